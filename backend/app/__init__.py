@@ -51,6 +51,28 @@ def create_app(config_name='default'):
     login_manager.init_app(app)
     limiter.init_app(app)
 
+    # Buffer write-behind, spool en disco, contador de page views y sketches de únicos
+    from app.services.analytics_buffer import analytics_buffer
+    from app.services.analytics_dimensions import dimension_cache
+    from app.services.analytics_spool import analytics_spool
+    from app.services.pageview_counter import pageview_counter
+    from app.services.visitor_sketches import visitor_sketches
+    from app.services.bot_filter import bot_filter
+    from app.services.analytics_dedupe import event_deduper
+    from app.services.live_stream import live_stream
+    from app.services.admin_cache import admin_cache
+    from app.services.lead_trigrams import lead_trigrams
+    analytics_buffer.init_app(app)
+    dimension_cache.init_app(app)
+    analytics_spool.init_app(app)
+    pageview_counter.init_app(app)
+    visitor_sketches.init_app(app)
+    bot_filter.init_app(app)
+    event_deduper.init_app(app)
+    live_stream.init_app(app)
+    admin_cache.init_app(app)
+    lead_trigrams.init_app(app)
+
     # CORS
     CORS(app, origins=app.config['CORS_ORIGINS'], supports_credentials=True)
 
@@ -121,6 +143,10 @@ def create_app(config_name='default'):
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(admin_bp, url_prefix='/admin')
 
+    # Comandos CLI (flask analytics ...)
+    from app.cli import analytics_cli
+    app.cli.add_command(analytics_cli)
+
     # User loader para Flask-Login
     from app.models.user import User
 
@@ -132,6 +158,18 @@ def create_app(config_name='default'):
     with app.app_context():
         try:
             db.create_all()
+            # url/referrer/user_agent como ids y columnas nuevas en analytics_events anteriores
+            from app.services.analytics_dimensions import classify_stored_user_agents, convert_legacy_columns
+            convert_legacy_columns()
+            # device_type/browser_family/os_family en leads y refresh_tokens anteriores
+            classify_stored_user_agents()
+            # estado/prioridad NOT NULL e índices de ordenación en bases anteriores
+            from app.models.lead import ensure_sort_columns
+            ensure_sort_columns()
+            # Índice de texto completo de leads en bases creadas antes de lead_search
+            from app.services.lead_search import ensure_search_index
+            app.extensions['lead_search'] = ensure_search_index()
+            lead_trigrams.setup()
             _create_default_admin(app)
         except Exception as e:
             app.logger.error(f"Database initialization error: {e}")
@@ -174,6 +212,18 @@ def create_app(config_name='default'):
         def serve_index():
             return send_from_directory(app.static_folder, 'index.html')
 
+        # Servir demos estáticos (carpetas con index.html propio)
+        @app.route('/demos/<path:subpath>')
+        def serve_demos(subpath):
+            # Si es un directorio, servir su index.html
+            demo_path = os.path.join(app.static_folder, 'demos', subpath)
+            if os.path.isdir(demo_path):
+                index_path = os.path.join(demo_path, 'index.html')
+                if os.path.exists(index_path):
+                    return send_from_directory(demo_path, 'index.html')
+            # Si es un archivo, servirlo directamente
+            return send_from_directory(os.path.join(app.static_folder, 'demos'), subpath)
+
         @app.errorhandler(404)
         def not_found(e):
             # Para SPA: devolver index.html para rutas no encontradas
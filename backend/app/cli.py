@@ -0,0 +1,158 @@
+"""
+CLI Commands - Tareas de mantenimiento (flask analytics ...)
+
+Pensadas para ejecutarse desde cron / Railway cron jobs:
+    flask --app run analytics rollup
+    flask --app run analytics sessionize
+    flask --app run analytics partitions   (también purga analytics_event_ids antiguos)
+    flask --app run analytics compact      (borra por lotes eventos crudos ya contados)
+    flask --app run analytics dimensions   (release del despliegue; create_app también lo hace al arrancar)
+    flask --app run analytics transitions  (una vez, leads creados antes de lead_transitions)
+    flask --app run analytics export --start 2026-01-01 --end 2026-02-01 -o enero.npz
+    flask --app run analytics serializer-bench   (filas/s de to_dict() frente a lead_serializer)
+    flask --app run analytics funnel-bench       (carga y cálculo del embudo sobre los eventos reales)
+"""
+
+import click
+from flask.cli import AppGroup
+
+analytics_cli = AppGroup('analytics', help='Tareas de mantenimiento de analytics')
+
+
+@analytics_cli.command('rollup')
+@click.option('--batch-size', type=int, default=None, help='Eventos por pasada')
+def rollup_command(batch_size):
+    """Actualiza los rollups horarios/diarios hasta ponerse al día"""
+    from app.services.analytics_rollup import update_rollups
+
+    total = 0
+    while True:
+        processed = update_rollups(batch_size=batch_size)
+        if not processed:
+            break
+        total += processed
+    click.echo(f'Rollups actualizados: {total} eventos procesados')
+
+
+@analytics_cli.command('sessionize')
+@click.option('--batch-size', type=int, default=None, help='Eventos por pasada')
+def sessionize_command(batch_size):
+    """Actualiza analytics_sessions hasta ponerse al día"""
+    from app.services.sessionizer import update_sessions
+
+    total = 0
+    while True:
+        processed = update_sessions(batch_size=batch_size)
+        if not processed:
+            break
+        total += processed
+    click.echo(f'Sesiones actualizadas: {total} eventos procesados')
+
+
+@analytics_cli.command('dimensions')
+def dimensions_command():
+    """
+    Convierte url/referrer/user_agent de tablas antiguas a ids de
+    analytics_dimensions y añade device_type/browser_family/os_family
+    """
+    from app.services.analytics_dimensions import classify_stored_user_agents, convert_legacy_columns
+
+    converted = convert_legacy_columns() + classify_stored_user_agents()
+    if converted:
+        click.echo(f"Tablas convertidas: {', '.join(converted)}")
+    else:
+        click.echo('Nada que convertir')
+
+
+@analytics_cli.command('transitions')
+def transitions_command():
+    """Crea el historial de estados mínimo de los leads que no tienen lead_transitions"""
+    from app.services.lead_pipeline import backfill_transitions
+
+    click.echo(f'Leads completados: {backfill_transitions()}')
+
+
+@analytics_cli.command('partitions')
+def partitions_command():
+    """Crea particiones mensuales, aplica la retención y purga ids de deduplicación antiguos"""
+    from app.services.analytics_dedupe import prune_event_ids
+    from app.services.analytics_partitions import maintain_partitions
+
+    report = maintain_partitions()
+    for table, result in report.items():
+        click.echo(
+            f"{table}: creadas={len(result['created'])} eliminadas={len(result['dropped'])}"
+            + (f" movidas={result['moved_rows']}" if 'moved_rows' in result else '')
+            + (' (convertida a particionada)' if result.get('converted') else '')
+        )
+    click.echo(f'analytics_event_ids: eliminados={prune_event_ids()}')
+
+
+@analytics_cli.command('compact')
+@click.option('--age-days', type=int, default=None, help='Antigüedad mínima de los eventos a borrar')
+@click.option('--batch-size', type=int, default=None, help='Eventos por lote')
+@click.option('--max-batches', type=int, default=None, help='Lotes como máximo en esta ejecución')
+@click.option('--archive-dir', type=click.Path(file_okay=False), default=None,
+              help='Directorio donde archivar cada lote (.npz) antes de borrarlo')
+def compact_command(age_days, batch_size, max_batches, archive_dir):
+    """Borra por lotes los eventos crudos antiguos (tras contarlos en los rollups)"""
+    from app.services.analytics_compaction import compact_events
+
+    report = compact_events(
+        age_days=age_days, batch_size=batch_size, max_batches=max_batches, archive_dir=archive_dir,
+    )
+    click.echo(
+        f"Compactados {report['rows']} eventos (~{report['bytes'] / 1024 / 1024:.1f} MB) "
+        f"en {report['batches']} lotes; checkpoint en id {report['last_id']}"
+    )
+    for path in report['archives']:
+        click.echo(f'Archivado: {path}')
+
+
+@analytics_cli.command('export')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Inicio (incluido)')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Fin (excluido)')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), required=True,
+              help='Fichero .npz de salida')
+@click.option('--chunk-rows', type=int, default=None, help='Filas por bloque')
+def export_command(start, end, output, chunk_rows):
+    """Exporta analytics_events de un rango a un fichero columnar .npz"""
+    from app.services.analytics_export import write_export
+
+    with open(output, 'wb') as f:
+        total = write_export(f, start, end, chunk_rows=chunk_rows)
+    click.echo(f'Exportados {total} eventos a {output}')
+
+
+@analytics_cli.command('serializer-bench')
+@click.option('--limit', type=int, default=100, help='Leads por página')
+@click.option('--repeat', type=int, default=20, help='Páginas serializadas con cada camino')
+def serializer_bench_command(limit, repeat):
+    """Compara filas/segundo de Lead.to_dict() y del serializador de listados con los leads de la base"""
+    from app.services.lead_serializer import benchmark
+
+    report = benchmark(limit=limit, repeat=repeat)
+    if not report['rows']:
+        click.echo('No hay leads que serializar')
+        return
+    click.echo(f"Filas serializadas: {report['rows']} (encoder {report['encoder']})")
+    click.echo(f"to_dict():        {report['to_dict_rows_per_second']} filas/s")
+    click.echo(f"lead_serializer:  {report['fast_rows_per_second']} filas/s (x{report['speedup']})")
+
+
+@analytics_cli.command('funnel-bench')
+@click.option('--steps', default=None, help='event_names separados por comas (por defecto los del dashboard)')
+@click.option('--days', type=int, default=30, help='Días hacia atrás')
+@click.option('--repeat', type=int, default=5, help='Pasadas (se informa la mejor)')
+def funnel_bench_command(steps, days, repeat):
+    """Mide la carga de eventos y el cálculo del embudo con los eventos de la base"""
+    from app.services.funnel import DEFAULT_STEPS, benchmark
+
+    steps = [s.strip() for s in steps.split(',') if s.strip()] if steps else DEFAULT_STEPS
+    report = benchmark(steps=steps, days=days, repeat=repeat)
+    if not report['events']:
+        click.echo('No hay eventos de esos pasos en el rango')
+        return
+    click.echo(f"Eventos: {report['events']}")
+    click.echo(f"Carga:   {report['load_ms']} ms")
+    click.echo(f"Cálculo: {report['compute_ms']} ms ({report['events_per_second']} eventos/s en total)")
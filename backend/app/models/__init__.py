@@ -3,9 +3,17 @@ Database Models
 """
 
 from app.models.user import User
-from app.models.lead import Lead
+from app.models.lead import Lead, LeadTransition
 from app.models.newsletter import NewsletterSubscriber
-from app.models.analytics import AnalyticsEvent
+from app.models.analytics import (
+    AnalyticsDimension, AnalyticsEvent, AnalyticsEventId, PageView, PageViewCount, AnalyticsRollupHourly,
+    AnalyticsRollupDaily, AnalyticsCheckpoint, AnalyticsSession, AnalyticsSketch, BotTrafficCount,
+    AnalyticsDeviceDaily,
+)
 from app.models.refresh_token import RefreshToken
 
-__all__ = ['User', 'Lead', 'NewsletterSubscriber', 'AnalyticsEvent', 'RefreshToken']
+__all__ = [
+    'User', 'Lead', 'LeadTransition', 'NewsletterSubscriber', 'AnalyticsDimension', 'AnalyticsEvent', 'AnalyticsEventId',
+    'PageView', 'PageViewCount', 'AnalyticsRollupHourly', 'AnalyticsRollupDaily', 'AnalyticsCheckpoint',
+    'AnalyticsSession', 'AnalyticsSketch', 'BotTrafficCount', 'AnalyticsDeviceDaily', 'RefreshToken',
+]
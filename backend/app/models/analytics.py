@@ -6,10 +6,42 @@ from datetime import datetime
 from app import db
 
 
+class AnalyticsDimension(db.Model):
+    """Valores de texto repetidos de analytics_events (url, referrer, user_agent)"""
+
+    __tablename__ = 'analytics_dimensions'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value', name='uq_analytics_dimensions_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.String(500), nullable=False)
+
+    def __repr__(self):
+        return f'<AnalyticsDimension {self.kind}={self.value[:40]}>'
+
+
+def _dimension_relationship(column):
+    # Sin FOREIGN KEY en la base de datos: las particiones se mueven/eliminan
+    # enteras y los valores del diccionario nunca se borran
+    return db.relationship(
+        AnalyticsDimension,
+        primaryjoin=lambda: db.foreign(getattr(AnalyticsEvent, column)) == AnalyticsDimension.id,
+        lazy='selectin',
+        viewonly=True,
+    )
+
+
 class AnalyticsEvent(db.Model):
     """Modelo para eventos de analytics"""
 
     __tablename__ = 'analytics_events'
+    __table_args__ = (
+        db.Index('ix_analytics_events_device', 'device_type', 'browser_family', 'os_family'),
+        # Ids monótonos aunque se vacíe la tabla (particiones en SQLite, high-water marks)
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -17,29 +49,54 @@ class AnalyticsEvent(db.Model):
     event_name = db.Column(db.String(100), nullable=False, index=True)
     event_data = db.Column(db.JSON, nullable=True)
 
-    # Contexto
-    url = db.Column(db.String(500), nullable=True)
-    referrer = db.Column(db.String(500), nullable=True)
+    # Contexto (ids de analytics_dimensions, ver analytics_dimensions.encode_rows)
+    url_id = db.Column(db.Integer, nullable=True)
+    referrer_id = db.Column(db.Integer, nullable=True)
 
     # Tracking
     session_id = db.Column(db.String(100), nullable=True, index=True)
     ip_address = db.Column(db.String(45), nullable=True)
-    user_agent = db.Column(db.String(500), nullable=True)
+    user_agent_id = db.Column(db.Integer, nullable=True)
+
+    # Derivados del User-Agent (ver services/user_agent.py)
+    device_type = db.Column(db.String(10), nullable=True)
+    browser_family = db.Column(db.String(30), nullable=True)
+    os_family = db.Column(db.String(20), nullable=True)
 
     # UTM
     utm_source = db.Column(db.String(100), nullable=True)
     utm_medium = db.Column(db.String(100), nullable=True)
     utm_campaign = db.Column(db.String(100), nullable=True)
 
+    # Eventos reales que representa la fila (N si se guarda 1 de cada N, ver analytics_sampling)
+    sample_weight = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
     # Timestamps
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    url_dimension = _dimension_relationship('url_id')
+    referrer_dimension = _dimension_relationship('referrer_id')
+    user_agent_dimension = _dimension_relationship('user_agent_id')
+
+    @property
+    def url(self):
+        return self.url_dimension.value if self.url_dimension else None
+
+    @property
+    def referrer(self):
+        return self.referrer_dimension.value if self.referrer_dimension else None
+
+    @property
+    def user_agent(self):
+        return self.user_agent_dimension.value if self.user_agent_dimension else None
+
     def to_dict(self):
         return {
             'id': self.id,
             'event_name': self.event_name,
             'event_data': self.event_data,
             'url': self.url,
+            'sample_weight': self.sample_weight,
             'timestamp': self.timestamp.isoformat(),
         }
 
@@ -47,10 +104,23 @@ class AnalyticsEvent(db.Model):
         return f'<AnalyticsEvent {self.event_name}>'
 
 
+class AnalyticsEventId(db.Model):
+    """Ids de evento generados por el cliente ya guardados (deduplicación, ver analytics_dedupe)"""
+
+    __tablename__ = 'analytics_event_ids'
+
+    client_event_id = db.Column(db.String(64), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<AnalyticsEventId {self.client_event_id}>'
+
+
 class PageView(db.Model):
     """Modelo para tracking de page views"""
 
     __tablename__ = 'page_views'
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
     path = db.Column(db.String(500), nullable=False, index=True)
@@ -62,3 +132,186 @@ class PageView(db.Model):
 
     def __repr__(self):
         return f'<PageView {self.path}>'
+
+
+class PageViewCount(db.Model):
+    """Page views por ruta y hora (deltas agregados en memoria por cada worker)"""
+
+    __tablename__ = 'page_view_counts'
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'path', name='uq_page_view_counts_key'),
+    )
+
+    KEY_COLUMNS = ('bucket', 'path')
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)
+    path = db.Column(db.String(500), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PageViewCount {self.bucket} {self.path}={self.count}>'
+
+
+class BotTrafficCount(db.Model):
+    """Tráfico descartado por el filtro de bots, por hora, tipo y motivo"""
+
+    __tablename__ = 'bot_traffic_counts'
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'kind', 'reason', name='uq_bot_traffic_counts_key'),
+    )
+
+    KEY_COLUMNS = ('bucket', 'kind', 'reason')
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)
+    kind = db.Column(db.String(10), nullable=False)  # event, pageview
+    reason = db.Column(db.String(20), nullable=False)  # user_agent, empty_user_agent, session_rate
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<BotTrafficCount {self.bucket} {self.kind}/{self.reason}={self.count}>'
+
+
+class AnalyticsSketch(db.Model):
+    """Sketch HyperLogLog de visitantes/sesiones únicos por día y dimensión"""
+
+    __tablename__ = 'analytics_sketches'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'metric', 'dimension', 'value', name='uq_analytics_sketches_key'),
+    )
+
+    KEY_COLUMNS = ('day', 'metric', 'dimension', 'value')
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    metric = db.Column(db.String(20), nullable=False)  # visitors, sessions
+    dimension = db.Column(db.String(20), nullable=False)  # all, event, path
+    value = db.Column(db.String(500), nullable=False, default='')
+    registers = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnalyticsSketch {self.day} {self.metric} {self.dimension}={self.value}>'
+
+
+class AnalyticsDeviceDaily(db.Model):
+    """Eventos por día, dispositivo, navegador y sistema operativo de los rangos ya compactados"""
+
+    __tablename__ = 'analytics_device_daily'
+    __table_args__ = (
+        db.UniqueConstraint(
+            'bucket', 'device_type', 'browser_family', 'os_family', name='uq_analytics_device_daily_key'
+        ),
+    )
+
+    KEY_COLUMNS = ('bucket', 'device_type', 'browser_family', 'os_family')
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)
+    # Cadena vacía en lugar de NULL para que la clave única funcione en el upsert
+    device_type = db.Column(db.String(10), nullable=False, default='')
+    browser_family = db.Column(db.String(30), nullable=False, default='')
+    os_family = db.Column(db.String(20), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsDeviceDaily {self.bucket} {self.device_type}/{self.browser_family}={self.count}>'
+
+
+class AnalyticsRollupMixin:
+    """Columnas comunes de las tablas de rollup (bucket × evento × UTM)"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)
+    event_name = db.Column(db.String(100), nullable=False)
+    # Cadena vacía en lugar de NULL para que la clave única funcione en el upsert
+    utm_source = db.Column(db.String(100), nullable=False, default='')
+    utm_medium = db.Column(db.String(100), nullable=False, default='')
+    utm_campaign = db.Column(db.String(100), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    KEY_COLUMNS = ('bucket', 'event_name', 'utm_source', 'utm_medium', 'utm_campaign')
+
+
+class AnalyticsRollupHourly(AnalyticsRollupMixin, db.Model):
+    """Conteo de eventos por hora"""
+
+    __tablename__ = 'analytics_rollup_hourly'
+    __table_args__ = (
+        db.UniqueConstraint(*AnalyticsRollupMixin.KEY_COLUMNS, name='uq_analytics_rollup_hourly_key'),
+    )
+
+    def __repr__(self):
+        return f'<AnalyticsRollupHourly {self.bucket} {self.event_name}={self.count}>'
+
+
+class AnalyticsRollupDaily(AnalyticsRollupMixin, db.Model):
+    """Conteo de eventos por día"""
+
+    __tablename__ = 'analytics_rollup_daily'
+    __table_args__ = (
+        db.UniqueConstraint(*AnalyticsRollupMixin.KEY_COLUMNS, name='uq_analytics_rollup_daily_key'),
+    )
+
+    def __repr__(self):
+        return f'<AnalyticsRollupDaily {self.bucket} {self.event_name}={self.count}>'
+
+
+class AnalyticsCheckpoint(db.Model):
+    """High-water mark (último AnalyticsEvent.id procesado) de cada job incremental"""
+
+    __tablename__ = 'analytics_checkpoints'
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnalyticsCheckpoint {self.name}={self.last_id}>'
+
+
+class AnalyticsSession(db.Model):
+    """Sesión de navegación reconstruida a partir de AnalyticsEvent (una fila por visita)"""
+
+    __tablename__ = 'analytics_sessions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # session_id del cliente; una misma session_id puede dar varias visitas
+    # si hay más de ANALYTICS_SESSION_GAP_MINUTES de inactividad entre eventos
+    session_key = db.Column(db.String(100), nullable=False, index=True)
+
+    first_seen = db.Column(db.DateTime, nullable=False, index=True)
+    last_seen = db.Column(db.DateTime, nullable=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+
+    landing_url = db.Column(db.String(500), nullable=True)
+    utm_source = db.Column(db.String(100), nullable=True)
+    utm_medium = db.Column(db.String(100), nullable=True)
+    utm_campaign = db.Column(db.String(100), nullable=True)
+
+    converted = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    converted_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def duration_seconds(self):
+        return int((self.last_seen - self.first_seen).total_seconds())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'session_id': self.session_key,
+            'first_seen': self.first_seen.isoformat(),
+            'last_seen': self.last_seen.isoformat(),
+            'duration_seconds': self.duration_seconds,
+            'event_count': self.event_count,
+            'landing_url': self.landing_url,
+            'utm_source': self.utm_source,
+            'utm_medium': self.utm_medium,
+            'utm_campaign': self.utm_campaign,
+            'converted': self.converted,
+            'converted_at': self.converted_at.isoformat() if self.converted_at else None,
+        }
+
+    def __repr__(self):
+        return f'<AnalyticsSession {self.session_key} events={self.event_count}>'
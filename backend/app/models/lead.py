@@ -3,6 +3,11 @@ Lead Model - Leads/Contactos del formulario
 """
 
 from datetime import datetime
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
 from app import db
 
 
@@ -21,6 +26,7 @@ class Lead(db.Model):
         ('perdido', 'Perdido'),
         ('descartado', 'Descartado'),
     ]
+    ESTADO_DISPLAY = dict(ESTADOS)
 
     # Fuentes de adquisición
     FUENTES = [
@@ -43,9 +49,14 @@ class Lead(db.Model):
     servicio_interes = db.Column(db.String(50), nullable=True)  # automatizacion, web, custom
 
     # Estado y seguimiento
-    estado = db.Column(db.String(20), default='nuevo', index=True)
+    # active_history: el valor anterior se carga al cambiarlo (lead_transitions.from_estado)
+    # NOT NULL: se ordenan por la columna tal cual (keyset en (columna, id), ver ensure_sort_columns)
+    estado = db.column_property(
+        db.Column(db.String(20), nullable=False, default='nuevo', server_default='nuevo'),
+        active_history=True,
+    )
     fuente = db.Column(db.String(20), default='landing')
-    prioridad = db.Column(db.Integer, default=0)  # 0=normal, 1=alta, 2=urgente
+    prioridad = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 0=normal, 1=alta, 2=urgente
 
     # Notas internas
     notas = db.Column(db.Text, nullable=True)
@@ -53,6 +64,9 @@ class Lead(db.Model):
     # Tracking
     ip_address = db.Column(db.String(45), nullable=True)
     user_agent = db.Column(db.String(500), nullable=True)
+    device_type = db.Column(db.String(10), nullable=True)
+    browser_family = db.Column(db.String(30), nullable=True)
+    os_family = db.Column(db.String(20), nullable=True)
     referrer = db.Column(db.String(500), nullable=True)
     utm_source = db.Column(db.String(100), nullable=True)
     utm_medium = db.Column(db.String(100), nullable=True)
@@ -63,17 +77,26 @@ class Lead(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     contacted_at = db.Column(db.DateTime, nullable=True)
 
+    # Índices de ordenación del listado (clave, id), que también sirven los filtros por estado;
+    # servicio_interes admite NULL y se ordena por coalesce
+    __table_args__ = (
+        db.Index('ix_leads_estado_id', 'estado', 'id'),
+        db.Index('ix_leads_prioridad_id', 'prioridad', 'id'),
+        db.Index('ix_leads_servicio_interes_id', db.func.coalesce(servicio_interes, ''), 'id'),
+    )
+
     # Relaciones
     assigned_to_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     assigned_to = db.relationship('User', backref='assigned_leads')
+    transitions = db.relationship(
+        'LeadTransition', backref='lead', lazy='dynamic', cascade='all, delete-orphan',
+        order_by='LeadTransition.at',
+    )
 
     @property
     def estado_display(self):
         """Retorna el nombre legible del estado"""
-        for code, name in self.ESTADOS:
-            if code == self.estado:
-                return name
-        return self.estado
+        return self.ESTADO_DISPLAY.get(self.estado, self.estado)
 
     @property
     def dias_desde_creacion(self):
@@ -83,12 +106,17 @@ class Lead(db.Model):
     @property
     def requiere_seguimiento(self):
         """True si el lead necesita seguimiento (nuevo o más de 2 días sin contacto)"""
-        if self.estado == 'nuevo':
+        return self.calcular_seguimiento(self.estado, self.contacted_at, datetime.utcnow())
+
+    @staticmethod
+    def calcular_seguimiento(estado, contacted_at, now):
+        """requiere_seguimiento a partir de los valores (también para filas sin objeto Lead)"""
+        if estado == 'nuevo':
             return True
-        if self.estado in ['contactado', 'en_proceso'] and not self.contacted_at:
+        if estado in ('contactado', 'en_proceso') and not contacted_at:
             return True
-        if self.contacted_at:
-            dias_sin_contacto = (datetime.utcnow() - self.contacted_at).days
+        if contacted_at:
+            dias_sin_contacto = (now - contacted_at).days
             return dias_sin_contacto > 2
         return False
 
@@ -124,6 +152,9 @@ class Lead(db.Model):
             data.update({
                 'ip_address': self.ip_address,
                 'user_agent': self.user_agent,
+                'device_type': self.device_type,
+                'browser_family': self.browser_family,
+                'os_family': self.os_family,
                 'referrer': self.referrer,
                 'utm_source': self.utm_source,
                 'utm_medium': self.utm_medium,
@@ -134,3 +165,79 @@ class Lead(db.Model):
 
     def __repr__(self):
         return f'<Lead {self.nombre} - {self.email}>'
+
+
+class LeadTransition(db.Model):
+    """Cambio de estado de un lead (solo inserciones; from_estado NULL = alta del lead)"""
+
+    __tablename__ = 'lead_transitions'
+    __table_args__ = (
+        db.Index('ix_lead_transitions_to_estado_at', 'to_estado', 'at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('leads.id'), nullable=False, index=True)
+    from_estado = db.Column(db.String(20), nullable=True)
+    to_estado = db.Column(db.String(20), nullable=False)
+    at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'from_estado': self.from_estado,
+            'to_estado': self.to_estado,
+            'at': self.at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f'<LeadTransition {self.lead_id} {self.from_estado}->{self.to_estado}>'
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_estado_transitions(session, flush_context, instances):
+    """
+    Añade una LeadTransition por cada alta de lead o cambio de estado, en
+    el mismo flush (y por tanto la misma transacción) que el cambio.
+    """
+    now = datetime.utcnow()
+    for lead in session.new:
+        if isinstance(lead, Lead):
+            lead.estado = lead.estado or 'nuevo'
+            session.add(LeadTransition(lead=lead, from_estado=None, to_estado=lead.estado,
+                                       at=lead.created_at or now))
+
+    for lead in session.dirty:
+        if not isinstance(lead, Lead):
+            continue
+        history = inspect(lead).attrs.estado.history
+        if not history.has_changes():
+            continue
+        previous = history.deleted[0] if history.deleted else None
+        if previous != lead.estado:
+            session.add(LeadTransition(lead=lead, from_estado=previous, to_estado=lead.estado, at=now))
+
+
+def ensure_sort_columns(conn=None):
+    """
+    Bases creadas cuando estado/prioridad admitían NULL: rellena los NULL
+    y crea los índices de ordenación, que create_all() no añade a una tabla
+    existente. En PostgreSQL además fija NOT NULL y el DEFAULT.
+    """
+    if conn is None:
+        with db.engine.begin() as conn:
+            return ensure_sort_columns(conn)
+
+    conn.execute(text("UPDATE leads SET estado = 'nuevo' WHERE estado IS NULL"))
+    conn.execute(text('UPDATE leads SET prioridad = 0 WHERE prioridad IS NULL'))
+    if conn.dialect.name == 'postgresql':
+        nullable = conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'leads' "
+            "AND column_name IN ('estado', 'prioridad') AND is_nullable = 'YES'"
+        )).first()
+        if nullable:
+            conn.execute(text(
+                "ALTER TABLE leads ALTER COLUMN estado SET DEFAULT 'nuevo', ALTER COLUMN estado SET NOT NULL, "
+                "ALTER COLUMN prioridad SET DEFAULT 0, ALTER COLUMN prioridad SET NOT NULL"
+            ))
+    for index in Lead.__table__.indexes:
+        # IF NOT EXISTS: checkfirst no ve los índices de expresión en SQLite
+        conn.execute(CreateIndex(index, if_not_exists=True))
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 import secrets
 
 from app import db
+from app.services.user_agent import user_agent_fields
 
 
 class RefreshToken(db.Model):
@@ -22,6 +23,9 @@ class RefreshToken(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     # Info del dispositivo/sesión
     user_agent = db.Column(db.String(500), nullable=True)
+    device_type = db.Column(db.String(10), nullable=True)
+    browser_family = db.Column(db.String(30), nullable=True)
+    os_family = db.Column(db.String(20), nullable=True)
     ip_address = db.Column(db.String(45), nullable=True)
 
     user = db.relationship('User', backref=db.backref('refresh_tokens', lazy='dynamic'))
@@ -37,7 +41,8 @@ class RefreshToken(db.Model):
             user_id=user_id,
             expires_at=expires_at,
             user_agent=user_agent[:500] if user_agent else None,
-            ip_address=ip_address
+            ip_address=ip_address,
+            **user_agent_fields(user_agent),
         )
         db.session.add(refresh_token)
         db.session.commit()
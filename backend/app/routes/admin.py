@@ -2,7 +2,8 @@
 Admin Routes - Panel de administración
 """
 
-from flask import Blueprint, request, jsonify
+import os
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import func
@@ -10,7 +11,29 @@ from sqlalchemy import func
 from app import db, limiter
 from app.models.lead import Lead
 from app.models.newsletter import NewsletterSubscriber
-from app.models.analytics import AnalyticsEvent, PageView
+from app.services.analytics_buffer import analytics_buffer
+from app.services.analytics_dimensions import dimension_cache
+from app.services.analytics_spool import analytics_spool
+from app.services.analytics_rollup import event_counts, refresh_rollups
+from app.services.analytics_compaction import device_counts
+from app.services.sessionizer import refresh_sessions, session_summary
+from app.services.pageview_counter import pageview_counter, popular_pages
+from app.services.visitor_sketches import visitor_sketches, unique_counts
+from app.services.analytics_export import stream_export
+from app.services.funnel import DEFAULT_STEPS, MAX_STEPS, funnel_report
+from app.services.user_agent import user_agent_cache_info
+from app.services.bot_filter import bot_filter, bot_summary
+from app.services.analytics_sampling import sampling_stats
+from app.services.analytics_dedupe import event_deduper
+from app.services.live_stream import live_stream
+from app.services.timeseries import time_series
+from app.services.lead_pipeline import pipeline_report
+from app.services.keyset_pagination import InvalidCursor, count_rows, keyset_page
+from app.services.lead_search import apply_search, snippets as search_snippets
+from app.services.lead_trigrams import fuzzy_search
+from app.services.lead_serializer import json_response, project, serialize_rows
+from app.services.dashboard_stats import get_stats as get_dashboard_stats
+from app.services.admin_cache import admin_cache, TOPIC_ANALYTICS
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -37,61 +60,12 @@ def admin_required(f):
 @limiter.limit("30 per minute")
 @admin_required
 def get_stats():
-    """Estadísticas del dashboard"""
+    """Estadísticas del dashboard (cacheadas por período hasta la próxima escritura, ver admin_cache)"""
 
     # Período (últimos 30 días por defecto)
     days = request.args.get('days', 30, type=int)
-    start_date = datetime.utcnow() - timedelta(days=days)
-
-    # Leads
-    leads_total = Lead.query.count()
-    leads_nuevos = Lead.query.filter(Lead.created_at >= start_date).count()
-    leads_pendientes = Lead.query.filter(Lead.estado == 'nuevo').count()
-
-    leads_por_estado = db.session.query(
-        Lead.estado,
-        func.count(Lead.id)
-    ).group_by(Lead.estado).all()
-
-    # Newsletter
-    suscriptores_total = NewsletterSubscriber.query.filter_by(is_active=True).count()
-    suscriptores_nuevos = NewsletterSubscriber.query.filter(
-        NewsletterSubscriber.created_at >= start_date,
-        NewsletterSubscriber.is_active == True
-    ).count()
-
-    # Analytics
-    eventos_total = AnalyticsEvent.query.filter(
-        AnalyticsEvent.timestamp >= start_date
-    ).count()
-
-    # Leads por día (últimos 7 días)
-    leads_por_dia = db.session.query(
-        func.date(Lead.created_at).label('fecha'),
-        func.count(Lead.id).label('total')
-    ).filter(
-        Lead.created_at >= datetime.utcnow() - timedelta(days=7)
-    ).group_by(
-        func.date(Lead.created_at)
-    ).order_by('fecha').all()
 
-    return jsonify({
-        'leads': {
-            'total': leads_total,
-            'nuevos_periodo': leads_nuevos,
-            'pendientes': leads_pendientes,
-            'por_estado': {estado: count for estado, count in leads_por_estado},
-            'por_dia': [{'fecha': str(fecha), 'total': total} for fecha, total in leads_por_dia],
-        },
-        'newsletter': {
-            'total_activos': suscriptores_total,
-            'nuevos_periodo': suscriptores_nuevos,
-        },
-        'analytics': {
-            'eventos_periodo': eventos_total,
-        },
-        'periodo_dias': days
-    })
+    return jsonify(get_dashboard_stats(days))
 
 
 # ============================================
@@ -101,12 +75,33 @@ def get_stats():
 # Columnas permitidas para ordenación (prevenir SQL injection)
 ALLOWED_ORDER_COLUMNS = {'created_at', 'nombre', 'email', 'estado', 'prioridad', 'servicio_interes'}
 
+# Clave de ordenación en modo cursor: sin NULL, que no se pueden comparar en (clave, id) > (...).
+# Cada una coincide con un índice (clave, id) de Lead; servicio_interes admite NULL y su índice es
+# sobre la misma expresión coalesce.
+KEYSET_SORT_KEYS = {
+    'created_at': Lead.created_at,
+    'nombre': Lead.nombre,
+    'email': Lead.email,
+    'estado': Lead.estado,
+    'prioridad': Lead.prioridad,
+    'servicio_interes': func.coalesce(Lead.servicio_interes, ''),
+}
+
+VALID_PRIORIDADES = {0, 1, 2}
+
 
 @admin_bp.route('/leads', methods=['GET'])
 @limiter.limit("60 per minute")
 @admin_required
 def list_leads():
-    """Listar todos los leads con filtros y paginación"""
+    """
+    Listar todos los leads con filtros y paginación.
+    Modo página (page/per_page, con total) o modo cursor: cursor= vacío
+    para la primera página y después los enlaces next/prev de la
+    respuesta; total=exact|estimate para incluir el total (por defecto no).
+    search usa el índice de texto completo (ver lead_search): sin order_by
+    explícito ordena por relevancia y cada lead lleva search_snippet.
+    """
 
     # Parámetros
     page = request.args.get('page', 1, type=int)
@@ -134,30 +129,29 @@ def list_leads():
         if estado in valid_estados:
             query = query.filter(Lead.estado == estado)
 
+    relevance = None
     if search:
         # Limitar longitud de búsqueda
         search = search[:100]
-        search_term = f"%{search}%"
-        query = query.filter(
-            db.or_(
-                Lead.nombre.ilike(search_term),
-                Lead.email.ilike(search_term),
-                Lead.proyecto.ilike(search_term)
-            )
-        )
+        query, relevance = apply_search(query, search)
+
+    if 'cursor' in request.args:
+        return _list_leads_keyset(query, order_by, order_dir, per_page, search)
 
-    # Ordenación (ya validado)
+    # Ordenación (ya validado); con búsqueda y sin order_by explícito, por relevancia
     order_column = getattr(Lead, order_by)
-    if order_dir == 'desc':
+    if relevance is not None and 'order_by' not in request.args:
+        query = query.order_by(relevance.desc(), Lead.id.desc())
+    elif order_dir == 'desc':
         query = query.order_by(order_column.desc())
     else:
         query = query.order_by(order_column.asc())
 
-    # Paginación
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Paginación (solo las columnas del listado, ver lead_serializer)
+    pagination = project(query).paginate(page=page, per_page=per_page, error_out=False)
 
-    return jsonify({
-        'leads': [lead.to_dict() for lead in pagination.items],
+    return json_response({
+        'leads': _lead_dicts(pagination.items, search),
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page,
@@ -167,6 +161,128 @@ def list_leads():
     })
 
 
+def _lead_dicts(rows, search):
+    """Dicts de listado de filas de project(), con search_snippet (fragmento resaltado) si hay búsqueda"""
+    items = serialize_rows(rows)
+    if search:
+        highlighted = search_snippets(search, [item['id'] for item in items])
+        for item in items:
+            item['search_snippet'] = highlighted.get(item['id'])
+    return items
+
+
+def _list_leads_keyset(query, order_by, order_dir, per_page, search):
+    """Página de leads por cursor firmado (sin OFFSET ni COUNT obligatorio)"""
+    total_mode = request.args.get('total')
+    try:
+        page = keyset_page(
+            project(query), KEYSET_SORT_KEYS[order_by], Lead.id, (order_by, order_dir), max(per_page, 1),
+            cursor=request.args.get('cursor') or None,
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        args = {key: value for key, value in request.args.items() if key != 'page'}
+        args['cursor'] = cursor
+        return url_for('admin.list_leads', **args)
+
+    response = {
+        'leads': _lead_dicts(page['items'], search),
+        'per_page': per_page,
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor'],
+        'next': link(page['next_cursor']),
+        'prev': link(page['prev_cursor']),
+        'has_next': page['next_cursor'] is not None,
+        'has_prev': page['prev_cursor'] is not None,
+    }
+    if total_mode in ('exact', 'estimate'):
+        response['total'] = count_rows(query, total_mode)
+        response['total_is_estimate'] = total_mode == 'estimate'
+    return json_response(response)
+
+
+@admin_bp.route('/leads/fuzzy', methods=['GET'])
+@limiter.limit("60 per minute")
+@admin_required
+def fuzzy_leads():
+    """
+    Búsqueda aproximada por nombre/email (tolera erratas y palabras a
+    medias), de más a menos parecido. Parámetros: q, threshold (0-1,
+    LEAD_FUZZY_THRESHOLD por defecto) y limit (máximo 100).
+    """
+    search = request.args.get('q', '').strip()[:100]
+    threshold = request.args.get('threshold', current_app.config.get('LEAD_FUZZY_THRESHOLD', 0.3), type=float)
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+    if not search:
+        return jsonify({'error': 'Falta el parámetro q'}), 400
+    if not 0 < threshold <= 1:
+        return jsonify({'error': 'threshold debe estar entre 0 y 1'}), 400
+
+    results = fuzzy_search(search, threshold, limit)
+    if results is None:
+        return jsonify({'error': 'Búsqueda aproximada no disponible (falta pg_trgm)'}), 503
+
+    leads = serialize_rows([row for row, _, _ in results])
+    for item, (_, score, similarity) in zip(leads, results):
+        item['score'] = round(score, 4)
+        item['similarity'] = round(similarity, 4)
+    return json_response({'leads': leads, 'threshold': threshold})
+
+
+@admin_bp.route('/leads/pipeline', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def lead_pipeline():
+    """
+    Conversión y velocidad del pipeline para los leads creados en la ventana.
+    Parámetros: start/end (YYYY-MM-DD, end exclusivo) o days (ventana de
+    días completos hasta hoy incluido), y from/to para medir entre dos estados.
+    """
+
+    try:
+        if request.args.get('start'):
+            start_date = datetime.strptime(request.args['start'], '%Y-%m-%d')
+            end_date = (
+                datetime.strptime(request.args['end'], '%Y-%m-%d')
+                if request.args.get('end') else None
+            )
+        else:
+            start_date = end_date = None
+    except ValueError:
+        return jsonify({'error': 'Fecha inválida (formato YYYY-MM-DD)'}), 400
+
+    # Ventana en días completos: la clave de cache no cambia en todo el día
+    if end_date is None:
+        end_date = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.min.time())
+    if start_date is None:
+        start_date = end_date - timedelta(days=request.args.get('days', 90, type=int))
+    if end_date <= start_date:
+        return jsonify({'error': 'El rango de fechas está vacío'}), 400
+
+    try:
+        report = pipeline_report(
+            start_date, end_date, from_estado=request.args.get('from'), to_estado=request.args.get('to'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(report)
+
+
+@admin_bp.route('/leads/<int:lead_id>/transitions', methods=['GET'])
+@limiter.limit("60 per minute")
+@admin_required
+def lead_transitions(lead_id):
+    """Historial de estados de un lead"""
+    lead = Lead.query.get_or_404(lead_id)
+    return jsonify({'transitions': [transition.to_dict() for transition in lead.transitions]})
+
+
 @admin_bp.route('/leads/<int:lead_id>', methods=['GET'])
 @limiter.limit("60 per minute")
 @admin_required
@@ -193,6 +309,9 @@ def update_lead(lead_id):
         if data['estado'] not in valid_estados:
             return jsonify({'error': f'Estado inválido. Valores permitidos: {", ".join(valid_estados)}'}), 400
 
+    if 'prioridad' in data and data['prioridad'] not in VALID_PRIORIDADES:
+        return jsonify({'error': 'Prioridad inválida. Valores permitidos: 0, 1, 2'}), 400
+
     # Campos actualizables
     allowed_fields = ['estado', 'prioridad', 'notas', 'servicio_interes']
 
@@ -261,6 +380,9 @@ def bulk_update_leads():
         if safe_updates['estado'] not in valid_estados:
             return jsonify({'error': f'Estado inválido. Valores permitidos: {", ".join(valid_estados)}'}), 400
 
+    if 'prioridad' in safe_updates and safe_updates['prioridad'] not in VALID_PRIORIDADES:
+        return jsonify({'error': 'Prioridad inválida. Valores permitidos: 0, 1, 2'}), 400
+
     leads = Lead.query.filter(Lead.id.in_(lead_ids)).all()
 
     for lead in leads:
@@ -332,22 +454,269 @@ def list_events():
     days = request.args.get('days', 7, type=int)
     event_name = request.args.get('event')
 
+    def count_events():
+        # Agrupar por evento (desde rollups + filas crudas del bucket abierto)
+        start_date = datetime.utcnow() - timedelta(days=days)
+        return event_counts(start_date, event_name=event_name)
+
+    refresh_rollups()
+    events_grouped = admin_cache.get(('events', days, event_name), (TOPIC_ANALYTICS,), count_events)
+
+    return jsonify({
+        'events_by_type': events_grouped,
+        'periodo_dias': days
+    })
+
+
+@admin_bp.route('/analytics/sessions', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def list_sessions():
+    """Resumen de visitas (una fila por sesión en analytics_sessions)"""
+
+    days = request.args.get('days', 7, type=int)
     start_date = datetime.utcnow() - timedelta(days=days)
 
-    query = AnalyticsEvent.query.filter(AnalyticsEvent.timestamp >= start_date)
+    refresh_sessions()
+    summary = session_summary(start_date)
+    summary['periodo_dias'] = days
+
+    return jsonify(summary)
+
+
+@admin_bp.route('/analytics/pages', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def list_popular_pages():
+    """Páginas más vistas (desde page_view_counts)"""
+
+    days = request.args.get('days', 7, type=int)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    start_date = datetime.utcnow() - timedelta(days=days)
+
+    pageview_counter.flush_pending()
+
+    return jsonify({
+        'pages': popular_pages(start_date, limit=limit),
+        'periodo_dias': days
+    })
+
+
+@admin_bp.route('/analytics/unique', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def unique_visitors():
+    """
+    Visitantes y sesiones únicos (HyperLogLog, error estándar ≈ 1.6 %).
+    Filtros opcionales: event=<event_name> o path=</ruta>.
+    """
+
+    days = request.args.get('days', 30, type=int)
+    event_name = request.args.get('event')
+    path = request.args.get('path')
+
+    end_day = datetime.utcnow().date()
+    start_day = end_day - timedelta(days=max(days, 1) - 1)
 
     if event_name:
-        query = query.filter(AnalyticsEvent.event_name == event_name)
+        dimension, value = 'event', event_name
+    elif path:
+        dimension, value = 'path', path
+    else:
+        dimension, value = 'all', ''
+
+    visitor_sketches.flush_pending()
+
+    result = unique_counts(start_day, end_day, dimension=dimension, value=value)
+    result['periodo_dias'] = days
+
+    return jsonify(result)
+
+
+@admin_bp.route('/analytics/devices', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def device_breakdown():
+    """Eventos por tipo de dispositivo, navegador y sistema operativo"""
+
+    days = request.args.get('days', 7, type=int)
+    start_date = datetime.utcnow() - timedelta(days=days)
 
-    # Agrupar por evento
-    events_grouped = db.session.query(
-        AnalyticsEvent.event_name,
-        func.count(AnalyticsEvent.id)
-    ).filter(
-        AnalyticsEvent.timestamp >= start_date
-    ).group_by(AnalyticsEvent.event_name).all()
+    by_device, by_browser, by_os = {}, {}, {}
+    for device, browser, os_family, count in device_counts(start_date):
+        by_device[device or 'other'] = by_device.get(device or 'other', 0) + count
+        by_browser[browser or 'Other'] = by_browser.get(browser or 'Other', 0) + count
+        by_os[os_family or 'Other'] = by_os.get(os_family or 'Other', 0) + count
 
     return jsonify({
-        'events_by_type': {name: count for name, count in events_grouped},
+        'by_device': by_device,
+        'by_browser': by_browser,
+        'by_os': by_os,
         'periodo_dias': days
     })
+
+
+@admin_bp.route('/analytics/bots', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def bot_traffic():
+    """Tráfico de bots descartado en la ingesta, por motivo y tipo"""
+
+    days = request.args.get('days', 7, type=int)
+    start_date = datetime.utcnow() - timedelta(days=days)
+
+    bot_filter.flush_pending()
+
+    return jsonify({
+        **bot_summary(start_date),
+        'periodo_dias': days
+    })
+
+
+@admin_bp.route('/analytics/funnel', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def funnel():
+    """
+    Embudo de conversión por sesión.
+    Parámetros: steps (event_names separados por comas, en orden) y days.
+    """
+
+    days = request.args.get('days', 30, type=int)
+    steps_param = request.args.get('steps')
+    steps = [s.strip() for s in steps_param.split(',') if s.strip()] if steps_param else list(DEFAULT_STEPS)
+
+    if not 2 <= len(steps) <= MAX_STEPS:
+        return jsonify({'error': f'Se requieren entre 2 y {MAX_STEPS} pasos'}), 400
+    if len(set(steps)) != len(steps):
+        return jsonify({'error': 'Los pasos no pueden repetirse'}), 400
+
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=days)
+
+    result = funnel_report(steps, start_date, end_date)
+    result['periodo_dias'] = days
+
+    return jsonify(result)
+
+
+@admin_bp.route('/analytics/timeseries', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def timeseries():
+    """
+    Serie temporal con huecos a 0.
+    Parámetros: metric (leads, leads_by_estado, subscribers, events_by_name),
+    granularity (hour, day, week, month), start/end (ISO, end exclusivo) o
+    days, cumulative=true y rolling=<buckets> para la media móvil.
+    """
+
+    metric = request.args.get('metric', 'leads')
+    granularity = request.args.get('granularity', 'day')
+    rolling = request.args.get('rolling', type=int)
+    cumulative_totals = request.args.get('cumulative', 'false') == 'true'
+
+    try:
+        end_date = (
+            datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+        )
+        if request.args.get('start'):
+            start_date = datetime.fromisoformat(request.args['start'])
+        else:
+            start_date = end_date - timedelta(days=request.args.get('days', 30, type=int))
+    except ValueError:
+        return jsonify({'error': 'Fecha inválida (formato ISO, p. ej. YYYY-MM-DD)'}), 400
+
+    try:
+        result = time_series(
+            metric, granularity, start_date, end_date,
+            cumulative_totals=cumulative_totals, rolling=rolling,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(result)
+
+
+@admin_bp.route('/analytics/export', methods=['GET'])
+@limiter.limit("5 per minute")
+@admin_required
+def export_events():
+    """
+    Exportar eventos en formato columnar (.npz, se lee con numpy.load o
+    app.services.analytics_export.load_export).
+    Parámetros: start/end (YYYY-MM-DD, end exclusivo) o days.
+    """
+
+    try:
+        if request.args.get('start'):
+            start_date = datetime.strptime(request.args['start'], '%Y-%m-%d')
+            end_date = (
+                datetime.strptime(request.args['end'], '%Y-%m-%d')
+                if request.args.get('end') else datetime.utcnow()
+            )
+        else:
+            days = request.args.get('days', 7, type=int)
+            end_date = datetime.utcnow()
+            start_date = end_date - timedelta(days=days)
+    except ValueError:
+        return jsonify({'error': 'Fecha inválida (formato YYYY-MM-DD)'}), 400
+
+    if end_date <= start_date:
+        return jsonify({'error': 'El rango de fechas está vacío'}), 400
+
+    filename = f'analytics_events_{start_date:%Y%m%d}_{end_date:%Y%m%d}.npz'
+    return Response(
+        stream_with_context(stream_export(start_date, end_date)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
+@admin_bp.route('/analytics/live', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def live_analytics():
+    """
+    Contadores en vivo por Server-Sent Events (eventos por minuto y nombre,
+    leads y suscriptores nuevos) desde el ring buffer en memoria.
+    Query: seconds (duración del stream, como mucho LIVE_STREAM_MAX_SECONDS)
+    """
+    seconds = request.args.get('seconds', type=int)
+    if seconds is not None:
+        seconds = max(seconds, 0)
+
+    # La plaza se reserva aquí (con lock); se libera al terminar o cortarse el stream
+    messages = live_stream.stream(seconds)
+    if messages is None:
+        return jsonify({'error': 'Demasiadas conexiones en vivo'}), 503
+
+    # El stream no usa la base de datos: devolver ya la conexión del login al pool
+    db.session.remove()
+
+    return Response(
+        messages,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@admin_bp.route('/analytics/ingestion', methods=['GET'])
+@limiter.limit("30 per minute")
+@admin_required
+def ingestion_stats():
+    """Métricas de la ingesta de analytics de este worker"""
+    return jsonify({
+        'buffer': analytics_buffer.stats(),
+        'spool': analytics_spool.stats(),
+        'pageviews': pageview_counter.stats(),
+        'sketches': visitor_sketches.stats(),
+        'dimensions': dimension_cache.stats(),
+        'user_agents': user_agent_cache_info(),
+        'bots': bot_filter.stats(),
+        'sampling': sampling_stats(),
+        'dedupe': event_deduper.stats(),
+        'live': live_stream.stats(),
+        'admin_cache': admin_cache.stats(),
+        'pid': os.getpid(),
+    })
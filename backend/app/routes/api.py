@@ -10,8 +10,14 @@ import bleach
 from app import db, limiter
 from app.models.lead import Lead
 from app.models.newsletter import NewsletterSubscriber
-from app.models.analytics import AnalyticsEvent
 from app.services.email_service import send_lead_notification, send_lead_confirmation
+from app.services.analytics_service import persist_events
+from app.services.pageview_counter import pageview_counter
+from app.services.visitor_sketches import visitor_sketches
+from app.services.user_agent import user_agent_fields
+from app.services.bot_filter import bot_filter
+from app.services.analytics_dedupe import valid_event_id
+from app.services.live_stream import live_stream
 
 api_bp = Blueprint('api', __name__)
 
@@ -84,6 +90,7 @@ def submit_contact():
         fuente='landing',
         ip_address=ip_address,
         user_agent=user_agent,
+        **user_agent_fields(user_agent),
         referrer=referrer,
         utm_source=sanitize_html(data.get('utm_source'), max_length=100),
         utm_medium=sanitize_html(data.get('utm_medium'), max_length=100),
@@ -92,6 +99,7 @@ def submit_contact():
 
     db.session.add(lead)
     db.session.commit()
+    live_stream.record_lead()
     current_app.logger.info(f"Lead saved: {lead.id}")
 
     # Enviar notificaciones por email
@@ -142,6 +150,7 @@ def subscribe_newsletter():
             existing.is_active = True
             existing.unsubscribed_at = None
             db.session.commit()
+            live_stream.record_subscriber()
             return jsonify({'success': True, 'message': 'Suscripción reactivada'}), 200
 
     # Crear nueva suscripción (con sanitización HTML)
@@ -154,6 +163,7 @@ def subscribe_newsletter():
 
     db.session.add(subscriber)
     db.session.commit()
+    live_stream.record_subscriber()
 
     return jsonify({
         'success': True,
@@ -179,15 +189,44 @@ def unsubscribe_newsletter():
 # ANALYTICS
 # ============================================
 
-@api_bp.route('/analytics/event', methods=['POST'])
-@limiter.limit("60 per minute")
-def track_event():
-    """Registra un evento de analytics"""
-    data = request.get_json()
+# Límites del endpoint batch
+MAX_BATCH_EVENTS = 50
+MAX_BATCH_BYTES = 64 * 1024  # 64 KB
+
+# Campos de texto opcionales de un evento (null o string; otro tipo rechaza el evento)
+EVENT_STRING_FIELDS = ('url', 'referrer', 'session_id', 'utm_source', 'utm_medium', 'utm_campaign')
+PAGEVIEW_STRING_FIELDS = ('referrer', 'session_id')
+
+
+def _invalid_string_field(data, fields):
+    """Primer campo de fields presente en data que no es string ni null"""
+    for field in fields:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            return field
+    return None
+
+
+def _build_event_row(data):
+    """
+    Valida y sanitiza un evento recibido del frontend.
+    Retorna (row, error): row es un dict con las columnas de analytics_events.
+    """
+    if not isinstance(data, dict):
+        return None, 'Event must be an object'
 
     event_name = data.get('event')
-    if not event_name:
-        return jsonify({'error': 'Event name required'}), 400
+    if not event_name or not isinstance(event_name, str):
+        return None, 'Event name required'
+
+    # Id generado por el cliente (se repite en los reintentos, ver analytics_dedupe)
+    event_id = data.get('event_id')
+    if event_id is not None and not valid_event_id(event_id):
+        return None, 'Invalid event id'
+
+    invalid = _invalid_string_field(data, EVENT_STRING_FIELDS)
+    if invalid:
+        return None, f'Invalid {invalid}'
 
     # Sanitizar event_data si es un dict (solo valores string)
     event_data = data.get('data')
@@ -197,23 +236,129 @@ def track_event():
             for k, v in event_data.items()
         }
 
-    event = AnalyticsEvent(
-        event_name=sanitize_html(event_name, max_length=100),
-        event_data=event_data,
-        url=sanitize_html(data.get('url', ''), max_length=500),
-        referrer=sanitize_html(data.get('referrer', ''), max_length=500),
-        session_id=sanitize_html(data.get('session_id'), max_length=100),
-        ip_address=request.headers.get('X-Forwarded-For', request.remote_addr),
-        user_agent=request.headers.get('User-Agent', '')[:500],
-        utm_source=sanitize_html(data.get('utm_source'), max_length=100),
-        utm_medium=sanitize_html(data.get('utm_medium'), max_length=100),
-        utm_campaign=sanitize_html(data.get('utm_campaign'), max_length=100),
-    )
+    user_agent = request.headers.get('User-Agent', '')[:500]
+    row = {
+        'event_name': sanitize_html(event_name, max_length=100),
+        'event_data': event_data,
+        'url': sanitize_html(data.get('url', ''), max_length=500),
+        'referrer': sanitize_html(data.get('referrer', ''), max_length=500),
+        'session_id': sanitize_html(data.get('session_id'), max_length=100),
+        'ip_address': request.headers.get('X-Forwarded-For', request.remote_addr),
+        'user_agent': user_agent,
+        'utm_source': sanitize_html(data.get('utm_source'), max_length=100),
+        'utm_medium': sanitize_html(data.get('utm_medium'), max_length=100),
+        'utm_campaign': sanitize_html(data.get('utm_campaign'), max_length=100),
+        'sample_weight': 1,
+        'client_event_id': event_id,
+        'timestamp': datetime.utcnow(),
+        **user_agent_fields(user_agent),
+    }
+
+    if not row['event_name']:
+        return None, 'Event name required'
+
+    return row, None
 
-    db.session.add(event)
-    db.session.commit()
 
-    return jsonify({'success': True}), 201
+@api_bp.route('/analytics/event', methods=['POST'])
+@limiter.limit("60 per minute")
+def track_event():
+    """Registra un evento de analytics"""
+    data = request.get_json()
+
+    row, error = _build_event_row(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # Los bots reciben la misma respuesta, pero el evento solo se cuenta
+    if not bot_filter.filter_rows([row], 'event'):
+        return jsonify({'success': True}), 202
+
+    # Con buffer/spool activos se responde 202 sin tocar la base de datos
+    stored = persist_events([row])
+
+    return jsonify({'success': True}), 201 if stored else 202
+
+
+@api_bp.route('/analytics/batch', methods=['POST'])
+@limiter.limit("30 per minute")
+def track_events_batch():
+    """
+    Registra varios eventos de analytics en una sola petición.
+    Body: {"events": [{...}, ...]} con el mismo formato que /analytics/event.
+    Los eventos válidos se insertan en una única transacción; la respuesta
+    indica por índice qué eventos se aceptaron y cuáles se rechazaron.
+    """
+    if request.content_length and request.content_length > MAX_BATCH_BYTES:
+        return jsonify({'error': f'Batch demasiado grande (máximo {MAX_BATCH_BYTES} bytes)'}), 413
+
+    data = request.get_json(silent=True) or {}
+    events = data.get('events') if isinstance(data, dict) else None
+
+    if not isinstance(events, list) or not events:
+        return jsonify({'error': 'Se requiere una lista de eventos'}), 400
+
+    if len(events) > MAX_BATCH_EVENTS:
+        return jsonify({'error': f'Máximo {MAX_BATCH_EVENTS} eventos por batch'}), 400
+
+    rows = []
+    results = []
+    for index, event in enumerate(events):
+        row, error = _build_event_row(event)
+        if error:
+            results.append({'index': index, 'accepted': False, 'error': error})
+        else:
+            rows.append(row)
+            results.append({'index': index, 'accepted': True})
+
+    accepted = len(rows)
+    stored = persist_events(bot_filter.filter_rows(rows, 'event'))
+
+    return jsonify({
+        'success': True,
+        'accepted': accepted,
+        'rejected': len(events) - accepted,
+        'results': results,
+    }), 201 if stored else 202
+
+
+@api_bp.route('/analytics/pageview', methods=['POST'])
+@limiter.limit("60 per minute")
+def track_pageview():
+    """
+    Registra una page view. Se cuenta en memoria por ruta y hora; solo una
+    muestra (PAGEVIEW_SAMPLE_RATE) se guarda como fila en page_views.
+    """
+    data = request.get_json(silent=True) or {}
+    path = data.get('path') if isinstance(data, dict) else None
+
+    if not path or not isinstance(path, str) or not path.startswith('/'):
+        return jsonify({'error': 'Path required'}), 400
+
+    invalid = _invalid_string_field(data, PAGEVIEW_STRING_FIELDS)
+    if invalid:
+        return jsonify({'error': f'Invalid {invalid}'}), 400
+
+    # Sin query string ni fragmento: una fila por página, no por URL
+    path = sanitize_html(path.split('?', 1)[0].split('#', 1)[0], max_length=500)
+    if not path:
+        return jsonify({'error': 'Path required'}), 400
+
+    row = {
+        'path': path,
+        'referrer': sanitize_html(data.get('referrer', ''), max_length=500),
+        'session_id': sanitize_html(data.get('session_id'), max_length=100),
+        'ip_address': request.headers.get('X-Forwarded-For', request.remote_addr),
+        'user_agent': request.headers.get('User-Agent', '')[:500],
+        'timestamp': datetime.utcnow(),
+    }
+    if not bot_filter.filter_rows([row], 'pageview'):
+        return jsonify({'success': True}), 202
+
+    visitor_sketches.add_pageview(row)
+    stored = pageview_counter.record(row)
+
+    return jsonify({'success': True}), 201 if stored else 202
 
 
 # ============================================
@@ -0,0 +1,319 @@
+"""
+Admin Cache - Cache de agregados del admin invalidada por escrituras
+
+Cada valor cacheado (stats del dashboard, conteos de eventos) declara de
+qué temas depende: 'leads', 'newsletter' o 'analytics'. Cada tema tiene
+un contador de generación compartido por todos los workers. Un valor
+sigue vigente mientras las generaciones de sus temas no cambien, así que
+no hace falta un TTL corto: el número se recalcula justo cuando hay algo
+nuevo que contar.
+
+Las generaciones suben en las escrituras:
+  - leads y newsletter (ORM): after_flush anota en session.info qué tablas
+    vigiladas cambiaron (objetos new/dirty/deleted) y do_orm_execute hace
+    lo mismo con las sentencias INSERT/UPDATE/DELETE ejecutadas con
+    db.session. after_commit sube la generación de esos temas;
+    after_rollback las descarta.
+  - analytics: solo update_rollups(), cuando procesa eventos nuevos. La
+    ingesta no toca la generación (subirla en cada evento invalidaría la
+    cache en cada request); los valores de analytics se ponen al día con
+    refresh_rollups() antes de leer la cache.
+
+Almacén de generaciones:
+  - REDIS_URL definido: INCR/MGET en Redis (sin el paquete redis la app no
+    arranca, en lugar de caer en silencio a un almacén por máquina).
+  - Si no: un fichero SQLite (ADMIN_CACHE_DB, por defecto
+    instance/admin_cache.sqlite3) en modo WAL, compartido por los workers
+    de la máquina.
+  - ADMIN_CACHE_SHARED=false (tests): contadores en memoria del proceso.
+
+ADMIN_CACHE_MAX_AGE_SECONDS acota la edad de un valor aunque no haya
+escrituras (las ventanas "últimos N días" se desplazan con el reloj).
+El recálculo es single-flight por clave: los requests que llegan mientras
+otro calcula esperan a ese resultado.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.lead import Lead
+from app.models.newsletter import NewsletterSubscriber
+
+TOPIC_LEADS = 'leads'
+TOPIC_NEWSLETTER = 'newsletter'
+TOPIC_ANALYTICS = 'analytics'
+
+TABLE_TOPICS = {
+    Lead.__tablename__: TOPIC_LEADS,
+    NewsletterSubscriber.__tablename__: TOPIC_NEWSLETTER,
+}
+
+_SESSION_KEY = 'admin_cache_topics'
+
+
+# ============================================
+# ALMACENES DE GENERACIONES
+# ============================================
+
+class LocalGenerations:
+    """Generaciones en memoria (un solo proceso)"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def read(self, topics):
+        return tuple(self._values[topic] for topic in topics)
+
+    def bump(self, topics):
+        with self._lock:
+            for topic in topics:
+                self._values[topic] += 1
+
+
+class SQLiteGenerations:
+    """Generaciones en un fichero SQLite compartido por los workers de la máquina"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = None
+
+    def _conn(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Las conexiones sqlite3 no sobreviven a un fork
+            self._pid = pid
+            self._local = threading.local()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS generations (topic TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def read(self, topics):
+        values = dict(self._conn().execute('SELECT topic, value FROM generations').fetchall())
+        return tuple(values.get(topic, 0) for topic in topics)
+
+    def bump(self, topics):
+        self._conn().executemany(
+            'INSERT INTO generations (topic, value) VALUES (?, 1) '
+            'ON CONFLICT(topic) DO UPDATE SET value = value + 1',
+            [(topic,) for topic in topics],
+        )
+
+
+class RedisGenerations:
+    """Generaciones en Redis (workers en varias máquinas)"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='admin_cache:generation:'):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def read(self, topics):
+        values = self._client.mget([f'{self.prefix}{topic}' for topic in topics])
+        return tuple(int(value or 0) for value in values)
+
+    def bump(self, topics):
+        pipe = self._client.pipeline(transaction=False)
+        for topic in topics:
+            pipe.incr(f'{self.prefix}{topic}')
+        pipe.execute()
+
+
+def _generation_store(app):
+    if not app.config.get('ADMIN_CACHE_SHARED', True):
+        return LocalGenerations()
+    redis_url = app.config.get('REDIS_URL')
+    if redis_url:
+        try:
+            return RedisGenerations(redis_url)
+        except ImportError as e:
+            raise RuntimeError('REDIS_URL is set but the redis package is not installed') from e
+    path = app.config.get('ADMIN_CACHE_DB') or os.path.join(app.instance_path, 'admin_cache.sqlite3')
+    return SQLiteGenerations(path)
+
+
+# ============================================
+# CACHE
+# ============================================
+
+class AdminCache:
+    """Valores del admin cacheados por clave y vigentes mientras no cambien sus temas"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._generations = LocalGenerations()
+        self.max_age = 300
+        self.max_keys = 128
+        self._stats = Counter()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el almacén de generaciones y registra los hooks de SQLAlchemy"""
+        self._app = app
+        self.max_age = app.config.get('ADMIN_CACHE_MAX_AGE_SECONDS', 300)
+        self.max_keys = app.config.get('ADMIN_CACHE_MAX_KEYS', 128)
+        self._generations = _generation_store(app)
+        self.clear()
+        _register_session_hooks()
+        app.extensions['admin_cache'] = self
+
+    def _check_fork(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._lock = threading.Lock()
+            self._key_locks = {}
+
+    def _read_generations(self, topics):
+        try:
+            return self._generations.read(topics)
+        except Exception as e:
+            # Sin almacén no se puede saber si el valor sigue vigente
+            self._stats['store_errors'] += 1
+            if self._app is not None:
+                self._app.logger.error(f"Admin cache generation read failed: {e}")
+            return None
+
+    def _fresh(self, key, generations, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == generations and entry[1] > now:
+            return entry
+        return None
+
+    def get(self, key, topics, compute):
+        """Valor de key: el cacheado si sus temas no han cambiado, si no compute()"""
+        self._check_fork()
+        if self.max_age <= 0:
+            return compute()
+
+        topics = tuple(topics)
+        generations = self._read_generations(topics)
+        if generations is None:
+            return compute()
+
+        entry = self._fresh(key, generations, time.monotonic())
+        if entry is not None:
+            self._stats['hits'] += 1
+            return entry[2]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Quien esperaba encuentra el valor que acaba de calcular otro thread
+            entry = self._fresh(key, generations, time.monotonic())
+            if entry is not None:
+                self._stats['waits'] += 1
+                return entry[2]
+
+            self._stats['misses'] += 1
+            # Generaciones leídas antes de calcular: una escritura concurrente deja el valor obsoleto
+            value = compute()
+            with self._lock:
+                self._entries[key] = (generations, time.monotonic() + self.max_age, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_keys:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+            return value
+
+    def invalidate(self, *topics):
+        """Sube la generación de topics en todos los workers"""
+        if not topics:
+            return
+        self._stats['invalidations'] += 1
+        try:
+            self._generations.bump(topics)
+        except Exception as e:
+            # Al menos este worker deja de servir valores viejos
+            self._stats['store_errors'] += 1
+            self.clear()
+            if self._app is not None:
+                self._app.logger.error(f"Admin cache invalidation failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            **self._stats,
+            'store': self._generations.name,
+            'keys': len(self._entries),
+            'max_age_seconds': self.max_age,
+        }
+
+
+admin_cache = AdminCache()
+
+
+# ============================================
+# HOOKS DE SQLALCHEMY
+# ============================================
+
+def _mark(session, table_name):
+    topic = TABLE_TOPICS.get(table_name)
+    if topic is not None:
+        session.info.setdefault(_SESSION_KEY, set()).add(topic)
+
+
+def _after_flush(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        _mark(session, getattr(obj, '__tablename__', None))
+
+
+def _do_orm_execute(orm_execute_state):
+    statement = orm_execute_state.statement
+    if getattr(statement, 'is_dml', False):
+        _mark(orm_execute_state.session, getattr(statement.table, 'name', None))
+
+
+def _after_commit(session):
+    topics = session.info.pop(_SESSION_KEY, None)
+    if topics:
+        admin_cache.invalidate(*sorted(topics))
+
+
+def _after_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'do_orm_execute', _do_orm_execute)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _hooks_registered = True
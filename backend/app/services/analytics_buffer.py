@@ -0,0 +1,170 @@
+"""
+Analytics Write Buffer - Cola write-behind para AnalyticsEvent
+
+Los endpoints de ingesta encolan filas en memoria y responden 202 sin tocar
+la base de datos. Un hilo por worker vacía la cola con un único
+executemany cuando se alcanzan ANALYTICS_BUFFER_MAX_ROWS filas o cuando
+pasan ANALYTICS_BUFFER_FLUSH_MS milisegundos. Al salir el worker
+(gunicorn worker_exit / atexit) se hace un último flush.
+
+Si la base de datos falla o va lenta, el flush desvía las filas al spool
+en disco (ver analytics_spool). Los eventos que aún no se han volcado se
+pierden si el proceso muere de forma abrupta (SIGKILL/OOM); es un
+compromiso aceptable para analytics.
+"""
+
+import time
+from collections import deque
+
+from app import db
+from app.models.analytics import AnalyticsEvent
+from app.services.analytics_dedupe import claim_event_ids
+from app.services.analytics_dimensions import dimension_cache
+from app.services.analytics_spool import analytics_spool
+from app.services.periodic_flusher import PeriodicFlusher
+
+
+class AnalyticsWriteBuffer(PeriodicFlusher):
+    """Buffer en memoria con flush por tamaño o por tiempo"""
+
+    thread_name = 'analytics-buffer'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._rows = deque()
+
+        self.max_rows = 200
+        self.flush_interval = 1.0
+        self.max_queue = 10000
+
+        self._reset_stats()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el buffer a partir de la config de la app"""
+        self.max_rows = app.config.get('ANALYTICS_BUFFER_MAX_ROWS', 200)
+        self.flush_interval = app.config.get('ANALYTICS_BUFFER_FLUSH_MS', 1000) / 1000.0
+        self.max_queue = app.config.get('ANALYTICS_BUFFER_MAX_QUEUE', 10000)
+
+        self._register(app, 'analytics_buffer')
+
+    def _reset_stats(self):
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'rejected': 0,
+            'failed': 0,
+            'spooled': 0,
+            'flush_count': 0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    @property
+    def enabled(self):
+        return bool(self._app and self._app.config.get('ANALYTICS_BUFFER_ENABLED'))
+
+    @property
+    def deferred(self):
+        return self.enabled
+
+    @property
+    def depth(self):
+        return len(self._rows)
+
+    def enqueue(self, rows):
+        """
+        Añade filas a la cola. Retorna False si la cola está llena
+        (el llamador debe escribir de forma síncrona).
+        """
+        self._ensure_worker()
+
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_queue:
+                self._stats['rejected'] += len(rows)
+                return False
+            self._rows.extend(rows)
+            self._stats['enqueued'] += len(rows)
+            full = len(self._rows) >= self.max_rows
+
+        if full:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Vuelca a la base de datos todas las filas pendientes"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._rows:
+                    return 0
+                rows = list(self._rows)
+                self._rows.clear()
+
+            # Base de datos caída o lenta: directo al spool
+            if analytics_spool.enabled and not analytics_spool.healthy:
+                return self._spool(rows)
+
+            started = time.perf_counter()
+            try:
+                with self._app.app_context():
+                    with db.engine.begin() as conn:
+                        if conn.dialect.name == 'postgresql' and analytics_spool.enabled:
+                            conn.exec_driver_sql(
+                                f"SET LOCAL statement_timeout = {int(analytics_spool.timeout_ms)}"
+                            )
+                        encoded = dimension_cache.encode_rows(conn, claim_event_ids(conn, rows))
+                        if encoded:
+                            conn.execute(AnalyticsEvent.__table__.insert(), encoded)
+            except Exception as e:
+                dimension_cache.clear()
+                self._app.logger.error(f"Analytics buffer flush failed ({len(rows)} rows): {e}")
+                if analytics_spool.enabled:
+                    analytics_spool.mark_unhealthy(e)
+                    return self._spool(rows)
+                self._stats['failed'] += len(rows)
+                return 0
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._stats['flushed'] += len(rows)
+            self._stats['flush_count'] += 1
+            self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], round(elapsed_ms, 2))
+            self._stats['total_flush_ms'] += elapsed_ms
+
+            if analytics_spool.enabled and elapsed_ms > analytics_spool.slow_ms:
+                analytics_spool.mark_unhealthy(f'slow flush: {elapsed_ms:.0f} ms')
+            return len(rows)
+
+    def _spool(self, rows):
+        try:
+            written = analytics_spool.append(rows)
+        except Exception as e:
+            self._stats['failed'] += len(rows)
+            self._app.logger.error(f"Analytics spool write failed ({len(rows)} rows): {e}")
+            return 0
+        self._stats['spooled'] += written
+        return 0
+
+    def stats(self):
+        """Métricas del buffer (profundidad de cola y latencia de flush)"""
+        stats = dict(self._stats)
+        flush_count = stats.pop('flush_count')
+        total_flush_ms = stats.pop('total_flush_ms')
+        stats.update({
+            'enabled': self.enabled,
+            'queue_depth': self.depth,
+            'max_rows': self.max_rows,
+            'flush_interval_ms': int(self.flush_interval * 1000),
+            'flushes': flush_count,
+            'avg_flush_ms': round(total_flush_ms / flush_count, 2) if flush_count else None,
+        })
+        return stats
+
+    def _reset_state(self):
+        self._rows.clear()
+
+
+analytics_buffer = AnalyticsWriteBuffer()
@@ -0,0 +1,121 @@
+"""
+Analytics Checkpoints - High-water marks de los jobs incrementales
+
+Cada job (rollups, sesiones, ...) consume AnalyticsEvent en orden de id y
+guarda el último id procesado en analytics_checkpoints. El checkpoint se
+mueve con compare-and-set dentro de la misma transacción que escribe los
+resultados, así dos workers nunca procesan el mismo rango.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from app import db
+from app.models.analytics import AnalyticsEvent, AnalyticsCheckpoint
+
+# Último id borrado por la compactación (ver analytics_compaction)
+COMPACTION_CHECKPOINT = 'compaction'
+
+# Observación de ids visibles para next_upper_id (no son jobs: no consumen eventos)
+VISIBLE_IDS_SEEN = 'visible_ids:seen'
+VISIBLE_IDS_READY = 'visible_ids:ready'
+
+_NOT_CONSUMERS = (COMPACTION_CHECKPOINT, VISIBLE_IDS_SEEN, VISIBLE_IDS_READY)
+
+
+def get_checkpoint(name):
+    """Retorna el último id procesado por un job (0 si nunca se ejecutó)"""
+    checkpoint = db.session.get(AnalyticsCheckpoint, name)
+    if checkpoint is None:
+        checkpoint = AnalyticsCheckpoint(name=name, last_id=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    return checkpoint.last_id
+
+
+def advance_checkpoint(name, last_id, new_last_id):
+    """
+    Compare-and-set del high-water mark dentro de la transacción actual.
+    Retorna False si otro worker lo movió antes (el llamador debe hacer rollback).
+    """
+    result = db.session.execute(
+        update(AnalyticsCheckpoint)
+        .where(AnalyticsCheckpoint.name == name, AnalyticsCheckpoint.last_id == last_id)
+        .values(last_id=new_last_id, updated_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+
+def consumed_up_to():
+    """
+    Id máximo que ya han procesado todos los jobs incrementales (None si no
+    hay ninguno). La compactación no cuenta: borra filas, no las consume.
+    """
+    return db.session.query(func.min(AnalyticsCheckpoint.last_id)).filter(
+        AnalyticsCheckpoint.name.notin_(_NOT_CONSUMERS),
+    ).scalar()
+
+
+def _max_event_id():
+    return db.session.query(func.max(AnalyticsEvent.id)).scalar() or 0
+
+
+def visible_id_bound(lag_seconds):
+    """
+    Mayor id que ya era visible hace al menos lag_seconds, medido con el
+    reloj del servidor al observarlo y no con el timestamp del evento (las
+    filas del buffer y del spool llegan con timestamps antiguos).
+
+    Cada observación (max(id), hora) se guarda en VISIBLE_IDS_SEEN; cuando
+    tiene más de lag_seconds pasa a VISIBLE_IDS_READY, que es la cota que
+    se usa, y se toma una nueva. Así un id entregado a una transacción que
+    aún no ha hecho COMMIT queda por encima de la cota durante lag_seconds.
+    """
+    if not lag_seconds:
+        return _max_event_id()
+
+    get_checkpoint(VISIBLE_IDS_SEEN)
+    get_checkpoint(VISIBLE_IDS_READY)
+    seen_id, seen_at = db.session.query(AnalyticsCheckpoint.last_id, AnalyticsCheckpoint.updated_at).filter(
+        AnalyticsCheckpoint.name == VISIBLE_IDS_SEEN,
+    ).one()
+
+    now = datetime.utcnow()
+    if not seen_id or seen_at <= now - timedelta(seconds=lag_seconds):
+        # Compare-and-set: con varios workers solo uno promueve cada observación
+        observed = db.session.execute(
+            update(AnalyticsCheckpoint)
+            .where(AnalyticsCheckpoint.name == VISIBLE_IDS_SEEN,
+                   AnalyticsCheckpoint.last_id == seen_id, AnalyticsCheckpoint.updated_at == seen_at)
+            .values(last_id=_max_event_id(), updated_at=now)
+        ).rowcount == 1
+        if observed and seen_id:
+            db.session.execute(
+                update(AnalyticsCheckpoint)
+                .where(AnalyticsCheckpoint.name == VISIBLE_IDS_READY, AnalyticsCheckpoint.last_id < seen_id)
+                .values(last_id=seen_id, updated_at=now)
+            )
+        db.session.commit()
+
+    return db.session.query(AnalyticsCheckpoint.last_id).filter(
+        AnalyticsCheckpoint.name == VISIBLE_IDS_READY,
+    ).scalar()
+
+
+def next_upper_id(last_id, batch_size, lag_seconds):
+    """
+    Último id a procesar en esta pasada (o None si no hay nada nuevo).
+    Los ids se asignan al INSERT pero son visibles al COMMIT, y una
+    transacción lenta podría quedar por detrás del high-water mark: solo
+    se llega hasta visible_id_bound(lag_seconds).
+    """
+    bound = visible_id_bound(lag_seconds)
+    if not bound or bound <= last_id:
+        return None
+
+    upper = db.session.query(AnalyticsEvent.id).filter(
+        AnalyticsEvent.id > last_id,
+        AnalyticsEvent.id <= bound,
+    ).order_by(AnalyticsEvent.id).offset(batch_size - 1).limit(1).scalar()
+    return upper if upper is not None else bound
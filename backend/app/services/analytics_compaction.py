@@ -0,0 +1,219 @@
+"""
+Analytics Compaction - Borrado por lotes de eventos crudos antiguos
+
+Los eventos con más de ANALYTICS_COMPACTION_AGE_DAYS días ya no se
+consultan fila a fila: sus conteos por hora × event_name (y UTM) viven en
+los rollups y las visitas en analytics_sessions. La compactación:
+
+1. Pone al día rollups y sesiones, así ninguna fila se borra sin contar.
+2. Avanza desde su checkpoint ('compaction', ver analytics_checkpoints)
+   en orden de id, en lotes de ANALYTICS_COMPACTION_BATCH_SIZE filas y
+   nunca más allá de lo que han consumido todos los jobs incrementales.
+   Se detiene en el primer evento que aún no tiene la antigüedad mínima.
+3. Con ANALYTICS_COMPACTION_ARCHIVE_DIR, escribe cada lote en un .npz
+   (mismo formato que analytics_export) antes de borrarlo.
+4. Suma los eventos del lote por día × dispositivo × navegador × SO a
+   analytics_device_daily, que device_counts() une con las filas crudas.
+5. Borra el lote por rango de id (tabla caliente y particiones) y hace
+   commit por lote: las transacciones y los bloqueos son cortos y una
+   ejecución interrumpida continúa donde se quedó.
+
+A diferencia de la retención de analytics_partitions (DROP de meses
+completos), permite conservar poco crudo sin esperar a que cierre el mes.
+
+Limitaciones de lo que se lee de filas crudas:
+- event_counts() cuenta la hora parcial inicial sobre filas crudas, así
+  que si start cae en un rango compactado esa hora sale de menos.
+- device_counts() suma los días compactados enteros: el día de start
+  cuenta completo si ya se compactó.
+- El embudo necesita la secuencia de eventos de cada sesión y no tiene
+  rollup: funnel_report() recorta la ventana a compacted_until() y lo
+  indica en el informe.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import String, cast, func, select, text
+
+from app import db
+from app.models.analytics import AnalyticsDeviceDaily, AnalyticsEvent
+from app.services.analytics_checkpoints import (
+    COMPACTION_CHECKPOINT, get_checkpoint, advance_checkpoint, consumed_up_to,
+)
+from app.services.analytics_export import write_export
+from app.services.analytics_partitions import delete_id_range, partitioned_source
+from app.services.analytics_rollup import update_rollups, upsert_counts
+from app.services.sessionizer import update_sessions
+from app.services.sql_functions import date_trunc
+
+
+def _catch_up(update):
+    while update():
+        pass
+
+
+def _next_batch(last_id, safe_id, cutoff, batch_size):
+    """
+    (último id, primer timestamp, filas) del siguiente lote: el prefijo en
+    orden de id con timestamp < cutoff. None si no hay nada que compactar.
+    """
+    source = partitioned_source(AnalyticsEvent)
+    rows = db.session.execute(
+        select(source.c.id, source.c.timestamp)
+        .where(source.c.id > last_id, source.c.id <= safe_id)
+        .order_by(source.c.id)
+        .limit(batch_size)
+    ).all()
+
+    count = 0
+    first_timestamp = None
+    for _, timestamp in rows:
+        if timestamp >= cutoff:
+            break
+        count += 1
+        if first_timestamp is None or timestamp < first_timestamp:
+            first_timestamp = timestamp
+    if not count:
+        return None
+    return rows[count - 1][0], first_timestamp, count
+
+
+def _batch_bytes(min_id, max_id):
+    """Tamaño aproximado de las filas del lote (pg_column_size en PostgreSQL)"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return int(db.session.execute(text(
+            'SELECT coalesce(sum(pg_column_size(e.*)), 0) FROM analytics_events e '
+            'WHERE e.id > :min_id AND e.id <= :max_id'
+        ), {'min_id': min_id, 'max_id': max_id}).scalar())
+
+    source = partitioned_source(AnalyticsEvent)
+    size = sum(func.coalesce(func.length(cast(column, String)), 0) for column in source.c)
+    return int(db.session.execute(
+        select(func.coalesce(func.sum(size), 0)).where(source.c.id > min_id, source.c.id <= max_id)
+    ).scalar())
+
+
+def _roll_up_devices(min_id, max_id):
+    """Suma los eventos del lote a analytics_device_daily antes de borrarlos"""
+    source = partitioned_source(AnalyticsEvent)
+    day = date_trunc('day', source.c.timestamp)
+    dimensions = [func.coalesce(column, '') for column in (
+        source.c.device_type, source.c.browser_family, source.c.os_family,
+    )]
+    rows = db.session.execute(
+        select(day, *dimensions, func.sum(source.c.sample_weight))
+        .where(source.c.id > min_id, source.c.id <= max_id)
+        .group_by(day, *dimensions)
+    ).all()
+    upsert_counts(AnalyticsDeviceDaily, [
+        dict(zip(AnalyticsDeviceDaily.KEY_COLUMNS, row[:4]), count=int(row[4])) for row in rows
+    ], AnalyticsDeviceDaily.KEY_COLUMNS)
+
+
+def compacted_until():
+    """
+    Primer instante a partir del cual las filas crudas están completas
+    (fin del último día compactado) o None si nunca se compactó.
+    """
+    last_day = db.session.query(func.max(AnalyticsDeviceDaily.bucket)).scalar()
+    if last_day is None:
+        return None
+    return last_day + timedelta(days=1)
+
+
+def device_counts(start):
+    """
+    [(device_type, browser_family, os_family, eventos)] desde start: filas
+    crudas más los días compactados (los dos conjuntos no se solapan).
+    """
+    source = partitioned_source(AnalyticsEvent, start)
+    raw = db.session.query(
+        source.c.device_type, source.c.browser_family, source.c.os_family, func.sum(source.c.sample_weight)
+    ).filter(
+        source.c.timestamp >= start,
+    ).group_by(source.c.device_type, source.c.browser_family, source.c.os_family).all()
+
+    compacted = db.session.query(
+        AnalyticsDeviceDaily.device_type, AnalyticsDeviceDaily.browser_family,
+        AnalyticsDeviceDaily.os_family, func.sum(AnalyticsDeviceDaily.count),
+    ).filter(
+        AnalyticsDeviceDaily.bucket >= start.replace(hour=0, minute=0, second=0, microsecond=0),
+    ).group_by(
+        AnalyticsDeviceDaily.device_type, AnalyticsDeviceDaily.browser_family, AnalyticsDeviceDaily.os_family,
+    ).all()
+
+    return [
+        (device or None, browser or None, os_family or None, int(count))
+        for device, browser, os_family, count in [*raw, *compacted]
+    ]
+
+
+def _archive_batch(directory, min_id, max_id, start, end):
+    """Escribe el lote en <directory>/analytics_events_<primero>_<último>.npz"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'analytics_events_{min_id + 1:012d}_{max_id:012d}.npz')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        write_export(fh, start, end, id_range=(min_id, max_id))
+    os.replace(tmp_path, path)
+    return path
+
+
+def compact_events(now=None, age_days=None, batch_size=None, max_batches=None,
+                   archive_dir=None, pause_ms=None):
+    """
+    Borra por lotes los eventos más antiguos que age_days (ver docstring
+    del módulo). Retorna {'rows', 'bytes', 'batches', 'archives', 'last_id'}.
+    """
+    config = current_app.config
+    now = now or datetime.utcnow()
+    if age_days is None:
+        age_days = config.get('ANALYTICS_COMPACTION_AGE_DAYS', 30)
+    batch_size = batch_size or config.get('ANALYTICS_COMPACTION_BATCH_SIZE', 5000)
+    max_batches = max_batches or config.get('ANALYTICS_COMPACTION_MAX_BATCHES', 100)
+    if archive_dir is None:
+        archive_dir = config.get('ANALYTICS_COMPACTION_ARCHIVE_DIR')
+    if pause_ms is None:
+        pause_ms = config.get('ANALYTICS_COMPACTION_PAUSE_MS', 100)
+    cutoff = now - timedelta(days=age_days)
+
+    _catch_up(update_rollups)
+    _catch_up(update_sessions)
+
+    report = {'rows': 0, 'bytes': 0, 'batches': 0, 'archives': [], 'last_id': None}
+    while report['batches'] < max_batches:
+        last_id = get_checkpoint(COMPACTION_CHECKPOINT)
+        report['last_id'] = last_id
+        safe_id = consumed_up_to()
+        if safe_id is None or safe_id <= last_id:
+            break
+
+        batch = _next_batch(last_id, safe_id, cutoff, batch_size)
+        if batch is None:
+            break
+        upper, first_timestamp, count = batch
+
+        # Igual que los rollups: el checkpoint primero serializa a los workers
+        if not advance_checkpoint(COMPACTION_CHECKPOINT, last_id, upper):
+            db.session.rollback()
+            break
+
+        report['bytes'] += _batch_bytes(last_id, upper)
+        if archive_dir:
+            report['archives'].append(_archive_batch(archive_dir, last_id, upper, first_timestamp, cutoff))
+        _roll_up_devices(last_id, upper)
+        report['rows'] += delete_id_range(AnalyticsEvent, last_id, upper)
+        db.session.commit()
+
+        report['batches'] += 1
+        report['last_id'] = upper
+        if count < batch_size:
+            break
+        if pause_ms:
+            # Deja respirar a la ingesta (WAL, autovacuum) entre lotes
+            time.sleep(pause_ms / 1000)
+
+    return report
@@ -0,0 +1,199 @@
+"""
+Analytics Dedupe - Ingesta idempotente con ids de evento del cliente
+
+El frontend envía un event_id por evento y lo reutiliza en los
+reintentos, así un evento repetido (reintento, sendBeacon al cerrar la
+página) se guarda una sola vez. Dos niveles:
+
+1. En la petición: un RotatingBloomFilter por worker. Si el id no está
+   (lo habitual) se acepta sin tocar la base de datos. Si puede que esté,
+   se confirma con una única SELECT para todos los ids dudosos de la
+   petición: los que existen se rechazan y los falsos positivos siguen.
+   Con la base de datos caída (spool no sano, o la SELECT falla) no se
+   confirma: las dudosas siguen hacia el spool y el nivel 2 las resuelve
+   al reproducirlo.
+2. Al escribir: los ids se insertan en analytics_event_ids (clave
+   primaria) con ON CONFLICT DO NOTHING RETURNING en la misma transacción
+   que los eventos, y solo se guardan los eventos cuyo id se insertó.
+   Cubre duplicados que llegan a otro worker, tras un reinicio o
+   mientras el original sigue en el buffer, y los replays del spool.
+
+Nunca hay una SELECT por evento. analytics_event_ids se purga pasadas
+ANALYTICS_DEDUPE_RETENTION_HOURS (flask analytics partitions).
+"""
+
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models.analytics import AnalyticsEventId
+from app.services.bloom_filter import RotatingBloomFilter
+
+EVENT_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+# Tamaño de los IN (...) al confirmar ids (límite de variables de SQLite)
+_KEY_CHUNK = 500
+
+
+def valid_event_id(value):
+    return isinstance(value, str) and EVENT_ID_RE.match(value) is not None
+
+
+class EventDeduper:
+    """Descarte de eventos repetidos por client_event_id con Bloom filter por worker"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self._seen = RotatingBloomFilter(self.capacity, self.error_rate)
+        self._stats = Counter()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el filtro a partir de la config de la app"""
+        self._app = app
+        self.capacity = app.config.get('ANALYTICS_DEDUPE_CAPACITY', 100000)
+        self.error_rate = app.config.get('ANALYTICS_DEDUPE_ERROR_RATE', 0.001)
+        self._seen = RotatingBloomFilter(self.capacity, self.error_rate)
+        app.extensions['analytics_dedupe'] = self
+
+    def _check_fork(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Lo visto por el padre sigue siendo válido; solo el lock no
+            self._pid = pid
+            self._lock = threading.Lock()
+
+    def filter_rows(self, rows, confirm=True):
+        """
+        Retorna las filas cuyo client_event_id no se ha visto (o que no lo
+        tienen). Con confirm=False (base de datos caída) o si la SELECT de
+        confirmación falla, las dudosas se conservan: claim_event_ids
+        descarta los duplicados reales al escribir.
+        """
+        self._check_fork()
+
+        kept = []
+        doubtful = []
+        with self._lock:
+            for row in rows:
+                event_id = row.get('client_event_id')
+                if event_id is None:
+                    kept.append(row)
+                elif self._seen.add(event_id):
+                    doubtful.append(row)
+                else:
+                    kept.append(row)
+
+        stored = set()
+        if doubtful and confirm:
+            try:
+                stored = _stored_ids([row['client_event_id'] for row in doubtful])
+            except OperationalError as e:
+                db.session.rollback()
+                self._stats['confirm_failed'] += 1
+                current_app.logger.warning(f"Event id check failed, keeping {len(doubtful)} rows: {e}")
+        for row in doubtful:
+            if row['client_event_id'] in stored:
+                self._stats['duplicates'] += 1
+            else:
+                # Falso positivo o duplicado aún sin escribir (lo resuelve claim_event_ids)
+                self._stats['unconfirmed'] += 1
+                kept.append(row)
+
+        self._stats['checked'] += len(rows)
+        return kept
+
+    def stats(self):
+        return {**self._stats, **self._seen.stats()}
+
+
+event_deduper = EventDeduper()
+
+
+def _stored_ids(event_ids):
+    table = AnalyticsEventId.__table__
+    stored = set()
+    for i in range(0, len(event_ids), _KEY_CHUNK):
+        chunk = event_ids[i:i + _KEY_CHUNK]
+        query = select(table.c.client_event_id).where(table.c.client_event_id.in_(chunk))
+        stored.update(db.session.execute(query).scalars())
+    return stored
+
+
+def claim_event_ids(conn, rows):
+    """
+    Registra los client_event_id de rows en analytics_event_ids dentro de
+    la transacción de conn. Retorna las filas que se deben insertar (sin
+    la clave client_event_id, que no es columna de analytics_events): las
+    que no tienen id y la primera aparición de cada id que no existía.
+    """
+    first = {}
+    for row in rows:
+        event_id = row.get('client_event_id')
+        if event_id is not None:
+            first.setdefault(event_id, row)
+    if not first:
+        return [_without_event_id(row) for row in rows]
+
+    table = AnalyticsEventId.__table__
+    now = datetime.utcnow()
+    params = [{'client_event_id': event_id, 'created_at': now} for event_id in first]
+
+    dialect = conn.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(table).on_conflict_do_nothing(
+            index_elements=['client_event_id']
+        ).returning(table.c.client_event_id)
+        claimed = set(conn.execute(stmt, params).scalars())
+    else:
+        existing = set()
+        ids = list(first)
+        for i in range(0, len(ids), _KEY_CHUNK):
+            chunk = ids[i:i + _KEY_CHUNK]
+            query = select(table.c.client_event_id).where(table.c.client_event_id.in_(chunk))
+            existing.update(conn.execute(query).scalars())
+        missing = [param for param in params if param['client_event_id'] not in existing]
+        if missing:
+            conn.execute(table.insert(), missing)
+        claimed = {param['client_event_id'] for param in missing}
+
+    return [
+        _without_event_id(row) for row in rows
+        if row.get('client_event_id') is None
+        or (row['client_event_id'] in claimed and first[row['client_event_id']] is row)
+    ]
+
+
+def _without_event_id(row):
+    if 'client_event_id' not in row:
+        return row
+    return {key: value for key, value in row.items() if key != 'client_event_id'}
+
+
+def prune_event_ids(now=None, retention_hours=None):
+    """Elimina los ids más antiguos que la ventana de deduplicación; retorna cuántos"""
+    now = now or datetime.utcnow()
+    if retention_hours is None:
+        retention_hours = current_app.config.get('ANALYTICS_DEDUPE_RETENTION_HOURS', 48)
+    cutoff = now - timedelta(hours=retention_hours)
+    result = db.session.execute(
+        AnalyticsEventId.__table__.delete().where(AnalyticsEventId.created_at < cutoff)
+    )
+    db.session.commit()
+    return result.rowcount
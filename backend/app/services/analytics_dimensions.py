@@ -0,0 +1,309 @@
+"""
+Analytics Dimensions - Codificación con diccionario de url/referrer/user_agent
+
+analytics_events guarda url_id, referrer_id y user_agent_id (enteros) en
+lugar de cadenas de hasta 500 caracteres que se repiten en casi todas las
+filas. Los valores viven una sola vez en analytics_dimensions (kind, value).
+
+encode_rows() traduce las filas justo antes del INSERT (inserción síncrona,
+flush del buffer y replay del spool) usando una LRU por worker
+cadena -> id. Los valores nuevos se insertan con ON CONFLICT DO NOTHING y
+se leen de vuelta, así dos workers que ven el mismo valor obtienen el
+mismo id. Si la transacción del INSERT falla, la LRU se vacía (podría
+contener ids de filas que nunca llegaron a confirmarse).
+
+event_name y los UTM siguen en línea: son cortos y son la clave de
+agrupación de rollups, sesiones y embudos.
+
+Las tablas creadas antes de la codificación se convierten al arrancar
+(create_app) y en el paso release del despliegue (flask analytics
+dimensions) con convert_legacy_columns(); leads y refresh_tokens reciben
+las columnas derivadas del User-Agent con classify_stored_user_agents().
+Ninguna de las dos hace nada si las tablas ya están al día.
+
+Para leer las cadenas: AnalyticsEvent.url / .referrer / .user_agent en el
+ORM, o join_dimensions() en consultas Core.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import inspect, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models.analytics import AnalyticsDimension, AnalyticsEvent
+from app.services.user_agent import USER_AGENT_COLUMNS, user_agent_fields
+
+DIMENSION_COLUMNS = ('url', 'referrer', 'user_agent')
+
+# Tamaño de los IN (...) al leer ids
+_KEY_CHUNK = 200
+
+# Clave del advisory lock de las conversiones de esquema
+_SCHEMA_LOCK_KEY = 4711
+
+
+def _resolve(conn, keys):
+    """Ids de (kind, value), creando los que no existan. Retorna {(kind, value): id}"""
+    table = AnalyticsDimension.__table__
+    keys = list(keys)
+    rows = [{'kind': kind, 'value': value} for kind, value in keys]
+
+    dialect = conn.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        conn.execute(insert(table).on_conflict_do_nothing(index_elements=['kind', 'value']), rows)
+    else:
+        existing = set()
+        for i in range(0, len(keys), _KEY_CHUNK):
+            query = select(table.c.kind, table.c.value).where(
+                tuple_(table.c.kind, table.c.value).in_(keys[i:i + _KEY_CHUNK])
+            )
+            existing.update(tuple(row) for row in conn.execute(query))
+        missing = [row for row in rows if (row['kind'], row['value']) not in existing]
+        if missing:
+            conn.execute(table.insert(), missing)
+
+    ids = {}
+    for i in range(0, len(keys), _KEY_CHUNK):
+        query = select(table.c.id, table.c.kind, table.c.value).where(
+            tuple_(table.c.kind, table.c.value).in_(keys[i:i + _KEY_CHUNK])
+        )
+        for dimension_id, kind, value in conn.execute(query):
+            ids[(kind, value)] = dimension_id
+    return ids
+
+
+class DimensionCache:
+    """LRU por worker de (kind, value) -> id de analytics_dimensions"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.max_size = 10000
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura la caché a partir de la config de la app"""
+        self._app = app
+        self.max_size = app.config.get('ANALYTICS_DIMENSION_CACHE_SIZE', 10000)
+        # Otra app puede apuntar a otra base de datos: los ids no valen
+        self._ids.clear()
+        app.extensions['analytics_dimensions'] = self
+
+    def _check_fork(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Los ids heredados del padre siguen siendo válidos; solo el lock no
+            self._pid = pid
+            self._lock = threading.Lock()
+
+    def encode_rows(self, conn, rows):
+        """
+        Retorna copias de rows con url/referrer/user_agent sustituidos por
+        url_id/referrer_id/user_agent_id. Debe llamarse dentro de la
+        transacción que inserta las filas (conn).
+        """
+        self._check_fork()
+
+        wanted = {
+            (kind, row[kind])
+            for row in rows for kind in DIMENSION_COLUMNS
+            if row.get(kind) is not None
+        }
+
+        resolved = {}
+        missing = []
+        with self._lock:
+            for key in wanted:
+                dimension_id = self._ids.get(key)
+                if dimension_id is None:
+                    missing.append(key)
+                else:
+                    self._ids.move_to_end(key)
+                    resolved[key] = dimension_id
+            self._stats['hits'] += len(resolved)
+            self._stats['misses'] += len(missing)
+
+        if missing:
+            fetched = _resolve(conn, missing)
+            resolved.update(fetched)
+            with self._lock:
+                for key, dimension_id in fetched.items():
+                    self._ids[key] = dimension_id
+                while len(self._ids) > self.max_size:
+                    self._ids.popitem(last=False)
+                    self._stats['evictions'] += 1
+
+        encoded = []
+        for row in rows:
+            new_row = {key: value for key, value in row.items() if key not in DIMENSION_COLUMNS}
+            if 'device_type' not in new_row:
+                # Filas sin clasificar (spool de versiones anteriores, scripts)
+                new_row.update(user_agent_fields(row.get('user_agent')))
+            new_row.setdefault('sample_weight', 1)
+            for kind in DIMENSION_COLUMNS:
+                value = row.get(kind)
+                new_row[f'{kind}_id'] = resolved[(kind, value)] if value is not None else None
+            encoded.append(new_row)
+        return encoded
+
+    def clear(self):
+        """Vacía la caché (tras un rollback que pudo deshacer valores nuevos)"""
+        self._check_fork()
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'size': len(self._ids),
+            'max_size': self.max_size,
+            'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else None,
+        }
+
+
+dimension_cache = DimensionCache()
+
+
+def join_dimensions(source, kinds=DIMENSION_COLUMNS):
+    """
+    FROM con LEFT JOIN a analytics_dimensions para cada kind.
+    Retorna (from_clause, {kind: columna con la cadena etiquetada como kind}).
+    """
+    table = AnalyticsDimension.__table__
+    from_clause = source
+    columns = {}
+    for kind in kinds:
+        dimension = table.alias(f'dim_{kind}')
+        from_clause = from_clause.outerjoin(dimension, dimension.c.id == source.c[f'{kind}_id'])
+        columns[kind] = dimension.c.value.label(kind)
+    return from_clause, columns
+
+
+# ============================================
+# CONVERSIÓN DE TABLAS EXISTENTES
+# ============================================
+
+def _event_tables():
+    from app.services.analytics_partitions import list_partitions
+
+    tables = [AnalyticsEvent.__tablename__]
+    if db.session.get_bind().dialect.name == 'sqlite':
+        tables += [name for _, name in list_partitions(AnalyticsEvent.__tablename__)]
+    return tables
+
+
+def _lock_schema_changes():
+    """
+    En PostgreSQL serializa las conversiones hasta el commit: cada worker de
+    gunicorn las ejecuta al arrancar y el segundo debe ver las columnas que
+    ya añadió el primero en lugar de repetir el ALTER TABLE.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _SCHEMA_LOCK_KEY})
+
+
+def _add_user_agent_columns(table_name, columns):
+    """Añade las columnas derivadas del User-Agent que falten. Retorna las añadidas"""
+    derived = [name for name in USER_AGENT_COLUMNS if name not in columns]
+    for name in derived:
+        length = AnalyticsEvent.__table__.c[name].type.length
+        db.session.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN {name} VARCHAR({length})'))
+    return derived
+
+
+def _classify_existing(table_name, user_agents, key_column):
+    """Rellena device_type/browser_family/os_family con un UPDATE por User-Agent distinto"""
+    for key, value in user_agents:
+        condition = f'{key_column} IS NULL' if key is None else f'{key_column} = :key'
+        db.session.execute(text(
+            f'UPDATE "{table_name}" SET device_type = :device_type, browser_family = :browser_family, '
+            f'os_family = :os_family WHERE device_type IS NULL AND {condition}'
+        ), {'key': key, **user_agent_fields(value)})
+
+
+def classify_stored_user_agents():
+    """
+    Añade y rellena device_type/browser_family/os_family en leads y
+    refresh_tokens creadas antes de la clasificación. Retorna las tablas
+    modificadas.
+    """
+    changed = []
+    _lock_schema_changes()
+    for table_name in ('leads', 'refresh_tokens'):
+        columns = {column['name'] for column in inspect(db.session.connection()).get_columns(table_name)}
+        if not _add_user_agent_columns(table_name, columns):
+            continue
+        user_agents = db.session.execute(text(
+            f'SELECT DISTINCT user_agent, user_agent FROM "{table_name}" WHERE device_type IS NULL'
+        )).all()
+        _classify_existing(table_name, user_agents, 'user_agent')
+        changed.append(table_name)
+
+    db.session.commit()
+    return changed
+
+
+def convert_legacy_columns():
+    """
+    Migra analytics_events (y sus particiones SQLite) creadas antes de la
+    codificación: añade *_id, rellena el diccionario y elimina las columnas
+    de texto. También añade y rellena las columnas derivadas del User-Agent
+    y sample_weight (1 para las filas existentes). Retorna las tablas
+    convertidas.
+    """
+    converted = []
+    _lock_schema_changes()
+    view_dropped = False
+
+    for table_name in _event_tables():
+        columns = {column['name'] for column in inspect(db.session.connection()).get_columns(table_name)}
+        legacy = [kind for kind in DIMENSION_COLUMNS if kind in columns]
+        if not legacy and 'sample_weight' in columns and all(name in columns for name in USER_AGENT_COLUMNS):
+            continue
+
+        if not view_dropped and db.session.get_bind().dialect.name == 'sqlite':
+            # La vista se recrea en el próximo mantenimiento de particiones
+            db.session.execute(text(f'DROP VIEW IF EXISTS "{AnalyticsEvent.__tablename__}_all"'))
+            view_dropped = True
+
+        derived = _add_user_agent_columns(table_name, columns)
+        if 'sample_weight' not in columns:
+            db.session.execute(text(
+                f'ALTER TABLE "{table_name}" ADD COLUMN sample_weight INTEGER NOT NULL DEFAULT 1'
+            ))
+
+        for kind in legacy:
+            if f'{kind}_id' not in columns:
+                db.session.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN {kind}_id INTEGER'))
+            db.session.execute(text(
+                f"INSERT INTO analytics_dimensions (kind, value) "
+                f"SELECT DISTINCT '{kind}', {kind} FROM \"{table_name}\" WHERE {kind} IS NOT NULL "
+                f"ON CONFLICT (kind, value) DO NOTHING"
+            ))
+            db.session.execute(text(
+                f'UPDATE "{table_name}" SET {kind}_id = d.id FROM analytics_dimensions d '
+                f'WHERE d.kind = \'{kind}\' AND d.value = "{table_name}".{kind}'
+            ))
+            db.session.execute(text(f'ALTER TABLE "{table_name}" DROP COLUMN {kind}'))
+        if derived:
+            user_agents = db.session.execute(text(
+                f'SELECT DISTINCT e.user_agent_id, d.value FROM "{table_name}" e '
+                f'LEFT JOIN analytics_dimensions d ON d.id = e.user_agent_id WHERE e.device_type IS NULL'
+            )).all()
+            _classify_existing(table_name, user_agents, 'user_agent_id')
+        converted.append(table_name)
+
+    db.session.commit()
+    dimension_cache.clear()
+    return converted
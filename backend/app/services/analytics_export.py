@@ -0,0 +1,201 @@
+"""
+Analytics Export - Exportación columnar de analytics_events
+
+Genera un .npz (zip de arrays .npy, comprimido con deflate) leyendo los
+eventos con un cursor de servidor (yield_per) y escribiendo cada bloque
+en cuanto se lee, así la memoria no depende del tamaño del rango.
+
+Cada bloque k aporta una entrada por columna:
+    k00000.id.npy            int64
+    k00000.timestamp.npy     datetime64[us]
+    k00000.sample_weight.npy int32 (eventos reales que representa cada fila)
+    k00000.<texto>.codes.npy int32 (-1 = NULL)
+    k00000.<texto>.values.npy diccionario del bloque (unicode)
+
+Las columnas de texto van codificadas con diccionario (event_name o
+utm_source tienen muy pocos valores distintos). load_export() une los
+bloques y decodifica; con pandas instalado to_dataframe() da un DataFrame.
+
+    >>> from app.services.analytics_export import load_export
+    >>> columns = load_export('events.npz')
+    >>> columns['event_name'][:3]
+"""
+
+import io
+import json
+import zipfile
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import select
+
+from app import db
+from app.models.analytics import AnalyticsEvent
+from app.services.analytics_dimensions import DIMENSION_COLUMNS, join_dimensions
+from app.services.analytics_partitions import partitioned_source
+
+TEXT_COLUMNS = (
+    'event_name', 'url', 'referrer', 'session_id', 'ip_address', 'user_agent',
+    'utm_source', 'utm_medium', 'utm_campaign', 'event_data',
+)
+NUMERIC_COLUMNS = {'id': np.int64, 'sample_weight': np.int32}
+EXPORT_COLUMNS = ('id', 'timestamp', 'sample_weight') + TEXT_COLUMNS
+
+DEFAULT_CHUNK_ROWS = 50000
+
+
+def _encode_text(values):
+    """Codificación con diccionario: (codes int32, valores únicos)"""
+    index = {}
+    codes = np.fromiter(
+        (-1 if value is None else index.setdefault(value, len(index)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    dictionary = np.array(list(index), dtype=str) if index else np.array([], dtype='<U1')
+    return codes, dictionary
+
+
+def _chunk_arrays(rows):
+    """Convierte un bloque de filas en {nombre_entrada: array}"""
+    columns = list(zip(*rows))
+    by_name = dict(zip(EXPORT_COLUMNS, columns))
+
+    arrays = {
+        name: np.fromiter(by_name[name], dtype=dtype, count=len(rows))
+        for name, dtype in NUMERIC_COLUMNS.items()
+    }
+    arrays['timestamp'] = np.array(by_name['timestamp'], dtype='datetime64[us]')
+    for name in TEXT_COLUMNS:
+        values = by_name[name]
+        if name == 'event_data':
+            values = [None if value is None else json.dumps(value, sort_keys=True) for value in values]
+        codes, dictionary = _encode_text(values)
+        arrays[f'{name}.codes'] = codes
+        arrays[f'{name}.values'] = dictionary
+    return arrays
+
+
+def _write_chunk(archive, chunk_index, rows):
+    for name, array in _chunk_arrays(rows).items():
+        with archive.open(f'k{chunk_index:05d}.{name}.npy', 'w', force_zip64=True) as entry:
+            np.lib.format.write_array(entry, array, allow_pickle=False)
+
+
+def _event_chunks(start, end, chunk_rows, id_range=None):
+    """
+    Bloques de filas de [start, end) en orden de timestamp con cursor de
+    servidor. id_range=(min_id, max_id) limita además a min_id < id <= max_id.
+    """
+    source = partitioned_source(AnalyticsEvent, start, end)
+    from_clause, dimensions = join_dimensions(source)
+    filters = [source.c.timestamp >= start, source.c.timestamp < end]
+    if id_range is not None:
+        filters += [source.c.id > id_range[0], source.c.id <= id_range[1]]
+    query = select(*(
+        dimensions[name] if name in DIMENSION_COLUMNS else source.c[name] for name in EXPORT_COLUMNS
+    )).select_from(from_clause).where(
+        *filters
+    ).order_by(source.c.timestamp, source.c.id).execution_options(yield_per=chunk_rows)
+
+    result = db.session.execute(query)
+    try:
+        for rows in result.partitions():
+            yield rows
+    finally:
+        result.close()
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Destino no seekable para zipfile: acumula bytes hasta que se drenan"""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def write_export(fileobj, start, end, chunk_rows=None, id_range=None):
+    """Escribe la exportación en un fichero abierto; retorna el número de eventos"""
+    total = 0
+    chunks = _event_chunks(start, end, chunk_rows or DEFAULT_CHUNK_ROWS, id_range=id_range)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for chunk_index, rows in enumerate(chunks):
+            _write_chunk(archive, chunk_index, rows)
+            total += len(rows)
+    return total
+
+
+def stream_export(start, end, chunk_rows=None):
+    """Generador de bytes del .npz (para una respuesta HTTP en streaming)"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for chunk_index, rows in enumerate(_event_chunks(start, end, chunk_rows or DEFAULT_CHUNK_ROWS)):
+            _write_chunk(archive, chunk_index, rows)
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+# ============================================
+# LECTURA
+# ============================================
+
+def load_export(path_or_file):
+    """
+    Lee una exportación y retorna {columna: array}. Las columnas de texto
+    se decodifican a arrays de objetos (None para NULL).
+    """
+    chunks = defaultdict(dict)
+    with np.load(path_or_file, allow_pickle=False) as npz:
+        for key in npz.files:
+            chunk, name = key.split('.', 1)
+            chunks[chunk][name] = npz[key]
+
+    parts = defaultdict(list)
+    for chunk in sorted(chunks):
+        arrays = chunks[chunk]
+        for name in NUMERIC_COLUMNS:
+            if name in arrays:
+                parts[name].append(arrays[name])
+            else:
+                # Exportaciones anteriores al muestreo: cada fila es un evento
+                parts[name].append(np.ones(len(arrays['id']), dtype=NUMERIC_COLUMNS[name]))
+        parts['timestamp'].append(arrays['timestamp'])
+        for name in TEXT_COLUMNS:
+            codes = arrays[f'{name}.codes']
+            dictionary = np.append(arrays[f'{name}.values'].astype(object), None)
+            # code -1 apunta al None añadido al final del diccionario
+            parts[name].append(dictionary[codes])
+
+    columns = {}
+    for name in EXPORT_COLUMNS:
+        if parts[name]:
+            columns[name] = np.concatenate(parts[name])
+        elif name in NUMERIC_COLUMNS:
+            columns[name] = np.array([], dtype=NUMERIC_COLUMNS[name])
+        elif name == 'timestamp':
+            columns[name] = np.array([], dtype='datetime64[us]')
+        else:
+            columns[name] = np.array([], dtype=object)
+    return columns
+
+
+def to_dataframe(path_or_file):
+    """DataFrame de pandas con la exportación (requiere pandas)"""
+    import pandas as pd
+
+    return pd.DataFrame(load_export(path_or_file))
@@ -0,0 +1,349 @@
+"""
+Analytics Partitions - Particionado mensual y retención de analytics_events / page_views
+
+PostgreSQL: particionado nativo por rango mensual sobre "timestamp".
+La tabla creada por db.create_all() se convierte en tabla particionada la
+primera vez que se ejecuta el mantenimiento (flask analytics partitions).
+La clave primaria pasa a ser (id, timestamp), requisito de PostgreSQL, y la
+secuencia del id se conserva. Las consultas con filtro por timestamp se
+podan solas (partition pruning). Las filas de un mes sin partición caen en
+<tabla>_default y se mueven a la suya cuando el mantenimiento la crea.
+
+SQLite (desarrollo): la tabla original actúa como partición "caliente" y
+los meses cerrados se mueven a tablas <tabla>_pYYYYMM. La vista
+<tabla>_all une todas con UNION ALL para consultas ad-hoc, y
+partitioned_source() construye la unión solo con las particiones que
+solapan la ventana pedida.
+
+Retención: se eliminan particiones completas (DROP TABLE) cuyo mes entero
+es anterior al corte; nunca se hacen DELETE fila a fila. Los rollups no
+se tocan, así que los conteos históricos del admin se mantienen.
+"""
+
+import re
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import Index, MetaData, func, select, text, union_all
+
+from app import db
+from app.models.analytics import AnalyticsEvent, PageView
+from app.services.analytics_checkpoints import consumed_up_to
+
+PARTITIONED_MODELS = (AnalyticsEvent, PageView)
+
+_PARTITION_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment, months):
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(table_name, month):
+    return f'{table_name}_p{month:%Y%m}'
+
+
+def _partition_month(table_name, name):
+    if not name.startswith(f'{table_name}_p'):
+        return None
+    match = _PARTITION_RE.search(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+# ============================================
+# CONSULTAS (poda de particiones)
+# ============================================
+
+def list_partitions(table_name):
+    """Particiones mensuales existentes: [(mes, nombre)] ordenadas por mes"""
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        names = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"
+        ), {'table': table_name}).scalars()
+    elif dialect == 'sqlite':
+        names = db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :pattern"
+        ), {'pattern': f'{table_name}_p%'}).scalars()
+    else:
+        return []
+
+    partitions = []
+    for name in names:
+        month = _partition_month(table_name, name)
+        if month is not None:
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def _partition_table(table, name, metadata=None):
+    """Tabla con el mismo esquema que table y otro nombre (solo índice por timestamp)"""
+    part = table.to_metadata(metadata or MetaData(), name=name)
+    part.indexes.clear()
+    Index(f'ix_{name}_timestamp', part.c.timestamp)
+    return part
+
+
+def partitioned_source(model, start=None, end=None):
+    """
+    Selectable para consultar model en la ventana [start, end).
+    En PostgreSQL es la tabla padre (la poda la hace el planner). En SQLite
+    es la unión de la tabla caliente y las particiones que solapan la ventana.
+    Las columnas son las mismas que las de la tabla (source.c.<columna>).
+    """
+    table = model.__table__
+    if _dialect() != 'sqlite':
+        return table
+
+    selects = [select(*table.c)]
+    metadata = MetaData()
+    for month, name in list_partitions(table.name):
+        if end is not None and month >= end:
+            continue
+        if start is not None and add_months(month, 1) <= start:
+            continue
+        part = _partition_table(table, name, metadata)
+        selects.append(select(*part.c))
+
+    if len(selects) == 1:
+        return table
+    return union_all(*selects).subquery(table.name)
+
+
+def delete_id_range(model, min_id, max_id):
+    """
+    Borra las filas con min_id < id <= max_id de la tabla y de todas sus
+    particiones (en PostgreSQL lo resuelve la tabla padre). Retorna cuántas.
+    """
+    table = model.__table__
+    tables = [table]
+    if _dialect() == 'sqlite':
+        metadata = MetaData()
+        tables += [_partition_table(table, name, metadata) for _, name in list_partitions(table.name)]
+
+    deleted = 0
+    for target in tables:
+        result = db.session.execute(target.delete().where(target.c.id > min_id, target.c.id <= max_id))
+        deleted += result.rowcount
+    return deleted
+
+
+# ============================================
+# MANTENIMIENTO
+# ============================================
+
+def _retention_cutoff(now, months):
+    """Primer mes que se conserva (None = sin retención)"""
+    if not months:
+        return None
+    return add_months(month_start(now), -months)
+
+
+def _safe_event_id():
+    """
+    Id máximo que ya han procesado todos los jobs incrementales
+    (las filas por encima no se mueven de la tabla caliente en SQLite).
+    """
+    return consumed_up_to()
+
+
+def _maintain_sqlite(model, now, cutoff):
+    table = model.__table__
+    report = {'created': [], 'dropped': [], 'moved_rows': 0}
+    current_month = month_start(now)
+
+    # Mover los meses cerrados de la tabla caliente a su partición
+    filters = [table.c.timestamp < current_month]
+    if model is AnalyticsEvent:
+        safe_id = _safe_event_id()
+        if safe_id is not None:
+            filters.append(table.c.id <= safe_id)
+
+    oldest = db.session.query(func.min(table.c.timestamp)).filter(*filters).scalar()
+    existing = {name for _, name in list_partitions(table.name)}
+    month = month_start(oldest) if oldest else current_month
+
+    while month < current_month:
+        next_month = add_months(month, 1)
+        month_filters = filters + [table.c.timestamp >= month, table.c.timestamp < next_month]
+        name = partition_name(table.name, month)
+        part = _partition_table(table, name)
+
+        if db.session.query(func.count()).select_from(table).filter(*month_filters).scalar():
+            if name not in existing:
+                part.create(db.session.connection())
+                existing.add(name)
+                report['created'].append(name)
+            columns = [column.name for column in table.c]
+            db.session.execute(part.insert().from_select(
+                columns, select(*table.c).where(*month_filters)
+            ))
+            result = db.session.execute(table.delete().where(*month_filters))
+            report['moved_rows'] += result.rowcount
+        month = next_month
+
+    # Retención: DROP de particiones completas
+    if cutoff is not None:
+        for month, name in list_partitions(table.name):
+            if month < cutoff:
+                db.session.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                report['dropped'].append(name)
+
+    # Vista UNION ALL para consultas ad-hoc
+    view = f'{table.name}_all'
+    parts = [name for _, name in list_partitions(table.name)]
+    db.session.execute(text(f'DROP VIEW IF EXISTS "{view}"'))
+    columns = ', '.join(f'"{column.name}"' for column in table.c)
+    db.session.execute(text(
+        f'CREATE VIEW "{view}" AS ' + ' UNION ALL '.join(
+            f'SELECT {columns} FROM "{name}"' for name in [table.name] + parts
+        )
+    ))
+    db.session.commit()
+    return report
+
+
+def _pg_is_partitioned(table_name):
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"
+    ), {'table': table_name}).scalar() is not None
+
+
+def _pg_default_rows(table_name, month):
+    """Filas del mes que cayeron en la partición DEFAULT (se insertaron antes de crear la suya)"""
+    return db.session.execute(text(
+        f'SELECT count(*) FROM "{table_name}_default" WHERE "timestamp" >= :start AND "timestamp" < :end'
+    ), {'start': month, 'end': add_months(month, 1)}).scalar()
+
+
+def _pg_create_partition(table_name, month):
+    """
+    Crea la partición del mes. Retorna (nombre, filas movidas desde DEFAULT).
+
+    PostgreSQL rechaza el CREATE si DEFAULT ya tiene filas de ese rango
+    (el mantenimiento no corrió a tiempo o llegaron timestamps futuros).
+    En ese caso se desengancha DEFAULT, se crea la partición, se mueven
+    las filas y se vuelve a enganchar, dentro de la transacción del
+    mantenimiento: o se hace todo o nada.
+    """
+    name = partition_name(table_name, month)
+    default = f'{table_name}_default'
+    bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    moved = _pg_default_rows(table_name, month)
+
+    if moved:
+        db.session.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{default}"'))
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" FOR VALUES {bounds}'
+    ))
+    if moved:
+        window = {'start': month, 'end': add_months(month, 1)}
+        where = '"timestamp" >= :start AND "timestamp" < :end'
+        db.session.execute(text(f'INSERT INTO "{name}" SELECT * FROM "{default}" WHERE {where}'), window)
+        db.session.execute(text(f'DELETE FROM "{default}" WHERE {where}'), window)
+        db.session.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{default}" DEFAULT'))
+        current_app.logger.warning('%s: %d filas movidas de %s a %s', table_name, moved, default, name)
+    return name, moved
+
+
+def _pg_convert(model, now):
+    """Convierte una tabla normal en tabla particionada por mes (una sola vez)"""
+    table = model.__table__
+    name = table.name
+    legacy = f'{name}_legacy'
+    columns = ', '.join(f'"{column.name}"' for column in table.c if column.name != 'timestamp')
+
+    db.session.execute(text(f'LOCK TABLE "{name}" IN ACCESS EXCLUSIVE MODE'))
+    oldest = db.session.execute(text(f'SELECT min("timestamp") FROM "{name}"')).scalar()
+
+    db.session.execute(text(f'ALTER TABLE "{name}" RENAME TO "{legacy}"'))
+    db.session.execute(text(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{name}_pkey" TO "{legacy}_pkey"'))
+    db.session.execute(text(
+        f'CREATE TABLE "{name}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'
+    ))
+    db.session.execute(text(f'ALTER TABLE "{name}" ADD PRIMARY KEY (id, "timestamp")'))
+    db.session.execute(text(f'CREATE TABLE "{name}_default" PARTITION OF "{name}" DEFAULT'))
+
+    month = month_start(oldest or now)
+    while month <= month_start(now):
+        _pg_create_partition(name, month)
+        month = add_months(month, 1)
+
+    db.session.execute(text(
+        f'INSERT INTO "{name}" ({columns}, "timestamp") '
+        f'SELECT {columns}, COALESCE("timestamp", now()) FROM "{legacy}"'
+    ))
+    db.session.execute(text(f'ALTER SEQUENCE "{name}_id_seq" OWNED BY "{name}".id'))
+    db.session.execute(text(f'DROP TABLE "{legacy}"'))
+
+    # Índices secundarios del modelo (se propagan a todas las particiones)
+    for index in table.indexes:
+        index.create(db.session.connection(), checkfirst=True)
+
+
+def _maintain_postgresql(model, now, cutoff, premake):
+    table = model.__table__
+    report = {'created': [], 'dropped': [], 'converted': False, 'moved_rows': 0}
+
+    if not _pg_is_partitioned(table.name):
+        _pg_convert(model, now)
+        report['converted'] = True
+
+    existing = {name for _, name in list_partitions(table.name)}
+    month = month_start(now)
+    for _ in range(premake + 1):
+        name = partition_name(table.name, month)
+        if name not in existing:
+            _, moved = _pg_create_partition(table.name, month)
+            report['created'].append(name)
+            report['moved_rows'] += moved
+        month = add_months(month, 1)
+
+    if cutoff is not None:
+        for month, name in list_partitions(table.name):
+            if month < cutoff:
+                db.session.execute(text(f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+                db.session.execute(text(f'DROP TABLE "{name}"'))
+                report['dropped'].append(name)
+
+    db.session.commit()
+    return report
+
+
+def maintain_partitions(now=None):
+    """
+    Crea las particiones necesarias y aplica la retención.
+    Retorna un informe por tabla.
+    """
+    now = now or datetime.utcnow()
+    config = current_app.config
+    premake = config.get('ANALYTICS_PARTITION_PREMAKE_MONTHS', 2)
+    retention = {
+        AnalyticsEvent: config.get('ANALYTICS_RETENTION_MONTHS', 0),
+        PageView: config.get('PAGEVIEW_RETENTION_MONTHS', 0),
+    }
+
+    dialect = _dialect()
+    report = {}
+    for model in PARTITIONED_MODELS:
+        cutoff = _retention_cutoff(now, retention[model])
+        if dialect == 'postgresql':
+            report[model.__tablename__] = _maintain_postgresql(model, now, cutoff, premake)
+        elif dialect == 'sqlite':
+            report[model.__tablename__] = _maintain_sqlite(model, now, cutoff)
+    return report
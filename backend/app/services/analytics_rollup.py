@@ -0,0 +1,193 @@
+"""
+Analytics Rollups - Conteos incrementales por hora y por día
+
+Las tablas analytics_rollup_hourly / analytics_rollup_daily guardan
+COUNT(*) por bucket × event_name × utm_source/medium/campaign. Se mantienen
+de forma incremental desde un high-water mark sobre AnalyticsEvent.id
+(ver analytics_checkpoints), así que cada actualización solo lee las
+filas nuevas. Solo se procesan ids que ya eran visibles hace
+ANALYTICS_ROLLUP_LAG_SECONDS (ver visible_id_bound); lo más reciente se
+cuenta directamente sobre las filas crudas (id > high-water mark).
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models.analytics import AnalyticsEvent, AnalyticsRollupHourly, AnalyticsRollupDaily
+from app.services.admin_cache import admin_cache, TOPIC_ANALYTICS
+from app.services.analytics_checkpoints import get_checkpoint, advance_checkpoint, next_upper_id
+from app.services.analytics_partitions import partitioned_source
+from app.services.sql_functions import date_trunc
+
+ROLLUP_CHECKPOINT = 'rollup'
+KEY_COLUMNS = AnalyticsRollupHourly.KEY_COLUMNS
+
+
+def upsert_counts(model, rows, key_columns, count_columns=('count',)):
+    """INSERT ... ON CONFLICT DO UPDATE SET count = count + excluded.count"""
+    if not rows:
+        return
+
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={column: table.c[column] + stmt.excluded[column] for column in count_columns},
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # Otros motores: leer y actualizar fila a fila
+    for row in rows:
+        existing = model.query.filter_by(**{key: row[key] for key in key_columns}).first()
+        if existing is None:
+            db.session.add(model(**row))
+        else:
+            for column in count_columns:
+                setattr(existing, column, getattr(existing, column) + row[column])
+
+
+def update_rollups(batch_size=None, lag_seconds=None):
+    """
+    Procesa hasta batch_size eventos nuevos y suma sus conteos a los rollups.
+    Retorna el número de eventos procesados.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('ANALYTICS_ROLLUP_BATCH_SIZE', 50000)
+    if lag_seconds is None:
+        lag_seconds = config.get('ANALYTICS_ROLLUP_LAG_SECONDS', 30)
+
+    last_id = get_checkpoint(ROLLUP_CHECKPOINT)
+    upper = next_upper_id(last_id, batch_size, lag_seconds)
+    if upper is None:
+        return 0
+
+    # Mover el checkpoint primero: en PostgreSQL bloquea la fila y serializa
+    # a los workers que intenten procesar el mismo rango.
+    if not advance_checkpoint(ROLLUP_CHECKPOINT, last_id, upper):
+        db.session.rollback()
+        return 0
+
+    bucket = date_trunc('hour', AnalyticsEvent.timestamp)
+    hourly = db.session.query(
+        bucket,
+        AnalyticsEvent.event_name,
+        func.coalesce(AnalyticsEvent.utm_source, ''),
+        func.coalesce(AnalyticsEvent.utm_medium, ''),
+        func.coalesce(AnalyticsEvent.utm_campaign, ''),
+        func.count(AnalyticsEvent.id),
+        func.sum(AnalyticsEvent.sample_weight),
+    ).filter(
+        AnalyticsEvent.id > last_id,
+        AnalyticsEvent.id <= upper,
+    ).group_by(
+        bucket,
+        AnalyticsEvent.event_name,
+        func.coalesce(AnalyticsEvent.utm_source, ''),
+        func.coalesce(AnalyticsEvent.utm_medium, ''),
+        func.coalesce(AnalyticsEvent.utm_campaign, ''),
+    ).all()
+
+    hourly_rows = []
+    daily = Counter()
+    processed = 0
+    for hour, event_name, source, medium, campaign, rows, weighted in hourly:
+        # Los rollups guardan eventos reales (filas muestreadas × sample_weight)
+        weighted = int(weighted)
+        hourly_rows.append({
+            'bucket': hour, 'event_name': event_name, 'utm_source': source,
+            'utm_medium': medium, 'utm_campaign': campaign, 'count': weighted,
+        })
+        day = hour.replace(hour=0, minute=0, second=0, microsecond=0)
+        daily[(day, event_name, source, medium, campaign)] += weighted
+        processed += rows
+
+    daily_rows = [
+        dict(zip(KEY_COLUMNS, key), count=count) for key, count in daily.items()
+    ]
+
+    upsert_counts(AnalyticsRollupHourly, hourly_rows, KEY_COLUMNS)
+    upsert_counts(AnalyticsRollupDaily, daily_rows, KEY_COLUMNS)
+    db.session.commit()
+    # Única fuente de invalidación de analytics en admin_cache (la ingesta no la sube)
+    admin_cache.invalidate(TOPIC_ANALYTICS)
+
+    return processed
+
+
+def _ceil(moment, granularity):
+    if granularity == 'hour':
+        floor = moment.replace(minute=0, second=0, microsecond=0)
+        step = timedelta(hours=1)
+    else:
+        floor = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        step = timedelta(days=1)
+    return floor if floor == moment else floor + step
+
+
+def _count_rollup(model, counts, event_name, start, end=None):
+    query = db.session.query(model.event_name, func.sum(model.count)).filter(model.bucket >= start)
+    if end is not None:
+        query = query.filter(model.bucket < end)
+    if event_name:
+        query = query.filter(model.event_name == event_name)
+    for name, total in query.group_by(model.event_name):
+        counts[name] += int(total or 0)
+
+
+def _count_raw(counts, event_name, start, end=None, min_id=None, max_id=None):
+    """Cuenta filas crudas en [start, end) usando solo las particiones necesarias"""
+    source = partitioned_source(AnalyticsEvent, start, end)
+    filters = [source.c.timestamp >= start]
+    if end is not None:
+        filters.append(source.c.timestamp < end)
+    if min_id is not None:
+        filters.append(source.c.id > min_id)
+    if max_id is not None:
+        filters.append(source.c.id <= max_id)
+    if event_name:
+        filters.append(source.c.event_name == event_name)
+
+    query = select(
+        source.c.event_name, func.sum(source.c.sample_weight)
+    ).where(*filters).group_by(source.c.event_name)
+    for name, total in db.session.execute(query):
+        counts[name] += int(total)
+
+
+def event_counts(start, event_name=None):
+    """
+    Conteo exacto de eventos por event_name desde start hasta ahora:
+      - filas crudas para la hora parcial inicial [start, primera hora completa)
+      - rollup horario hasta el primer día completo
+      - rollup diario a partir de ahí
+      - filas crudas con id > high-water mark (el bucket aún abierto)
+    """
+    hwm = get_checkpoint(ROLLUP_CHECKPOINT)
+    first_hour = _ceil(start, 'hour')
+    first_day = _ceil(first_hour, 'day')
+
+    counts = Counter()
+    if first_hour > start:
+        _count_raw(counts, event_name, start, first_hour, max_id=hwm)
+    _count_rollup(AnalyticsRollupHourly, counts, event_name, first_hour, first_day)
+    _count_rollup(AnalyticsRollupDaily, counts, event_name, first_day)
+    _count_raw(counts, event_name, start, min_id=hwm)
+    return dict(counts)
+
+
+def refresh_rollups():
+    """Pone al día los rollups si ANALYTICS_ROLLUP_ON_READ (sube la generación de analytics si hubo eventos)"""
+    if current_app.config.get('ANALYTICS_ROLLUP_ON_READ', True):
+        update_rollups()
+
@@ -0,0 +1,77 @@
+"""
+Analytics Sampling - Muestreo por event_name de eventos muy frecuentes
+
+ANALYTICS_SAMPLE_RATES indica qué eventos se guardan solo 1 de cada N,
+p. ej. "scroll=10,time_on_page=5". La decisión depende del hash (CRC32)
+de la session_id, así una sesión conserva todos sus eventos de ese tipo
+o ninguno; sin session_id se decide al azar con probabilidad 1/N.
+
+Las filas guardadas llevan sample_weight = N y los conteos (rollups,
+event_counts, sesiones, desgloses del admin) suman sample_weight en
+lugar de contar filas. Los visitantes únicos se cuentan antes del
+muestreo (ver persist_events), así que no se ven afectados.
+
+No conviene muestrear eventos de conversión ni pasos de un embudo: el
+embudo trabaja por sesión y solo vería las sesiones muestreadas.
+"""
+
+import random
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+from flask import current_app
+
+_stats = Counter()
+
+
+@lru_cache(maxsize=8)
+def parse_sample_rates(raw):
+    """'scroll=10,time_on_page=5' -> {'scroll': 10, 'time_on_page': 5} (ignora N <= 1)"""
+    rates = {}
+    for item in (raw or '').split(','):
+        name, _, value = item.partition('=')
+        name = name.strip()
+        try:
+            rate = int(value)
+        except ValueError:
+            continue
+        if name and rate > 1:
+            rates[name] = rate
+    return rates
+
+
+def sample_rates():
+    return parse_sample_rates(current_app.config.get('ANALYTICS_SAMPLE_RATES', ''))
+
+
+def keep_event(session_id, rate):
+    """True si el evento entra en la muestra 1-de-rate"""
+    if session_id:
+        return zlib.crc32(session_id.encode('utf-8')) % rate == 0
+    return random.random() * rate < 1
+
+
+def sample_rows(rows):
+    """Retorna las filas que se guardan, con sample_weight ajustado"""
+    rates = sample_rates()
+    if not rates:
+        return rows
+
+    kept = []
+    for row in rows:
+        rate = rates.get(row['event_name'])
+        if rate is None:
+            kept.append(row)
+        elif keep_event(row.get('session_id'), rate):
+            row['sample_weight'] = rate
+            kept.append(row)
+            _stats['kept'] += 1
+        else:
+            _stats['skipped'] += 1
+    return kept
+
+
+def sampling_stats():
+    """Filas muestreadas guardadas y descartadas en este worker"""
+    return {**_stats, 'rates': sample_rates()}
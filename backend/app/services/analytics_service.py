@@ -0,0 +1,77 @@
+"""
+Analytics Service - Persistencia de eventos de analytics
+"""
+
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models.analytics import AnalyticsEvent
+from app.services.analytics_buffer import analytics_buffer
+from app.services.analytics_dedupe import claim_event_ids, event_deduper
+from app.services.analytics_dimensions import dimension_cache
+from app.services.analytics_sampling import sample_rows
+from app.services.analytics_spool import analytics_spool
+from app.services.live_stream import live_stream
+from app.services.visitor_sketches import visitor_sketches
+
+
+def insert_events(rows):
+    """
+    Inserta una lista de eventos (dicts con las columnas de AnalyticsEvent)
+    en una única sentencia INSERT multi-fila y una sola transacción.
+    """
+    if not rows:
+        return 0
+
+    try:
+        conn = db.session.connection()
+        encoded = dimension_cache.encode_rows(conn, claim_event_ids(conn, rows))
+        if encoded:
+            db.session.execute(db.insert(AnalyticsEvent), encoded)
+        db.session.commit()
+    except Exception:
+        dimension_cache.clear()
+        raise
+
+    return len(encoded)
+
+
+def persist_events(rows):
+    """
+    Guarda eventos por el camino más barato disponible:
+    buffer write-behind -> spool en disco (si la BD está degradada) -> INSERT síncrono.
+    Retorna True si se escribieron en la base de datos y False si quedaron
+    diferidos (el endpoint responde 202).
+    """
+    # Reintentos y sendBeacon: fuera los event_id ya vistos (sin SELECT si la BD está caída)
+    db_down = analytics_spool.enabled and not analytics_spool.healthy
+    rows = event_deduper.filter_rows(rows, confirm=not db_down)
+    if not rows:
+        return True
+
+    # Los únicos se cuentan al recibir el evento, no al escribirlo (ni muestrear)
+    visitor_sketches.add_events(rows)
+    live_stream.record_events(rows)
+
+    rows = sample_rows(rows)
+    if not rows:
+        return True
+
+    if analytics_buffer.enabled and analytics_buffer.enqueue(rows):
+        return False
+
+    if analytics_spool.enabled and not analytics_spool.healthy:
+        analytics_spool.append(rows)
+        return False
+
+    try:
+        insert_events(rows)
+    except OperationalError as e:
+        db.session.rollback()
+        if not analytics_spool.enabled:
+            raise
+        analytics_spool.mark_unhealthy(e)
+        analytics_spool.append(rows)
+        return False
+
+    return True
@@ -0,0 +1,475 @@
+"""
+Analytics Spool - Cola durable en disco para eventos de analytics
+
+Cuando la base de datos está caída o lenta, los eventos se escriben en un
+spool local en lugar de perderse. El spool son segmentos de tamaño fijo
+(ANALYTICS_SPOOL_SEGMENT_BYTES) mapeados en memoria con registros
+prefijados por longitud:
+
+    segmento = MAGIC (8 bytes) + registro* + ceros
+    registro = longitud (uint32 LE) + crc32 (uint32 LE) + payload JSON
+
+Cada proceso escribe en su propio directorio (worker-<pid>), protegido con
+un flock, para que varios workers de gunicorn no compartan segmentos. Un
+hilo cargador reenvía los segmentos cerrados a analytics_events en bloque
+en cuanto la base de datos responde, y también recoge los directorios de
+workers que murieron (su flock ya no está tomado).
+
+Recuperación tras caída: al abrir un segmento se recorre hasta el primer
+registro vacío, truncado o con checksum incorrecto y se continúa
+escribiendo desde ahí (el resto se pone a cero). La entrega es
+"at-least-once": si el proceso muere entre el COMMIT y el borrado del
+segmento, ese segmento se vuelve a cargar.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+from sqlalchemy import DateTime
+
+from app import db
+from app.models.analytics import AnalyticsEvent
+from app.services.analytics_dedupe import claim_event_ids
+from app.services.analytics_dimensions import dimension_cache
+
+MAGIC = b'AGSPOOL\x01'
+RECORD_HEADER = struct.Struct('<II')  # longitud, crc32
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.spool'
+LOCK_FILE = 'LOCK'
+
+# Columnas DateTime de AnalyticsEvent (se serializan como ISO 8601)
+_DATETIME_COLUMNS = {
+    column.name for column in AnalyticsEvent.__table__.columns
+    if isinstance(column.type, DateTime)
+}
+
+
+def encode_row(row):
+    """Serializa una fila de AnalyticsEvent a bytes"""
+    data = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row.items()
+    }
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def decode_row(payload):
+    """Deserializa una fila escrita con encode_row"""
+    row = json.loads(payload.decode('utf-8'))
+    for key in _DATETIME_COLUMNS:
+        if row.get(key):
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+def scan_records(buf, size):
+    """
+    Recorre los registros válidos de un segmento y se detiene en el primer
+    registro vacío, truncado o con checksum incorrecto.
+    Retorna (payloads, offset_fin, corrupto).
+    """
+    payloads = []
+    offset = len(MAGIC)
+    while offset + RECORD_HEADER.size <= size:
+        length, crc = RECORD_HEADER.unpack_from(buf, offset)
+        if length == 0:
+            return payloads, offset, False
+        end = offset + RECORD_HEADER.size + length
+        if end > size:
+            return payloads, offset, True
+        payload = bytes(buf[offset + RECORD_HEADER.size:end])
+        if zlib.crc32(payload) != crc:
+            return payloads, offset, True
+        payloads.append(payload)
+        offset = end
+    return payloads, offset, False
+
+
+def read_segment(path):
+    """Lee un segmento completo. Retorna (payloads, corrupto)"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC):
+            return [], True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:len(MAGIC)] != MAGIC:
+                return [], True
+            payloads, _, corrupt = scan_records(buf, size)
+    return payloads, corrupt
+
+
+class SegmentWriter:
+    """Segmento activo de tamaño fijo mapeado en memoria"""
+
+    def __init__(self, path, size):
+        self.path = path
+        exists = os.path.exists(path)
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(size)
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._buf = mmap.mmap(self._file.fileno(), self.size)
+        self.records = 0
+        self.recovered_corrupt = False
+
+        if not exists or self._buf[:len(MAGIC)] != MAGIC:
+            self._buf[:len(MAGIC)] = MAGIC
+            self.offset = len(MAGIC)
+        else:
+            self.offset = self._recover()
+
+    def _recover(self):
+        """Busca el final de los datos válidos y limpia la cola rota"""
+        payloads, offset, corrupt = scan_records(self._buf, self.size)
+        self.records = len(payloads)
+        if corrupt:
+            self.recovered_corrupt = True
+            self._buf[offset:self.size] = bytes(self.size - offset)
+            self._buf.flush()
+        return offset
+
+    def fits(self, payload):
+        return self.offset + RECORD_HEADER.size + len(payload) <= self.size
+
+    def append(self, payload):
+        header = RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+        end = self.offset + len(header) + len(payload)
+        # Payload primero y cabecera después: un registro a medio escribir
+        # queda con longitud 0 o checksum incorrecto y se descarta.
+        self._buf[self.offset + len(header):end] = payload
+        self._buf[self.offset:self.offset + len(header)] = header
+        self.offset = end
+        self.records += 1
+
+    def flush(self):
+        self._buf.flush()
+
+    def close(self):
+        self._buf.flush()
+        self._buf.close()
+        self._file.close()
+
+
+class AnalyticsSpool:
+    """Spool durable en disco con cargador en segundo plano"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self.directory = None
+        self.segment_size = 4 * 1024 * 1024
+        self.replay_interval = 5.0
+        self.slow_ms = 2000
+        self.timeout_ms = 5000
+        self.batch_size = 1000
+
+        self._lock = threading.RLock()
+        self._writer = None
+        self._worker_dir = None
+        self._lock_file = None
+        self._pid = None
+        self._loader = None
+        self._stopping = threading.Event()
+        self.healthy = True
+
+        self._stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'corrupt_segments': 0,
+            'replay_errors': 0,
+            'last_replay_at': None,
+            'last_error': None,
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el spool a partir de la config de la app"""
+        self._app = app
+        self.directory = app.config.get('ANALYTICS_SPOOL_DIR') or os.path.join(
+            app.instance_path, 'analytics_spool'
+        )
+        self.segment_size = app.config.get('ANALYTICS_SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024)
+        self.replay_interval = app.config.get('ANALYTICS_SPOOL_REPLAY_SECONDS', 5)
+        self.slow_ms = app.config.get('ANALYTICS_SPOOL_SLOW_MS', 2000)
+        self.timeout_ms = app.config.get('ANALYTICS_SPOOL_DB_TIMEOUT_MS', 5000)
+        self.batch_size = app.config.get('ANALYTICS_SPOOL_BATCH_SIZE', 1000)
+        self.close()
+        self.healthy = True
+        app.extensions['analytics_spool'] = self
+
+    @property
+    def enabled(self):
+        return bool(self._app and self._app.config.get('ANALYTICS_SPOOL_ENABLED'))
+
+    # --------------------------------------------
+    # Escritura
+    # --------------------------------------------
+
+    def _check_fork(self):
+        """Tras un fork no se hereda el estado de escritura del padre"""
+        if self._pid is not None and self._pid != os.getpid():
+            self._pid = None
+            self._writer = None
+            self._lock_file = None
+            self._lock = threading.RLock()
+            self._loader = None
+
+    def _open(self):
+        """Abre el directorio y el segmento activo de este proceso"""
+        if self._pid is None:
+            self._pid = os.getpid()
+            self._worker_dir = os.path.join(self.directory, f'worker-{self._pid}')
+            os.makedirs(self._worker_dir, exist_ok=True)
+
+            self._lock_file = open(os.path.join(self._worker_dir, LOCK_FILE), 'a+')
+            if HAS_FCNTL:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        if self._writer is None:
+            segments = self._segments(self._worker_dir)
+            if segments:
+                path = segments[-1]
+            else:
+                path = self._segment_path(self._worker_dir, 1)
+            self._writer = SegmentWriter(path, self.segment_size)
+
+    def _rotate(self):
+        """Cierra el segmento activo y abre el siguiente"""
+        sequence = self._sequence(self._writer.path) + 1
+        self._writer.close()
+        self._writer = SegmentWriter(
+            self._segment_path(self._worker_dir, sequence), self.segment_size
+        )
+
+    def append(self, rows):
+        """Escribe filas en el spool (durable al retornar)"""
+        payloads = [encode_row(row) for row in rows]
+        max_payload = self.segment_size - len(MAGIC) - RECORD_HEADER.size
+
+        self._check_fork()
+        with self._lock:
+            self._open()
+            written = 0
+            for payload in payloads:
+                if len(payload) > max_payload:
+                    continue
+                if not self._writer.fits(payload):
+                    self._rotate()
+                self._writer.append(payload)
+                written += 1
+            self._writer.flush()
+
+        self._stats['spooled'] += written
+        self._ensure_loader()
+        return written
+
+    def mark_unhealthy(self, error=None):
+        """La base de datos falló o va lenta: desviar escrituras al spool"""
+        self.healthy = False
+        if error is not None:
+            self._stats['last_error'] = str(error)[:200]
+
+    # --------------------------------------------
+    # Carga (replay)
+    # --------------------------------------------
+
+    def _own_writer(self):
+        if self._pid == os.getpid():
+            return self._writer
+        return None
+
+    def pending_segments(self):
+        """Segmentos con datos pendientes de cargar (de todos los workers)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        writer = self._own_writer()
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            worker_dir = os.path.join(self.directory, name)
+            if os.path.isdir(worker_dir):
+                segments.extend(self._segments(worker_dir))
+        if writer is not None and not writer.records:
+            segments = [path for path in segments if path != writer.path]
+        return segments
+
+    def replay(self, engine=None):
+        """
+        Carga en analytics_events los segmentos cerrados de este proceso y
+        los de workers muertos. Un segmento se borra solo después del COMMIT.
+        Si la base de datos no responde, lanza la excepción y no borra nada.
+        """
+        if engine is None:
+            with self._app.app_context():
+                engine = db.engine
+
+        self._check_fork()
+        with self._lock:
+            writer = self._own_writer()
+            if writer is not None and writer.records:
+                self._rotate()
+            # Los segmentos propios se fijan aquí: un append posterior puede
+            # rotar y abrir uno nuevo que no se debe cargar ni borrar
+            writer = self._own_writer()
+            own_sealed = [
+                path for path in self._segments(self._worker_dir) if path != writer.path
+            ] if writer is not None else None
+
+        loaded = 0
+        for worker_dir, orphan_lock in self._replayable_dirs():
+            try:
+                if orphan_lock is None and own_sealed is not None:
+                    paths = own_sealed
+                else:
+                    paths = self._segments(worker_dir)
+                for path in paths:
+                    loaded += self._replay_segment(engine, path)
+                if orphan_lock is not None:
+                    shutil.rmtree(worker_dir, ignore_errors=True)
+            finally:
+                if orphan_lock is not None:
+                    orphan_lock.close()
+
+        self._stats['replayed'] += loaded
+        self._stats['last_replay_at'] = datetime.utcnow().isoformat()
+        self.healthy = True
+        return loaded
+
+    def _replay_segment(self, engine, path):
+        payloads, corrupt = read_segment(path)
+        if corrupt:
+            self._stats['corrupt_segments'] += 1
+        rows = [decode_row(payload) for payload in payloads]
+
+        if rows:
+            table = AnalyticsEvent.__table__
+            try:
+                with engine.begin() as conn:
+                    for start in range(0, len(rows), self.batch_size):
+                        batch = rows[start:start + self.batch_size]
+                        # Idempotente: un segmento reprocesado no duplica eventos con id
+                        encoded = dimension_cache.encode_rows(conn, claim_event_ids(conn, batch))
+                        if encoded:
+                            conn.execute(table.insert(), encoded)
+            except Exception:
+                dimension_cache.clear()
+                raise
+
+        os.remove(path)
+        return len(rows)
+
+    def _replayable_dirs(self):
+        """Directorio propio + directorios huérfanos (flock libre)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in sorted(os.listdir(self.directory)):
+            worker_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(worker_dir):
+                continue
+            if worker_dir == self._worker_dir and self._pid == os.getpid():
+                result.append((worker_dir, None))
+                continue
+            if not HAS_FCNTL:
+                continue
+            lock_file = open(os.path.join(worker_dir, LOCK_FILE), 'a+')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()  # Worker vivo: no tocar
+                continue
+            result.append((worker_dir, lock_file))
+        return result
+
+    def _ensure_loader(self):
+        if self._app is None:
+            return
+        if self._loader is not None and self._loader.is_alive():
+            return
+        self._stopping.clear()
+        self._loader = threading.Thread(target=self._run, name='analytics-spool', daemon=True)
+        self._loader.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.replay_interval):
+            if not self.pending_segments():
+                self.healthy = True
+                continue
+            try:
+                with self._app.app_context():
+                    started = time.perf_counter()
+                    db.session.execute(db.text('SELECT 1'))
+                    db.session.remove()
+                    if (time.perf_counter() - started) * 1000 > self.slow_ms:
+                        continue
+                    self.replay()
+            except Exception as e:
+                self._stats['replay_errors'] += 1
+                self.mark_unhealthy(e)
+
+    def close(self):
+        """Detiene el cargador y cierra el segmento activo"""
+        self._stopping.set()
+        loader = self._loader
+        if loader is not None and loader.is_alive() and loader is not threading.current_thread():
+            loader.join(timeout=5)
+        self._loader = None
+        with self._lock:
+            writer = self._own_writer()
+            if writer is not None:
+                writer.close()
+            self._writer = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            self._pid = None
+
+    def stats(self):
+        """Métricas del spool"""
+        pending = self.pending_segments()
+        stats = dict(self._stats)
+        stats.update({
+            'enabled': self.enabled,
+            'healthy': self.healthy,
+            'pending_segments': len(pending),
+            'pending_bytes': sum(os.path.getsize(path) for path in pending),
+        })
+        return stats
+
+    # --------------------------------------------
+    # Utilidades
+    # --------------------------------------------
+
+    @staticmethod
+    def _segment_path(directory, sequence):
+        return os.path.join(directory, f'{SEGMENT_PREFIX}{sequence:012d}{SEGMENT_SUFFIX}')
+
+    @staticmethod
+    def _sequence(path):
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    @staticmethod
+    def _segments(directory):
+        return [
+            os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        ]
+
+
+analytics_spool = AnalyticsSpool()
@@ -0,0 +1,106 @@
+"""
+Bloom Filter - Conjunto probabilístico de tamaño fijo
+
+Responde "seguro que no está" o "puede que esté" con una tasa de falsos
+positivos acotada. Para n elementos y tasa p se usan
+m = -n·ln(p) / ln(2)^2 bits y k = m/n·ln(2) funciones hash; con
+n = 100 000 y p = 0.1 % son ~180 KB y k = 10.
+
+Las k posiciones salen de un único blake2b de 128 bits con doble hashing
+(h1 + i·h2), así que añadir o consultar cuesta un hash y k accesos a un
+bytearray.
+
+RotatingBloomFilter mantiene dos generaciones: al llenarse la actual pasa
+a ser la anterior y se descarta la más vieja. Recuerda como mínimo los
+últimos `capacity` elementos sin crecer nunca.
+"""
+
+import hashlib
+import math
+
+
+def _hashes(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    digest = hashlib.blake2b(value, digest_size=16).digest()
+    # h2 impar: recorre todas las posiciones aunque m sea par
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter:
+    """Bloom filter de capacidad y tasa de falsos positivos fijas"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('capacity must be >= 1 and 0 < error_rate < 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        h1, h2 = _hashes(value)
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, value):
+        """Añade value; retorna True si (probablemente) ya estaba"""
+        bits = self._bits
+        present = True
+        for position in self._positions(value):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, value):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def size_bytes(self):
+        return len(self._bits)
+
+
+class RotatingBloomFilter:
+    """Dos generaciones de BloomFilter: memoria acotada y olvido de lo más antiguo"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self.rotations = 0
+
+    def add(self, value):
+        """Añade value; retorna True si (probablemente) se había visto"""
+        if self._previous is not None and value in self._previous:
+            self._current.add(value)
+            return True
+        present = self._current.add(value)
+        if self._current.full:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self.rotations += 1
+        return present
+
+    def __contains__(self, value):
+        return value in self._current or (self._previous is not None and value in self._previous)
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'current_count': self._current.count,
+            'rotations': self.rotations,
+            'size_bytes': self._current.size_bytes * (2 if self._previous is not None else 1),
+        }
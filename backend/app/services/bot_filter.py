@@ -0,0 +1,226 @@
+"""
+Bot Filter - Descarte de bots y crawlers en la ingesta de analytics
+
+Se aplica en /api/analytics/event, /api/analytics/batch y
+/api/analytics/pageview antes de guardar nada. Un evento se descarta si:
+
+- user_agent: el User-Agent coincide con el patrón de bots compilado de
+  user_agent (la clasificación va detrás de su LRU, así que para los
+  User-Agent repetidos cuesta una búsqueda en un dict)
+- empty_user_agent: no hay User-Agent (los navegadores siempre lo envían)
+- session_rate: la session_id supera BOT_SESSION_MAX_EVENTS eventos en una
+  ventana de BOT_SESSION_WINDOW_SECONDS; la sesión queda marcada hasta que
+  termina la ventana
+
+El tráfico descartado no llega a analytics_events ni a page_views: se
+cuenta por (hora, tipo, motivo) en memoria y un hilo vuelca los deltas a
+bot_traffic_counts cada BOT_FLUSH_SECONDS, igual que pageview_counter.
+
+Las ventanas por sesión son de cada worker (sin estado compartido), así
+que con N workers el límite efectivo puede llegar a N veces el
+configurado. El número de sesiones vigiladas está acotado por
+BOT_MAX_TRACKED_SESSIONS (se olvidan las menos recientes).
+"""
+
+import time
+from collections import Counter, OrderedDict
+
+from app import db
+from app.models.analytics import BotTrafficCount
+from app.services.analytics_rollup import upsert_counts
+from app.services.pageview_counter import hour_bucket
+from app.services.periodic_flusher import PeriodicFlusher
+from app.services.user_agent import classify_user_agent
+
+REASONS = ('user_agent', 'empty_user_agent', 'session_rate')
+
+
+class BotFilter(PeriodicFlusher):
+    """Detección de bots por User-Agent y ritmo por sesión, con conteo por motivo"""
+
+    thread_name = 'bot-counter'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._counts = Counter()
+        self._sessions = OrderedDict()
+
+        self.session_max_events = 120
+        self.session_window = 60.0
+        self.max_tracked_sessions = 50000
+        self.flush_interval = 30.0
+
+        self._stats = {'checked': 0, 'flushed': 0, 'failed_flushes': 0}
+        self._dropped = Counter()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el filtro a partir de la config de la app"""
+        self.session_max_events = app.config.get('BOT_SESSION_MAX_EVENTS', 120)
+        self.session_window = app.config.get('BOT_SESSION_WINDOW_SECONDS', 60)
+        self.max_tracked_sessions = app.config.get('BOT_MAX_TRACKED_SESSIONS', 50000)
+        self.flush_interval = app.config.get('BOT_FLUSH_SECONDS', 30)
+        self._sessions.clear()
+
+        self._register(app, 'bot_filter')
+
+    @property
+    def active(self):
+        return bool(self._app and self._app.config.get('BOT_FILTER_ENABLED', True))
+
+    @property
+    def buffered(self):
+        return bool(self._app and self._app.config.get('BOT_COUNTER_BUFFER_ENABLED'))
+
+    @property
+    def deferred(self):
+        return self.buffered
+
+    # ============================================
+    # DETECCIÓN
+    # ============================================
+
+    def _session_over_limit(self, session_id, now):
+        """Cuenta el evento en la ventana de la sesión; True si supera el límite"""
+        with self._lock:
+            window = self._sessions.get(session_id)
+            if window is None or now - window[0] >= self.session_window:
+                window = [now, 0]
+                self._sessions[session_id] = window
+                while len(self._sessions) > self.max_tracked_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            window[1] += 1
+            return window[1] > self.session_max_events
+
+    def check(self, row):
+        """Motivo por el que row es tráfico de bot, o None si parece humano"""
+        user_agent = row.get('user_agent')
+        if not user_agent:
+            return 'empty_user_agent'
+
+        device_type = row.get('device_type') or classify_user_agent(user_agent).device_type
+        if device_type == 'bot':
+            return 'user_agent'
+
+        session_id = row.get('session_id')
+        if session_id and self._session_over_limit(session_id, time.monotonic()):
+            return 'session_rate'
+        return None
+
+    def filter_rows(self, rows, kind):
+        """
+        Retorna las filas que no son de bots; las descartadas se cuentan por
+        motivo (kind: 'event' o 'pageview').
+        """
+        if not self.active:
+            return rows
+
+        self._check_fork()
+        kept = []
+        dropped = Counter()
+        for row in rows:
+            reason = self.check(row)
+            if reason is None:
+                kept.append(row)
+            else:
+                dropped[(hour_bucket(row['timestamp']), kind, reason)] += 1
+
+        self._stats['checked'] += len(rows)
+        if dropped:
+            self._record(dropped)
+        return kept
+
+    # ============================================
+    # CONTADORES
+    # ============================================
+
+    def _record(self, dropped):
+        for (_, kind, reason), count in dropped.items():
+            self._dropped[f'{kind}.{reason}'] += count
+
+        if not self.buffered:
+            # Sin acumulador (tests, scripts): escritura síncrona
+            self._write(dropped)
+            return
+
+        self._ensure_worker()
+        with self._lock:
+            self._counts.update(dropped)
+
+    def flush(self):
+        """Vuelca los conteos acumulados; retorna el número de eventos descartados escritos"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._counts:
+                    return 0
+                counts, self._counts = self._counts, Counter()
+
+            try:
+                with self._app.app_context():
+                    self._write(counts)
+            except Exception as e:
+                self._app.logger.error(f"Bot counter flush failed ({len(counts)} keys): {e}")
+                self._stats['failed_flushes'] += 1
+                with self._lock:
+                    # Los deltas son sumables: se reintentan en el próximo flush
+                    self._counts.update(counts)
+                return 0
+
+            written = sum(counts.values())
+            self._stats['flushed'] += written
+            return written
+
+    def _write(self, counts):
+        rows = [
+            {'bucket': bucket, 'kind': kind, 'reason': reason, 'count': count}
+            for (bucket, kind, reason), count in counts.items()
+        ]
+        try:
+            upsert_counts(BotTrafficCount, rows, BotTrafficCount.KEY_COLUMNS)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def stats(self):
+        """Descartes por motivo y métricas del filtro de este worker"""
+        stats = dict(self._stats)
+        stats.update({
+            'enabled': self.active,
+            'dropped': dict(self._dropped),
+            'pending': sum(self._counts.values()),
+            'tracked_sessions': len(self._sessions),
+            'session_max_events': self.session_max_events,
+            'session_window_s': self.session_window,
+        })
+        return stats
+
+    def _reset_state(self):
+        self._counts = Counter()
+        self._sessions = OrderedDict()
+
+
+bot_filter = BotFilter()
+
+
+def bot_summary(start):
+    """Tráfico de bots descartado desde start (lee bot_traffic_counts)"""
+    total = db.func.sum(BotTrafficCount.count)
+    rows = db.session.query(BotTrafficCount.kind, BotTrafficCount.reason, total).filter(
+        BotTrafficCount.bucket >= hour_bucket(start),
+    ).group_by(BotTrafficCount.kind, BotTrafficCount.reason).all()
+
+    by_reason = Counter()
+    by_kind = Counter()
+    for kind, reason, count in rows:
+        by_reason[reason] += int(count)
+        by_kind[kind] += int(count)
+    return {
+        'total': sum(by_reason.values()),
+        'by_reason': dict(by_reason),
+        'by_kind': dict(by_kind),
+    }
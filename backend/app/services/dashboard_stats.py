@@ -0,0 +1,103 @@
+"""
+Dashboard Stats - Estadísticas de /admin/stats con cache por período
+
+Las cifras de leads y de suscriptores salen de una consulta agregada por
+tabla con agregación condicional (count_if, ver sql_functions): totales,
+nuevos del período, pendientes, conteo por estado y leads por día de la
+última semana en una sola pasada sobre leads. Solo si aparece un estado
+que no está en Lead.ESTADOS se hace además el GROUP BY por estado.
+
+get_stats() guarda el resultado por valor de days en admin_cache, que
+lo invalida cuando cambian leads, newsletter_subscribers o
+analytics_events y recalcula single-flight: diez admins abriendo el
+dashboard a la vez lanzan una sola computación.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import db
+from app.models.lead import Lead
+from app.models.newsletter import NewsletterSubscriber
+from app.services.admin_cache import admin_cache, TOPIC_ANALYTICS, TOPIC_LEADS, TOPIC_NEWSLETTER
+from app.services.analytics_rollup import event_counts, refresh_rollups
+from app.services.sql_functions import count_if
+
+# Días de la serie leads por día
+LEADS_PER_DAY_WINDOW = 7
+
+
+def _lead_stats(start_date, now):
+    """Cifras de leads con una consulta (dos si hay estados desconocidos)"""
+    week_start = now - timedelta(days=LEADS_PER_DAY_WINDOW)
+    days = []
+    day = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day <= now:
+        days.append((day, max(day, week_start), day + timedelta(days=1)))
+        day += timedelta(days=1)
+
+    estados = [code for code, _ in Lead.ESTADOS]
+    columns = [
+        func.count(Lead.id),
+        count_if(Lead.created_at >= start_date),
+        count_if(Lead.estado == 'nuevo'),
+    ]
+    columns += [count_if(Lead.estado == estado) for estado in estados]
+    columns += [count_if((Lead.created_at >= low) & (Lead.created_at < high)) for _, low, high in days]
+    values = [int(value or 0) for value in db.session.execute(select(*columns)).one()]
+
+    total, nuevos, pendientes = values[:3]
+    por_estado_values = values[3:3 + len(estados)]
+    por_dia_values = values[3 + len(estados):]
+
+    por_estado = {estado: count for estado, count in zip(estados, por_estado_values) if count}
+    if sum(por_estado_values) != total:
+        # Estados fuera de Lead.ESTADOS (o NULL): conteo exacto por estado
+        por_estado = dict(
+            db.session.query(Lead.estado, func.count(Lead.id)).group_by(Lead.estado).all()
+        )
+
+    return {
+        'total': total,
+        'nuevos_periodo': nuevos,
+        'pendientes': pendientes,
+        'por_estado': por_estado,
+        'por_dia': [
+            {'fecha': day.date().isoformat(), 'total': count}
+            for (day, _, _), count in zip(days, por_dia_values) if count
+        ],
+    }
+
+
+def _newsletter_stats(start_date):
+    active = NewsletterSubscriber.is_active == True
+    total, nuevos = db.session.execute(select(
+        count_if(active),
+        count_if(active & (NewsletterSubscriber.created_at >= start_date)),
+    )).one()
+    return {'total_activos': int(total or 0), 'nuevos_periodo': int(nuevos or 0)}
+
+
+def compute_stats(days, now=None):
+    """Estadísticas del dashboard para los últimos days días (sin cache)"""
+    now = now or datetime.utcnow()
+    start_date = now - timedelta(days=days)
+    return {
+        'leads': _lead_stats(start_date, now),
+        'newsletter': _newsletter_stats(start_date),
+        'analytics': {
+            # Desde rollups + filas crudas del bucket abierto
+            'eventos_periodo': sum(event_counts(start_date).values()),
+        },
+        'periodo_dias': days,
+    }
+
+
+def get_stats(days):
+    """Estadísticas del dashboard desde admin_cache (se recalculan al cambiar sus tablas)"""
+    # Los rollups nuevos suben la generación de analytics y el valor se recalcula
+    refresh_rollups()
+    return admin_cache.get(
+        ('stats', days), (TOPIC_LEADS, TOPIC_NEWSLETTER, TOPIC_ANALYTICS), lambda: compute_stats(days),
+    )
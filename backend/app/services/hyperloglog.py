@@ -0,0 +1,103 @@
+"""
+HyperLogLog - Estimación de cardinalidad (visitantes/sesiones únicos)
+
+Sketch de tamaño fijo m = 2^p registros de un byte. Con p = 12 (4096
+registros) el error estándar es 1.04 / sqrt(m) ≈ 1.6 %: en el 95 % de los
+casos el valor real está a menos de ±3.3 % del estimado. Los conteos
+pequeños (< 2.5·m) usan linear counting y son prácticamente exactos.
+
+Dos sketches se combinan con el máximo registro a registro, así que la
+unión de N días cuesta N merges de m bytes sin volver a leer eventos, y
+añadir dos veces el mismo valor no cambia nada (idempotente).
+
+Serializado con zlib: un sketch con pocos valores ocupa unas decenas de
+bytes y uno saturado ~4 KB.
+"""
+
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 12
+
+# 2^-r precalculado para el estimador
+_INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+
+def _hash64(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+
+def standard_error(precision=DEFAULT_PRECISION):
+    """Error estándar relativo del estimador para una precisión p"""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+class HyperLogLog:
+    """Sketch HyperLogLog mergeable con hash de 64 bits"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f'Precisión no soportada: {precision}')
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError('Número de registros incorrecto para la precisión')
+
+    def add(self, value):
+        """Añade un valor (str/bytes) al sketch"""
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        """Unión con otro sketch (in place)"""
+        if other.precision != self.precision:
+            raise ValueError('No se pueden combinar sketches de distinta precisión')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Cardinalidad estimada"""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        total = sum(_INVERSE_POWERS[r] for r in self.registers)
+        estimate = alpha * m * m / total
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Rango pequeño: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def is_empty(self):
+        return not any(self.registers)
+
+    def to_bytes(self):
+        """Formato compacto: byte de precisión + registros comprimidos"""
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, blob):
+        return cls(precision=blob[0], registers=zlib.decompress(blob[1:]))
+
+    @classmethod
+    def union(cls, sketches, precision=DEFAULT_PRECISION):
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
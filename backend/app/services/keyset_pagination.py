@@ -0,0 +1,123 @@
+"""
+Keyset Pagination - Paginación por cursor (seek) en lugar de OFFSET
+
+OFFSET n obliga a la base de datos a leer y descartar n filas, y
+paginate() añade un COUNT(*) completo en cada página. Con keyset cada
+página es "las per_page filas siguientes a (valor, id)" sobre el índice
+de ordenación, cueste lo mismo la página 1 que la 1000:
+
+    WHERE (clave, id) < (:valor, :id) ORDER BY clave DESC, id DESC LIMIT per_page + 1
+
+La fila extra dice si hay más páginas sin contar nada. El id desempata
+valores repetidos de la clave.
+
+Los cursores son opacos y van firmados con SECRET_KEY (itsdangerous):
+guardan la columna y el sentido de ordenación, la dirección (next/prev)
+y la posición. Un cursor manipulado o de otra ordenación se rechaza con
+InvalidCursor.
+
+El total es opcional: 'exact' hace el COUNT(*) y 'estimate' usa la
+estimación del planner de PostgreSQL (EXPLAIN), exacta en otros motores.
+"""
+
+import json
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import func, select, tuple_
+
+from app import db
+
+CURSOR_SALT = 'keyset-cursor'
+
+
+class InvalidCursor(ValueError):
+    """Cursor con firma inválida o de otra ordenación"""
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=CURSOR_SALT)
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(order, direction, value, row_id):
+    """order: (columna, 'asc'|'desc'); direction: 'next'|'prev'"""
+    return _serializer().dumps({
+        'o': list(order), 'd': direction, 'v': _dump_value(value), 'i': row_id,
+    })
+
+
+def decode_cursor(token, order):
+    """Retorna (direction, value, id) o lanza InvalidCursor"""
+    try:
+        data = _serializer().loads(token)
+    except BadSignature as e:
+        raise InvalidCursor('Cursor inválido') from e
+    if not isinstance(data, dict) or data.get('o') != list(order) or data.get('d') not in ('next', 'prev'):
+        raise InvalidCursor('El cursor no corresponde a esta ordenación')
+    return data['d'], _load_value(data.get('v')), data.get('i')
+
+
+def keyset_page(query, sort_key, id_column, order, per_page, cursor=None):
+    """
+    Página de query (ORM, sin ORDER BY) ordenada por (sort_key, id_column).
+    order: (nombre de la clave, 'asc'|'desc'); cursor: token de una página
+    anterior o None para la primera. Retorna
+    {'items', 'next_cursor', 'prev_cursor'} (cursores None si no hay página).
+    items son las entidades de query, o tuplas si selecciona varias columnas.
+    """
+    direction, value, row_id = decode_cursor(cursor, order) if cursor else ('next', None, None)
+    descending = order[1] == 'desc'
+    # Hacia atrás se recorre en sentido contrario y se invierte el resultado
+    reverse = descending != (direction == 'prev')
+
+    if cursor:
+        position = tuple_(sort_key, id_column)
+        bound = tuple_(value, row_id)
+        query = query.filter(position < bound if reverse else position > bound)
+    if reverse:
+        query = query.order_by(sort_key.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_key.asc(), id_column.asc())
+
+    width = len(query.column_descriptions)
+    rows = query.add_columns(sort_key, id_column).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    items = [row[0] if width == 1 else tuple(row[:width]) for row in rows]
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or direction == 'prev':
+            next_cursor = encode_cursor(order, 'next', rows[-1][-2], rows[-1][-1])
+        if cursor and (has_more or direction == 'next'):
+            prev_cursor = encode_cursor(order, 'prev', rows[0][-2], rows[0][-1])
+    return {'items': items, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+def count_rows(query, mode):
+    """Total de filas de query: 'exact' (COUNT) o 'estimate' (planner de PostgreSQL)"""
+    if mode == 'estimate' and db.session.get_bind().dialect.name == 'postgresql':
+        compiled = query.statement.compile(dialect=db.session.get_bind().dialect)
+        plan = db.session.connection().exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        ).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]['Plan']['Plan Rows'])
+    return db.session.execute(
+        select(func.count()).select_from(query.order_by(None).subquery())
+    ).scalar()
@@ -0,0 +1,173 @@
+"""
+Lead Pipeline - Velocidad y conversión del pipeline de leads
+
+Parte de lead_transitions (una fila por alta o cambio de estado, escrita
+en la misma transacción que el cambio, ver models/lead.py). Para la
+cohorte de leads creados en [start, end) se leen sus transiciones en una
+consulta y el resto es NumPy sobre las columnas:
+
+- first_reached: matriz leads × estados con el primer instante en que
+  cada lead llegó a cada estado (np.fmin.at, NaN si nunca llegó).
+- conversión: leads que alcanzaron cada etapa de PIPELINE.
+- velocidad: días entre etapas consecutivas (y entre from/to a elección)
+  como diferencia de columnas de first_reached, con mediana/p75/media.
+- tiempo en estado: diferencia entre transiciones consecutivas del mismo
+  lead, agrupada por estado de origen.
+
+Los resultados se cachean por ventana de fechas en admin_cache (tema
+'leads'): se recalculan cuando cambia algún lead, no en cada petición.
+"""
+
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from app import db
+from app.models.lead import Lead, LeadTransition
+from app.services.admin_cache import admin_cache, TOPIC_LEADS
+
+# Etapas del pipeline en orden; perdido/descartado son salidas
+PIPELINE = ('nuevo', 'contactado', 'en_proceso', 'propuesta', 'ganado')
+ESTADOS = tuple(code for code, _ in Lead.ESTADOS)
+
+_SECONDS_PER_DAY = 86400.0
+
+
+def _days(values):
+    """datetime -> días desde epoch (float64)"""
+    return np.array(values, dtype='datetime64[us]').astype(np.int64) / 1e6 / _SECONDS_PER_DAY
+
+
+def _summary(durations):
+    durations = durations[~np.isnan(durations)]
+    durations = durations[durations >= 0]
+    if not len(durations):
+        return {'leads': 0, 'median_days': None, 'p75_days': None, 'mean_days': None}
+    median, p75 = np.percentile(durations, [50, 75])
+    return {
+        'leads': int(len(durations)),
+        'median_days': round(float(median), 2),
+        'p75_days': round(float(p75), 2),
+        'mean_days': round(float(durations.mean()), 2),
+    }
+
+
+def _load(start, end):
+    """Columnas de las transiciones de los leads creados en [start, end), en orden (lead, at)"""
+    cohort = select(Lead.id).where(Lead.created_at >= start, Lead.created_at < end)
+    rows = db.session.execute(
+        select(LeadTransition.lead_id, LeadTransition.to_estado, LeadTransition.at)
+        .where(LeadTransition.lead_id.in_(cohort))
+        .order_by(LeadTransition.lead_id, LeadTransition.at, LeadTransition.id)
+    ).all()
+    if not rows:
+        return None
+    lead_ids, estados, moments = zip(*rows)
+    return np.array(lead_ids, dtype=np.int64), np.array(estados, dtype=object), _days(moments)
+
+
+def compute_pipeline(start, end, from_estado=None, to_estado=None):
+    """Informe de conversión y velocidad para los leads creados en [start, end)"""
+    report = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'leads': 0,
+        'conversion': [],
+        'velocity': [],
+        'time_in_estado': {},
+    }
+    loaded = _load(start, end)
+    if loaded is None:
+        if from_estado and to_estado:
+            report['from_to'] = {'from': from_estado, 'to': to_estado, **_summary(np.array([]))}
+        return report
+    lead_ids, estados, moments = loaded
+
+    leads, lead_index = np.unique(lead_ids, return_inverse=True)
+    estado_index = np.full(len(estados), -1, dtype=np.int64)
+    for i, estado in enumerate(ESTADOS):
+        estado_index[estados == estado] = i
+    known = estado_index >= 0
+
+    first_reached = np.full((len(leads), len(ESTADOS)), np.nan)
+    np.fmin.at(first_reached, (lead_index[known], estado_index[known]), moments[known])
+    reached = ~np.isnan(first_reached)
+
+    column = {estado: i for i, estado in enumerate(ESTADOS)}
+    report['leads'] = int(len(leads))
+
+    # Etapas en orden y después las salidas (perdido, descartado)
+    entered = int(reached[:, column[PIPELINE[0]]].sum())
+    exits = tuple(estado for estado in ESTADOS if estado not in PIPELINE)
+    for estado in PIPELINE + exits:
+        count = int(reached[:, column[estado]].sum())
+        report['conversion'].append({
+            'estado': estado,
+            'leads': count,
+            'rate': round(count / entered, 4) if entered else None,
+        })
+
+    for current, following in zip(PIPELINE, PIPELINE[1:]):
+        durations = first_reached[:, column[following]] - first_reached[:, column[current]]
+        report['velocity'].append({'from': current, 'to': following, **_summary(durations)})
+
+    if from_estado and to_estado:
+        durations = first_reached[:, column[to_estado]] - first_reached[:, column[from_estado]]
+        report['from_to'] = {'from': from_estado, 'to': to_estado, **_summary(durations)}
+
+    # Tiempo en cada estado: de una transición a la siguiente del mismo lead
+    same_lead = lead_ids[1:] == lead_ids[:-1]
+    stays = (moments[1:] - moments[:-1])[same_lead]
+    stay_estados = estados[:-1][same_lead]
+    for estado in ESTADOS:
+        summary = _summary(stays[stay_estados == estado])
+        if summary['leads']:
+            report['time_in_estado'][estado] = summary
+
+    return report
+
+
+def pipeline_report(start, end, from_estado=None, to_estado=None):
+    """compute_pipeline cacheado por ventana hasta el próximo cambio en leads"""
+    for estado in (from_estado, to_estado):
+        if estado is not None and estado not in ESTADOS:
+            raise ValueError(f"Estado inválido: {estado}")
+    if bool(from_estado) != bool(to_estado):
+        raise ValueError('from y to deben indicarse juntos')
+    return admin_cache.get(
+        ('pipeline', start, end, from_estado, to_estado), (TOPIC_LEADS,),
+        lambda: compute_pipeline(start, end, from_estado, to_estado),
+    )
+
+
+def backfill_transitions():
+    """
+    Crea el historial mínimo de los leads sin transiciones (anteriores a
+    lead_transitions): alta en 'nuevo' en created_at, paso a 'contactado'
+    en contacted_at si existe y el estado actual en updated_at. Retorna
+    cuántos leads se completaron.
+    """
+    has_history = select(LeadTransition.lead_id).distinct()
+    leads = db.session.execute(
+        select(Lead.id, Lead.estado, Lead.created_at, Lead.contacted_at, Lead.updated_at)
+        .where(Lead.id.notin_(has_history))
+    ).all()
+
+    rows = []
+    for lead_id, estado, created_at, contacted_at, updated_at in leads:
+        created_at = created_at or datetime.utcnow()
+        rows.append({'lead_id': lead_id, 'from_estado': None, 'to_estado': 'nuevo', 'at': created_at})
+        previous = 'nuevo'
+        if contacted_at and estado != 'nuevo':
+            rows.append({'lead_id': lead_id, 'from_estado': 'nuevo', 'to_estado': 'contactado',
+                         'at': contacted_at})
+            previous = 'contactado'
+        if estado and estado != previous:
+            rows.append({'lead_id': lead_id, 'from_estado': previous, 'to_estado': estado,
+                         'at': max(updated_at or created_at, contacted_at or created_at)})
+
+    if rows:
+        db.session.execute(LeadTransition.__table__.insert(), rows)
+    db.session.commit()
+    return len(leads)
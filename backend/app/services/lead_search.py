@@ -0,0 +1,203 @@
+"""
+Lead Search - Búsqueda de texto completo en leads
+
+Sustituye a nombre/email/proyecto ILIKE '%x%', que ningún índice B-tree
+puede servir: cada búsqueda recorría la tabla entera leyendo proyecto.
+
+PostgreSQL: columna generada leads.search_vector (tsvector con la
+configuración 'spanish' para nombre y proyecto y 'simple' para el email
+partido por @ y .) con índice GIN. Al ser GENERATED ... STORED se
+mantiene sola en cada INSERT/UPDATE. Ranking con ts_rank_cd y
+fragmentos con ts_headline.
+
+SQLite: tabla FTS5 leads_fts de contenido externo (content='leads')
+mantenida por triggers de INSERT/UPDATE/DELETE sobre leads. Ranking con
+bm25 y fragmentos con snippet(). FTS5 no trae stemming en español; la
+búsqueda por prefijo cubre plurales y variantes habituales.
+
+Cada palabra buscada es un prefijo ("juan gar" -> juan* AND gar*): el
+principio de un nombre, de una palabra del proyecto o del dominio del
+email sigue encontrando el lead. nombre y email pesan más que proyecto.
+Los fragmentos se escapan como HTML y solo los términos van en <mark>.
+
+ensure_search_index() crea lo que falte (after_create de leads y
+create_app, para bases existentes) y rellena el índice. En otros motores,
+o si no se pudo crear, la búsqueda vuelve a ILIKE.
+"""
+
+import html
+import re
+
+from flask import current_app
+from sqlalchemy import Float, Integer, bindparam, event, func, literal_column, select, text
+
+from app import db
+from app.models.lead import Lead
+
+# Palabras de búsqueda usadas como máximo
+MAX_TERMS = 8
+
+# Marcadores de los fragmentos antes de escapar el HTML
+_START, _STOP = '\x02', '\x03'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Pesos de bm25 por columna de leads_fts (nombre, email, proyecto)
+_BM25_WEIGHTS = '10.0, 10.0, 1.0'
+
+_PG_VECTOR = (
+    "setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') || "
+    "setweight(to_tsvector('simple', translate(coalesce(email, ''), '@.', '  ')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(proyecto, '')), 'B')"
+)
+
+_SQLITE_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads BEGIN "
+    "INSERT INTO leads_fts (rowid, nombre, email, proyecto) "
+    "VALUES (new.id, new.nombre, new.email, new.proyecto); END",
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads BEGIN "
+    "INSERT INTO leads_fts (leads_fts, rowid, nombre, email, proyecto) "
+    "VALUES ('delete', old.id, old.nombre, old.email, old.proyecto); END",
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF nombre, email, proyecto ON leads BEGIN "
+    "INSERT INTO leads_fts (leads_fts, rowid, nombre, email, proyecto) "
+    "VALUES ('delete', old.id, old.nombre, old.email, old.proyecto); "
+    "INSERT INTO leads_fts (rowid, nombre, email, proyecto) "
+    "VALUES (new.id, new.nombre, new.email, new.proyecto); END",
+)
+
+
+# ============================================
+# ÍNDICE
+# ============================================
+
+def _ensure_postgresql(conn):
+    exists = conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'leads' AND column_name = 'search_vector'"
+    )).first()
+    if not exists:
+        conn.execute(text(
+            f"ALTER TABLE leads ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({_PG_VECTOR}) STORED"
+        ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_leads_search_vector ON leads USING GIN (search_vector)"
+    ))
+
+
+def _ensure_sqlite(conn):
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leads_fts'"
+    )).first()
+    if not exists:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE leads_fts USING fts5("
+            "nombre, email, proyecto, content='leads', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    for trigger in _SQLITE_TRIGGERS:
+        conn.execute(text(trigger))
+    if not exists:
+        # Leads anteriores al índice
+        conn.execute(text("INSERT INTO leads_fts (leads_fts) VALUES ('rebuild')"))
+
+
+def ensure_search_index(conn=None):
+    """Crea el índice de búsqueda si falta. Retorna False si el motor no lo soporta"""
+    if conn is None:
+        with db.engine.begin() as conn:
+            return ensure_search_index(conn)
+
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        _ensure_postgresql(conn)
+    elif dialect == 'sqlite':
+        _ensure_sqlite(conn)
+    else:
+        return False
+    return True
+
+
+@event.listens_for(Lead.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    ensure_search_index(connection)
+
+
+@event.listens_for(Lead.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    # La columna generada y el índice GIN caen con la tabla; leads_fts no
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS leads_fts'))
+
+
+# ============================================
+# CONSULTAS
+# ============================================
+
+def search_terms(search):
+    return _TERM_RE.findall(search.lower())[:MAX_TERMS]
+
+
+def _enabled():
+    return current_app.extensions.get('lead_search', False)
+
+
+def _pg_query(terms):
+    return func.to_tsquery('spanish', ' & '.join(f'{term}:*' for term in terms))
+
+
+def _fts5_match(terms):
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def apply_search(query, search):
+    """
+    Filtra query (de Lead) por search. Retorna (query, relevancia), donde
+    relevancia es una expresión para ordenar (mayor es mejor) o None si
+    la búsqueda se hizo con ILIKE.
+    """
+    terms = search_terms(search)
+    if not terms or not _enabled():
+        pattern = f'%{search}%'
+        return query.filter(db.or_(
+            Lead.nombre.ilike(pattern),
+            Lead.email.ilike(pattern),
+            Lead.proyecto.ilike(pattern),
+        )), None
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        vector = literal_column('leads.search_vector')
+        tsquery = _pg_query(terms)
+        return query.filter(vector.op('@@')(tsquery)), func.ts_rank_cd(vector, tsquery)
+
+    matches = text(
+        f"SELECT rowid AS id, -bm25(leads_fts, {_BM25_WEIGHTS}) AS rank "
+        "FROM leads_fts WHERE leads_fts MATCH :match"
+    ).bindparams(match=_fts5_match(terms)).columns(id=Integer, rank=Float).subquery('lead_matches')
+    return query.join(matches, matches.c.id == Lead.id), matches.c.rank
+
+
+def _highlight(fragment):
+    return html.escape(fragment or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def snippets(search, lead_ids):
+    """{id: fragmento HTML con los términos en <mark>} para los leads de una página"""
+    terms = search_terms(search)
+    if not lead_ids or not terms or not _enabled():
+        return {}
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=20, MinWords=8, MaxFragments=2'
+        rows = db.session.execute(
+            select(Lead.id, func.ts_headline('spanish', Lead.proyecto, _pg_query(terms), options))
+            .where(Lead.id.in_(lead_ids))
+        )
+    else:
+        rows = db.session.execute(
+            text(
+                "SELECT rowid, snippet(leads_fts, -1, :start, :stop, '…', 16) FROM leads_fts "
+                "WHERE leads_fts MATCH :match AND rowid IN :ids"
+            ).bindparams(bindparam('ids', expanding=True)),
+            {'start': _START, 'stop': _STOP, 'match': _fts5_match(terms), 'ids': list(lead_ids)},
+        )
+    return {lead_id: _highlight(fragment) for lead_id, fragment in rows}
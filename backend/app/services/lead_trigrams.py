@@ -0,0 +1,333 @@
+"""
+Lead Trigrams - Búsqueda aproximada (con erratas) por nombre y email
+
+Un lead se indexa por los trigramas de "nombre email". Los trigramas son
+los de pg_trgm: cada palabra alfanumérica en minúsculas con dos espacios
+delante y uno detrás ('ana' -> '  a', ' an', 'ana', 'na '), así que el
+email se parte en usuario, dominio y TLD.
+
+Puntuación (igual que word_similarity de pg_trgm): fracción de los
+trigramas de lo buscado presentes en el lead. Escribir el principio de un
+nombre puntúa alto aunque el lead tenga más palabras; una errata solo
+pierde los trigramas que toca. Se exige un mínimo (LEAD_FUZZY_THRESHOLD)
+y los empates se ordenan por similitud de conjuntos (similarity de
+pg_trgm), que favorece al lead más parecido en total.
+
+PostgreSQL: extensión pg_trgm e índice GIN gin_trgm_ops sobre la
+expresión "nombre || ' ' || email"; la consulta usa el operador <% para
+que el índice filtre candidatos.
+
+SQLite: índice invertido en memoria del proceso (trigrama -> ids),
+construido al arrancar y actualizado en cada commit con los leads
+creados, borrados o con nombre/email cambiado (hooks de la sesión, como
+admin_cache). Una búsqueda cuenta coincidencias con un np.bincount sobre
+las listas de sus trigramas (arrays cacheados hasta que cambian) y
+descarta por umbral sin tocar la base de datos. Las escrituras de otros procesos y las sentencias
+UPDATE/DELETE masivas se recogen reconstruyendo el índice
+(LEAD_FUZZY_MAX_AGE_SECONDS, o en la siguiente búsqueda tras un DML masivo).
+"""
+
+import re
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event, func, inspect, literal, literal_column, select, text
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.lead import Lead
+from app.services.lead_serializer import project
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+# Texto indexado en PostgreSQL (la consulta debe usar la misma expresión que el índice)
+_PG_TEXT = "(coalesce(leads.nombre, '') || ' ' || coalesce(leads.email, ''))"
+_PG_INDEX_TEXT = "(coalesce(nombre, '') || ' ' || coalesce(email, ''))"
+
+_SESSION_KEY = 'lead_trigrams'
+_STALE = object()
+
+
+def trigrams(value):
+    """Trigramas de value al estilo pg_trgm"""
+    grams = set()
+    for word in _WORD_RE.findall((value or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def lead_text(nombre, email):
+    return f'{nombre or ""} {email or ""}'
+
+
+# ============================================
+# ÍNDICE EN MEMORIA (SQLite)
+# ============================================
+
+class LeadTrigramIndex:
+    """Índice invertido trigrama -> ids de lead, mantenido en los commits"""
+
+    def __init__(self, app=None):
+        self._postings = {}
+        self._arrays = {}
+        self._texts = {}
+        self._sizes = np.zeros(0, dtype=np.int32)
+        self._lock = threading.Lock()
+        self._built_at = None
+        self.enabled = False
+        self.pg_index = False
+        self.max_age = 300
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Activa el índice en memoria si la base de datos es SQLite"""
+        self.enabled = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+        self.pg_index = False
+        self.max_age = app.config.get('LEAD_FUZZY_MAX_AGE_SECONDS', 300)
+        self._swap(LeadTrigramIndex(), built_at=None)
+        _register_session_hooks()
+        app.extensions['lead_trigrams'] = self
+
+    def setup(self):
+        """Al arrancar (con contexto de app): índice GIN en PostgreSQL o construcción en memoria"""
+        if self.enabled:
+            self.rebuild()
+        else:
+            self.pg_index = ensure_trigram_index()
+
+    def _swap(self, other, built_at):
+        with self._lock:
+            self._postings, self._arrays = other._postings, other._arrays
+            self._texts, self._sizes = other._texts, other._sizes
+            self._built_at = built_at
+
+    def _add(self, lead_id, value):
+        grams = trigrams(value)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(lead_id)
+            self._arrays.pop(gram, None)
+        if lead_id >= len(self._sizes):
+            grown = np.zeros(max(lead_id + 1, 2 * len(self._sizes)), dtype=np.int32)
+            grown[:len(self._sizes)] = self._sizes
+            self._sizes = grown
+        self._sizes[lead_id] = len(grams)
+        self._texts[lead_id] = value
+
+    def _remove(self, lead_id):
+        value = self._texts.pop(lead_id, None)
+        if value is None:
+            return
+        self._sizes[lead_id] = 0
+        for gram in trigrams(value):
+            self._arrays.pop(gram, None)
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(lead_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def _posting_array(self, gram):
+        """Lista de ids de gram como array (cacheado hasta que cambie)"""
+        array = self._arrays.get(gram)
+        if array is None:
+            array = np.fromiter(self._postings.get(gram, ()), dtype=np.int64)
+            self._arrays[gram] = array
+        return array
+
+    def rebuild(self):
+        """Reconstruye el índice con todos los leads; retorna cuántos indexó"""
+        rows = db.session.execute(select(Lead.id, Lead.nombre, Lead.email)).all()
+        fresh = LeadTrigramIndex()
+        for lead_id, nombre, email in rows:
+            fresh._add(lead_id, lead_text(nombre, email))
+        self._swap(fresh, built_at=time.monotonic())
+        return len(rows)
+
+    def apply(self, changes):
+        """changes: {id: texto nuevo o None si se borró}"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            for lead_id, value in changes.items():
+                self._remove(lead_id)
+                if value is not None:
+                    self._add(lead_id, value)
+
+    def mark_stale(self):
+        with self._lock:
+            self._built_at = None
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None or (self.max_age > 0 and time.monotonic() - built_at > self.max_age):
+            self.rebuild()
+
+    def lookup(self, query, threshold, limit):
+        """[(id, puntuación, similitud)] de mayor a menor puntuación"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        self._ensure_fresh()
+
+        total = len(grams)
+        with self._lock:
+            postings = [self._posting_array(gram) for gram in grams]
+            postings = [array for array in postings if len(array)]
+            if not postings:
+                return []
+            # Coincidencias por lead: un bincount sobre las listas de los trigramas buscados
+            counts = np.bincount(np.concatenate(postings))
+            candidates = np.flatnonzero(counts >= threshold * total - 1e-9)
+            common = counts[candidates]
+            similarity = common / (total + self._sizes[candidates] - common)
+
+        # Orden por coincidencias y, a igualdad, por similitud (< 1, no cruza de un entero al siguiente)
+        key = common * 2 + similarity
+        if len(key) > limit:
+            top = np.argpartition(-key, limit - 1)[:limit]
+        else:
+            top = np.arange(len(key))
+        top = top[np.argsort(-key[top], kind='stable')]
+        return [(int(candidates[i]), common[i] / total, float(similarity[i])) for i in top]
+
+
+lead_trigrams = LeadTrigramIndex()
+
+
+# ============================================
+# HOOKS DE SQLALCHEMY
+# ============================================
+
+def _pending(session):
+    return session.info.setdefault(_SESSION_KEY, {})
+
+
+def _after_flush(session, flush_context):
+    if not lead_trigrams.enabled:
+        return
+    for obj in session.new:
+        if isinstance(obj, Lead):
+            _pending(session)[obj.id] = lead_text(obj.nombre, obj.email)
+    for obj in session.dirty:
+        if isinstance(obj, Lead):
+            state = inspect(obj)
+            if state.attrs.nombre.history.has_changes() or state.attrs.email.history.has_changes():
+                _pending(session)[obj.id] = lead_text(obj.nombre, obj.email)
+    for obj in session.deleted:
+        if isinstance(obj, Lead):
+            _pending(session)[obj.id] = None
+
+
+def _do_orm_execute(orm_execute_state):
+    statement = orm_execute_state.statement
+    if lead_trigrams.enabled and getattr(statement, 'is_dml', False) \
+            and getattr(statement.table, 'name', None) == Lead.__tablename__:
+        _pending(orm_execute_state.session)[_STALE] = True
+
+
+def _after_commit(session):
+    changes = session.info.pop(_SESSION_KEY, None)
+    if not changes:
+        return
+    if changes.pop(_STALE, False):
+        lead_trigrams.mark_stale()
+    else:
+        lead_trigrams.apply(changes)
+
+
+def _after_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'do_orm_execute', _do_orm_execute)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _hooks_registered = True
+
+
+# ============================================
+# POSTGRESQL
+# ============================================
+
+def ensure_trigram_index(conn=None):
+    """
+    Crea pg_trgm y el índice GIN en PostgreSQL. Retorna False si no se
+    pudo (la extensión requiere permisos) o el motor no es PostgreSQL.
+    """
+    if conn is None:
+        with db.engine.connect() as conn:
+            return ensure_trigram_index(conn)
+    if conn.dialect.name != 'postgresql':
+        return False
+
+    savepoint = conn.begin_nested() if conn.in_transaction() else conn.begin()
+    try:
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_leads_nombre_email_trgm '
+            f'ON leads USING GIN ({_PG_INDEX_TEXT} gin_trgm_ops)'
+        ))
+        savepoint.commit()
+    except Exception:
+        savepoint.rollback()
+        return False
+    return True
+
+
+@event.listens_for(Lead.__table__, 'after_create')
+def _create_trigram_index(target, connection, **kw):
+    ensure_trigram_index(connection)
+
+
+def _pg_lookup(query, threshold, limit):
+    indexed = literal_column(_PG_TEXT)
+    score = func.word_similarity(query, indexed)
+    similarity = func.similarity(query, indexed)
+    # Umbral del operador <% solo para esta transacción
+    db.session.execute(select(func.set_config('pg_trgm.word_similarity_threshold', str(threshold), True)))
+    return db.session.execute(
+        select(Lead.id, score, similarity)
+        .where(literal(query).op('<%')(indexed))
+        .order_by(score.desc(), similarity.desc(), Lead.id.desc())
+        .limit(limit)
+    ).all()
+
+
+# ============================================
+# BÚSQUEDA
+# ============================================
+
+def fuzzy_search(query, threshold, limit):
+    """
+    Leads cuyo nombre/email se parecen a query, de más a menos parecido:
+    [(fila de lead_serializer.project, puntuación, similitud)]. None si no
+    hay índice de trigramas (PostgreSQL sin pg_trgm).
+    """
+    if lead_trigrams.enabled:
+        ranked = lead_trigrams.lookup(query, threshold, limit)
+    elif lead_trigrams.pg_index:
+        ranked = _pg_lookup(query, threshold, limit)
+    else:
+        return None
+
+    if not ranked:
+        return []
+    rows = project(Lead.query.filter(Lead.id.in_([row[0] for row in ranked]))).all()
+    leads = {row.id: row for row in rows}
+    return [
+        (leads[lead_id], float(score), float(similarity))
+        for lead_id, score, similarity in ranked if lead_id in leads
+    ]
+
@@ -0,0 +1,357 @@
+"""
+Live Stream - Contadores en vivo para el dashboard (Server-Sent Events)
+
+Los caminos de ingesta (persist_events, formulario de contacto,
+newsletter) suman en un ring buffer en memoria de LIVE_STREAM_WINDOW_MINUTES
+minutos: eventos por event_name, leads nuevos y suscriptores nuevos.
+/admin/analytics/live emite un snapshot cada LIVE_STREAM_INTERVAL_SECONDS
+sin tocar la base de datos: la conexión del request se libera antes de
+empezar el stream.
+
+Cada worker de gunicorn tiene su propio ring buffer. Con
+LIVE_STREAM_SHARED activado, un hilo publica el de este worker cada
+LIVE_STREAM_PUBLISH_SECONDS en <LIVE_STREAM_DIR>/worker-<pid>.json
+(escritura atómica con os.replace) y el snapshot suma los ficheros
+recientes de todos los workers. Los ficheros de workers muertos dejan de
+contarse al envejecer y se borran pasada la ventana.
+
+El snapshot se calcula como mucho una vez por intervalo y lo comparten
+todas las pestañas conectadas a este worker. Cada stream dura como mucho
+LIVE_STREAM_MAX_SECONDS (EventSource reconecta solo), así un thread de
+gunicorn no queda ocupado indefinidamente.
+
+Cada stream ocupa un thread del worker (gthread), así que
+LIVE_STREAM_MAX_SUBSCRIBERS no puede pasar de GUNICORN_THREADS - 2: con
+todas las pestañas abiertas quedan threads para la ingesta pública. La
+plaza se reserva con el lock antes de responder y se libera al terminar
+el stream o al cerrarse la conexión (close() del iterable WSGI).
+"""
+
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from app.services.periodic_flusher import PeriodicFlusher
+
+FILE_PREFIX = 'worker-'
+
+
+def _minute(now=None):
+    return int((now if now is not None else time.time()) // 60)
+
+
+def _new_bucket():
+    return {'events': Counter(), 'leads': 0, 'subscribers': 0}
+
+
+class LiveStream(PeriodicFlusher):
+    """Ring buffer por minuto de la actividad de ingesta, publicado entre workers"""
+
+    thread_name = 'live-stream'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._minutes = OrderedDict()
+        self._version = 0
+        self._published_version = 0
+        self._snapshot = None
+        self._snapshot_at = 0.0
+        self.subscribers = 0
+
+        self.directory = None
+        self.window = 60
+        self.interval = 2.0
+        self.publish_interval = 2.0
+        self.max_seconds = 300
+        self.max_subscribers = 6
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el ring buffer a partir de la config de la app"""
+        self.directory = app.config.get('LIVE_STREAM_DIR') or os.path.join(
+            app.instance_path, 'live_stream'
+        )
+        self.window = app.config.get('LIVE_STREAM_WINDOW_MINUTES', 60)
+        self.interval = app.config.get('LIVE_STREAM_INTERVAL_SECONDS', 2)
+        self.publish_interval = app.config.get('LIVE_STREAM_PUBLISH_SECONDS', 2)
+        self.max_seconds = app.config.get('LIVE_STREAM_MAX_SECONDS', 300)
+        self.max_subscribers = _subscriber_cap(app)
+        self._minutes.clear()
+        self._snapshot = None
+
+        self._register(app, 'live_stream')
+
+    @property
+    def shared(self):
+        return bool(self._app and self._app.config.get('LIVE_STREAM_SHARED'))
+
+    @property
+    def deferred(self):
+        return self.shared
+
+    @property
+    def flush_interval(self):
+        return self.publish_interval
+
+    # ============================================
+    # REGISTRO (caminos de ingesta)
+    # ============================================
+
+    def _bucket(self, minute):
+        """Bucket del minuto (con el lock tomado); descarta los que salen de la ventana"""
+        bucket = self._minutes.get(minute)
+        if bucket is None:
+            bucket = self._minutes[minute] = _new_bucket()
+            while self._minutes and next(iter(self._minutes)) <= minute - self.window:
+                self._minutes.popitem(last=False)
+        return bucket
+
+    def _touch(self):
+        self._version += 1
+        if self.shared:
+            self._ensure_worker()
+
+    def record_events(self, rows):
+        """Suma eventos recibidos en el minuto actual (rows con event_name)"""
+        self._check_fork()
+        minute = _minute()
+        with self._lock:
+            self._bucket(minute)['events'].update(row['event_name'] for row in rows)
+            self._touch()
+
+    def record_lead(self):
+        self._check_fork()
+        with self._lock:
+            self._bucket(_minute())['leads'] += 1
+            self._touch()
+
+    def record_subscriber(self):
+        self._check_fork()
+        with self._lock:
+            self._bucket(_minute())['subscribers'] += 1
+            self._touch()
+
+    # ============================================
+    # SNAPSHOT
+    # ============================================
+
+    def _local_minutes(self):
+        with self._lock:
+            return {
+                minute: {'events': dict(bucket['events']), 'leads': bucket['leads'],
+                         'subscribers': bucket['subscribers']}
+                for minute, bucket in self._minutes.items()
+            }
+
+    def _worker_files(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        own = f'{FILE_PREFIX}{os.getpid()}.json'
+        return [
+            os.path.join(self.directory, name) for name in names
+            if name.startswith(FILE_PREFIX) and name.endswith('.json') and name != own
+        ]
+
+    def _other_workers(self, now):
+        """Ring buffers publicados por los demás workers (solo los recientes)"""
+        stale_after = max(self.publish_interval * 5, 10)
+        published = []
+        for path in self._worker_files():
+            try:
+                age = now - os.path.getmtime(path)
+                if age > self.window * 60:
+                    # Worker muerto hace tiempo
+                    os.remove(path)
+                    continue
+                if age > stale_after:
+                    continue
+                with open(path, encoding='utf-8') as fh:
+                    published.append({int(minute): bucket for minute, bucket in json.load(fh).items()})
+            except (OSError, ValueError):
+                # Fichero a medio borrar o de otra versión: se ignora
+                continue
+        return published
+
+    def snapshot(self, now=None):
+        """
+        Contadores de la ventana sumando todos los workers. Se recalcula
+        como mucho una vez por intervalo (compartido por los suscriptores).
+        """
+        now = now if now is not None else time.time()
+        cached = self._snapshot
+        if cached is not None and now - self._snapshot_at < self.interval:
+            return cached
+
+        sources = [self._local_minutes()]
+        if self.shared:
+            sources += self._other_workers(now)
+
+        current = _minute(now)
+        merged = {}
+        for source in sources:
+            for minute, bucket in source.items():
+                if minute <= current - self.window:
+                    continue
+                target = merged.setdefault(minute, _new_bucket())
+                target['events'].update(bucket['events'])
+                target['leads'] += bucket['leads']
+                target['subscribers'] += bucket['subscribers']
+
+        totals = _new_bucket()
+        minutes = []
+        for minute in sorted(merged):
+            bucket = merged[minute]
+            totals['events'].update(bucket['events'])
+            totals['leads'] += bucket['leads']
+            totals['subscribers'] += bucket['subscribers']
+            minutes.append({
+                'minute': datetime.utcfromtimestamp(minute * 60).isoformat(),
+                'events': dict(bucket['events']),
+                'leads': bucket['leads'],
+                'subscribers': bucket['subscribers'],
+            })
+
+        snapshot = {
+            'generated_at': datetime.utcfromtimestamp(now).isoformat(),
+            'window_minutes': self.window,
+            'workers': len(sources),
+            'totals': {
+                'events': dict(totals['events']),
+                'leads': totals['leads'],
+                'subscribers': totals['subscribers'],
+            },
+            'minutes': minutes,
+        }
+        self._snapshot, self._snapshot_at = snapshot, now
+        return snapshot
+
+    # ============================================
+    # SERVER-SENT EVENTS
+    # ============================================
+
+    def stream(self, duration=None):
+        """
+        Reserva una plaza y retorna el iterable de mensajes SSE (un evento
+        'counters' por intervalo durante duration segundos, como mucho
+        LIVE_STREAM_MAX_SECONDS), o None si este worker ya tiene
+        max_subscribers streams abiertos. No necesita contexto de app ni
+        de request.
+        """
+        duration = self.max_seconds if duration is None else min(duration, self.max_seconds)
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                return None
+            self.subscribers += 1
+        return _Subscription(self, self._messages(duration))
+
+    def _messages(self, duration):
+        yield f'retry: {int(self.interval * 1000)}\n\n'
+        deadline = time.monotonic() + duration
+        while True:
+            yield f'event: counters\ndata: {json.dumps(self.snapshot())}\n\n'
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.interval, remaining))
+
+    def _release(self):
+        with self._lock:
+            self.subscribers -= 1
+
+    # ============================================
+    # PUBLICACIÓN ENTRE WORKERS
+    # ============================================
+
+    def publish(self):
+        """Escribe el ring buffer de este worker para los demás; retorna True si escribió"""
+        if self._version == self._published_version:
+            return False
+        version = self._version
+        data = {str(minute): bucket for minute, bucket in self._local_minutes().items()}
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{FILE_PREFIX}{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(data, fh, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        self._published_version = version
+        return True
+
+    def flush(self):
+        """Publica el ring buffer (lo llama el hilo cada publish_interval)"""
+        try:
+            return self.publish()
+        except OSError as e:
+            if self._app is not None:
+                self._app.logger.error(f"Live stream publish failed: {e}")
+            return False
+
+    def _on_stop(self):
+        """Retira el fichero de este worker en lugar de publicarlo por última vez"""
+        if self.directory and self._pid == os.getpid():
+            try:
+                os.remove(os.path.join(self.directory, f'{FILE_PREFIX}{self._pid}.json'))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'shared': self.shared,
+            'subscribers': self.subscribers,
+            'max_subscribers': self.max_subscribers,
+            'minutes_buffered': len(self._minutes),
+        }
+
+    def _reset_state(self):
+        self._minutes = OrderedDict()
+        self._snapshot = None
+        self.subscribers = 0
+
+
+class _Subscription:
+    """Mensajes de un stream con su plaza reservada; la libera una sola vez al terminar o cerrarse"""
+
+    def __init__(self, owner, messages):
+        self._owner = owner
+        self._messages = messages
+        self._open = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._messages)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self._messages.close()
+            self._owner._release()
+
+
+def _subscriber_cap(app):
+    """LIVE_STREAM_MAX_SUBSCRIBERS acotado a GUNICORN_THREADS - 2 (con aviso si se pide más)"""
+    threads = app.config.get('GUNICORN_THREADS', 8)
+    limit = max(threads - 2, 1)
+    requested = app.config.get('LIVE_STREAM_MAX_SUBSCRIBERS', limit)
+    if requested > limit:
+        app.logger.warning(
+            f'LIVE_STREAM_MAX_SUBSCRIBERS={requested} would take every gunicorn thread '
+            f'(GUNICORN_THREADS={threads}); using {limit}'
+        )
+        return limit
+    return requested
+
+
+live_stream = LiveStream()
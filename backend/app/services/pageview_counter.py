@@ -0,0 +1,165 @@
+"""
+Page View Counter - Conteo de page views por ruta agregado en memoria
+
+Cada worker acumula en un dict {(hora, ruta): n} las page views recibidas
+y un hilo vuelca los deltas cada PAGEVIEW_FLUSH_SECONDS con un único
+upsert sobre page_view_counts (count = count + delta). Así una página
+muy visitada cuesta una fila por hora y por worker en lugar de un INSERT
+por carga.
+
+Solo una fracción PAGEVIEW_SAMPLE_RATE de las visitas se guarda además
+como fila cruda en page_views (referrer, sesión, user agent), para
+análisis puntuales.
+
+Si el flush falla, los deltas vuelven al acumulador y se reintentan en el
+siguiente intervalo. Lo pendiente se pierde si el proceso muere de forma
+abrupta, igual que en el buffer de eventos (ver analytics_buffer).
+"""
+
+import random
+from collections import Counter
+
+from app import db
+from app.models.analytics import PageView, PageViewCount
+from app.services.analytics_rollup import upsert_counts
+from app.services.periodic_flusher import PeriodicFlusher
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class PageViewCounter(PeriodicFlusher):
+    """Acumulador de page views por (hora, ruta) con flush periódico"""
+
+    thread_name = 'pageview-counter'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._counts = Counter()
+        self._samples = []
+
+        self.flush_interval = 10.0
+        self.sample_rate = 0.01
+        self.max_keys = 10000
+
+        self._stats = {'recorded': 0, 'sampled': 0, 'flushed': 0, 'failed_flushes': 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el contador a partir de la config de la app"""
+        self.flush_interval = app.config.get('PAGEVIEW_FLUSH_SECONDS', 10)
+        self.sample_rate = app.config.get('PAGEVIEW_SAMPLE_RATE', 0.01)
+        self.max_keys = app.config.get('PAGEVIEW_MAX_KEYS', 10000)
+
+        self._register(app, 'pageview_counter')
+
+    @property
+    def enabled(self):
+        return bool(self._app and self._app.config.get('PAGEVIEW_COUNTER_ENABLED'))
+
+    @property
+    def deferred(self):
+        return self.enabled
+
+    @property
+    def pending(self):
+        return sum(self._counts.values())
+
+    def record(self, row):
+        """
+        Registra una page view (row: dict con las columnas de page_views).
+        Retorna True si quedó escrita en la base de datos y False si está
+        pendiente del próximo flush.
+        """
+        sampled = random.random() < self.sample_rate
+
+        if not self.enabled:
+            # Sin acumulador (tests, scripts): escritura síncrona
+            self._write(Counter({(hour_bucket(row['timestamp']), row['path']): 1}), [row] if sampled else [])
+            self._stats['recorded'] += 1
+            self._stats['sampled'] += int(sampled)
+            return True
+
+        self._ensure_worker()
+        with self._lock:
+            self._counts[(hour_bucket(row['timestamp']), row['path'])] += 1
+            if sampled:
+                self._samples.append(row)
+            self._stats['recorded'] += 1
+            self._stats['sampled'] += int(sampled)
+            full = len(self._counts) >= self.max_keys
+
+        if full:
+            self._wakeup.set()
+        return False
+
+    def flush(self):
+        """Vuelca los deltas acumulados; retorna el número de page views escritas"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._counts and not self._samples:
+                    return 0
+                counts, self._counts = self._counts, Counter()
+                samples, self._samples = self._samples, []
+
+            try:
+                with self._app.app_context():
+                    self._write(counts, samples)
+            except Exception as e:
+                self._app.logger.error(f"Page view flush failed ({len(counts)} paths): {e}")
+                self._stats['failed_flushes'] += 1
+                with self._lock:
+                    # Reintentar en el próximo flush (los deltas son sumables)
+                    if len(self._counts) + len(counts) <= self.max_keys:
+                        self._counts.update(counts)
+                        self._samples.extend(samples)
+                return 0
+
+            written = sum(counts.values())
+            self._stats['flushed'] += written
+            return written
+
+    def _write(self, counts, samples):
+        rows = [
+            {'bucket': bucket, 'path': path, 'count': count}
+            for (bucket, path), count in counts.items()
+        ]
+        try:
+            upsert_counts(PageViewCount, rows, PageViewCount.KEY_COLUMNS)
+            if samples:
+                db.session.execute(db.insert(PageView), samples)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def stats(self):
+        """Métricas del contador de este worker"""
+        stats = dict(self._stats)
+        stats.update({
+            'enabled': self.enabled,
+            'pending_views': self.pending,
+            'pending_paths': len(self._counts),
+            'sample_rate': self.sample_rate,
+            'flush_interval_s': self.flush_interval,
+        })
+        return stats
+
+    def _reset_state(self):
+        self._counts = Counter()
+        self._samples = []
+
+
+pageview_counter = PageViewCounter()
+
+
+def popular_pages(start, limit=20):
+    """Rutas más vistas desde start (lee page_view_counts)"""
+    total = db.func.sum(PageViewCount.count)
+    rows = db.session.query(PageViewCount.path, total).filter(
+        PageViewCount.bucket >= hour_bucket(start),
+    ).group_by(PageViewCount.path).order_by(total.desc(), PageViewCount.path).limit(limit)
+    return [{'path': path, 'views': int(views)} for path, views in rows]
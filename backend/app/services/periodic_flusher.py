@@ -0,0 +1,117 @@
+"""
+Periodic Flusher - Base de los acumuladores por worker con hilo de flush
+
+pageview_counter, visitor_sketches, bot_filter, live_stream y
+analytics_buffer acumulan en memoria y un hilo por worker llama a flush()
+cada flush_interval segundos (o antes, si alguien hace _wakeup.set()).
+Esta clase reúne ese ciclo de vida:
+
+- el hilo se arranca la primera vez que hace falta (_ensure_worker), no
+  al importar, así que funciona igual con gunicorn --preload
+- tras un fork el proceso hijo no hereda hilo, locks ni datos del padre
+  (_check_fork + _reset_state de cada subclase)
+- stop() (atexit / gunicorn worker_exit) detiene el hilo y hace un último
+  flush
+
+Las subclases fijan flush_interval e implementan flush() y, si guardan algo
+en memoria, _reset_state().
+"""
+
+import atexit
+import os
+import threading
+
+
+class PeriodicFlusher:
+    """Hilo de flush por proceso, seguro tras fork, con parada ordenada"""
+
+    thread_name = 'periodic-flusher'
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+
+    def _register(self, app, name):
+        """Guarda la app, se publica en app.extensions y registra stop() al salir"""
+        self._app = app
+        app.extensions[name] = self
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    @property
+    def deferred(self):
+        """True si lo registrado espera al hilo (False: escritura síncrona)"""
+        return True
+
+    def flush(self):
+        raise NotImplementedError
+
+    def flush_pending(self):
+        """
+        Vuelca lo pendiente de este worker antes de leer; lo de los demás
+        workers llega en su próximo flush.
+        """
+        if self.deferred:
+            return self.flush()
+        return 0
+
+    def stop(self):
+        """Detiene el hilo de flush y vuelca lo pendiente"""
+        self._stopping = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=max(self.flush_interval * 2, 5))
+        self._thread = None
+        try:
+            self._on_stop()
+        finally:
+            self._stopping = False
+
+    def _on_stop(self):
+        if self._app is not None:
+            self.flush()
+
+    # ============================================
+    # HILO
+    # ============================================
+
+    def _reset_state(self):
+        """Descarta lo acumulado (proceso nuevo tras fork)"""
+
+    def _check_fork(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Proceso nuevo (fork de gunicorn): no heredar estado del padre
+            self._pid = pid
+            self._thread = None
+            self._lock = threading.Lock()
+            self._flush_lock = threading.Lock()
+            self._thread_lock = threading.Lock()
+            self._wakeup = threading.Event()
+            self._reset_state()
+
+    def _ensure_worker(self):
+        """Arranca el hilo de flush (una vez por proceso, seguro tras fork)"""
+        self._check_fork()
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            self.flush()
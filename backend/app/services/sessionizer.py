@@ -0,0 +1,207 @@
+"""
+Sessionizer - Sesiones de navegación a partir de analytics_events
+
+Consume AnalyticsEvent en orden de id (checkpoint 'sessions', ver
+analytics_checkpoints) y mantiene analytics_sessions con una fila por
+visita: primer/último evento, número de eventos, landing, UTM y si hubo
+conversión. Una session_id del cliente se parte en varias visitas cuando
+pasan más de ANALYTICS_SESSION_GAP_MINUTES sin eventos.
+
+Los eventos tardíos (que llegan en una pasada posterior pero con timestamp
+anterior) se asignan a la visita cuyo intervalo ampliado con el gap los
+contiene; si un evento une dos visitas existentes, se fusionan.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.models.analytics import AnalyticsEvent, AnalyticsSession
+from app.services.analytics_checkpoints import get_checkpoint, advance_checkpoint, next_upper_id
+from app.services.analytics_dimensions import join_dimensions
+from app.services.analytics_partitions import partitioned_source
+
+SESSIONS_CHECKPOINT = 'sessions'
+
+# Tamaño de los IN (...) al cargar sesiones existentes (límite de variables de SQLite)
+_KEY_CHUNK = 500
+
+_ATTRIBUTION_COLUMNS = ('utm_source', 'utm_medium', 'utm_campaign')
+
+
+def conversion_events():
+    """Eventos que marcan una visita como convertida (ANALYTICS_CONVERSION_EVENTS)"""
+    raw = current_app.config.get('ANALYTICS_CONVERSION_EVENTS', 'generate_lead')
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+def _load_sessions(keys, start, end):
+    """Visitas existentes de esas session_id que solapan [start, end]"""
+    sessions = defaultdict(list)
+    keys = sorted(keys)
+    for i in range(0, len(keys), _KEY_CHUNK):
+        chunk = keys[i:i + _KEY_CHUNK]
+        query = AnalyticsSession.query.filter(
+            AnalyticsSession.session_key.in_(chunk),
+            AnalyticsSession.last_seen >= start,
+            AnalyticsSession.first_seen <= end,
+        )
+        for session in query:
+            sessions[session.session_key].append(session)
+    return sessions
+
+
+def _new_session(event):
+    return AnalyticsSession(
+        session_key=event.session_id,
+        first_seen=event.timestamp,
+        last_seen=event.timestamp,
+        event_count=0,
+        landing_url=event.url,
+        utm_source=event.utm_source,
+        utm_medium=event.utm_medium,
+        utm_campaign=event.utm_campaign,
+        converted=False,
+    )
+
+
+def _add_event(session, event, conversions):
+    if event.timestamp < session.first_seen:
+        # Evento tardío anterior a la landing: pasa a ser la landing
+        session.first_seen = event.timestamp
+        session.landing_url = event.url or session.landing_url
+        for column in _ATTRIBUTION_COLUMNS:
+            setattr(session, column, getattr(event, column) or getattr(session, column))
+    else:
+        # Primer contacto: solo se completan los campos vacíos
+        session.landing_url = session.landing_url or event.url
+        for column in _ATTRIBUTION_COLUMNS:
+            if not getattr(session, column):
+                setattr(session, column, getattr(event, column))
+
+    session.last_seen = max(session.last_seen, event.timestamp)
+    session.event_count += event.sample_weight
+
+    if event.event_name in conversions:
+        session.converted = True
+        if session.converted_at is None or event.timestamp < session.converted_at:
+            session.converted_at = event.timestamp
+
+
+def _merge(target, other):
+    """Fusiona other en target (target es la visita que empieza antes)"""
+    target.last_seen = max(target.last_seen, other.last_seen)
+    target.event_count += other.event_count
+    target.landing_url = target.landing_url or other.landing_url
+    for column in _ATTRIBUTION_COLUMNS:
+        if not getattr(target, column):
+            setattr(target, column, getattr(other, column))
+    if other.converted:
+        target.converted = True
+        if target.converted_at is None or other.converted_at < target.converted_at:
+            target.converted_at = other.converted_at
+
+
+def update_sessions(batch_size=None, lag_seconds=None):
+    """
+    Procesa hasta batch_size eventos nuevos y actualiza analytics_sessions.
+    Retorna el número de eventos leídos (incluidos los que no tienen session_id).
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('ANALYTICS_ROLLUP_BATCH_SIZE', 50000)
+    if lag_seconds is None:
+        lag_seconds = config.get('ANALYTICS_ROLLUP_LAG_SECONDS', 30)
+    gap = timedelta(minutes=config.get('ANALYTICS_SESSION_GAP_MINUTES', 30))
+    conversions = conversion_events()
+
+    last_id = get_checkpoint(SESSIONS_CHECKPOINT)
+    upper = next_upper_id(last_id, batch_size, lag_seconds)
+    if upper is None:
+        return 0
+
+    if not advance_checkpoint(SESSIONS_CHECKPOINT, last_id, upper):
+        db.session.rollback()
+        return 0
+
+    source = partitioned_source(AnalyticsEvent)
+    from_clause, dimensions = join_dimensions(source, ('url',))
+    events = db.session.execute(
+        select(
+            source.c.id, source.c.event_name, source.c.session_id, dimensions['url'],
+            source.c.utm_source, source.c.utm_medium, source.c.utm_campaign,
+            source.c.sample_weight, source.c.timestamp,
+        ).select_from(from_clause).where(source.c.id > last_id, source.c.id <= upper)
+    ).all()
+
+    pending = sorted(
+        (event for event in events if event.session_id and event.timestamp),
+        key=lambda event: (event.timestamp, event.id),
+    )
+    if pending:
+        sessions = _load_sessions(
+            {event.session_id for event in pending},
+            pending[0].timestamp - gap,
+            pending[-1].timestamp + gap,
+        )
+
+        for event in pending:
+            candidates = [
+                session for session in sessions[event.session_id]
+                if session.first_seen - gap <= event.timestamp <= session.last_seen + gap
+            ]
+            if not candidates:
+                session = _new_session(event)
+                db.session.add(session)
+                sessions[event.session_id].append(session)
+            else:
+                candidates.sort(key=lambda s: s.first_seen)
+                session = candidates[0]
+                for other in candidates[1:]:
+                    _merge(session, other)
+                    sessions[event.session_id].remove(other)
+                    if other.id is not None:
+                        db.session.delete(other)
+                    else:
+                        db.session.expunge(other)
+            _add_event(session, event, conversions)
+
+    db.session.commit()
+    return len(events)
+
+
+def refresh_sessions():
+    """Pone al día analytics_sessions si ANALYTICS_SESSIONS_ON_READ está activado"""
+    if current_app.config.get('ANALYTICS_SESSIONS_ON_READ', True):
+        update_sessions()
+
+
+def session_summary(start):
+    """Resumen de las visitas que empezaron desde start (una fila por visita)"""
+    totals = db.session.query(
+        func.count(AnalyticsSession.id),
+        func.sum(AnalyticsSession.event_count),
+        func.count(AnalyticsSession.converted_at),
+    ).filter(AnalyticsSession.first_seen >= start).one()
+    sessions, events, converted = totals[0], int(totals[1] or 0), totals[2]
+
+    by_source = db.session.query(
+        AnalyticsSession.utm_source,
+        func.count(AnalyticsSession.id),
+        func.count(AnalyticsSession.converted_at),
+    ).filter(
+        AnalyticsSession.first_seen >= start,
+    ).group_by(AnalyticsSession.utm_source).order_by(func.count(AnalyticsSession.id).desc()).all()
+
+    return {
+        'sessions': sessions,
+        'converted': converted,
+        'conversion_rate': round(converted / sessions * 100, 2) if sessions else 0,
+        'avg_events_per_session': round(events / sessions, 2) if sessions else 0,
+        'by_source': [
+            {'utm_source': source or 'direct', 'sessions': count, 'converted': conv}
+            for source, count, conv in by_source
+        ],
+    }
@@ -0,0 +1,97 @@
+"""
+SQL Functions - Funciones SQL portables entre PostgreSQL y SQLite
+"""
+
+from sqlalchemy import DateTime, Float, Integer, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+# Formatos strftime de SQLite para cada granularidad
+_SQLITE_TRUNC_FORMATS = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+    'month': '%Y-%m-01 00:00:00',
+}
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+
+class date_trunc(FunctionElement):
+    """
+    date_trunc(granularidad, columna) portable.
+    PostgreSQL usa date_trunc nativo; SQLite usa strftime/date.
+    Las semanas empiezan en lunes (ISO), igual que en PostgreSQL.
+    """
+
+    type = DateTime()
+    inherit_cache = True
+    name = 'date_trunc'
+
+    def __init__(self, granularity, expr, **kwargs):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'Granularidad no soportada: {granularity}')
+        # La granularidad va como literal para que forme parte de la cache key
+        super().__init__(literal_column(f"'{granularity}'"), expr, **kwargs)
+
+
+def _unpack(element, compiler, **kw):
+    granularity_clause, expr_clause = list(element.clauses)
+    return granularity_clause.name.strip("'"), compiler.process(expr_clause, **kw)
+
+
+@compiles(date_trunc)
+def _compile_date_trunc(element, compiler, **kw):
+    granularity, expr = _unpack(element, compiler, **kw)
+    return f"date_trunc('{granularity}', {expr})"
+
+
+@compiles(date_trunc, 'sqlite')
+def _compile_date_trunc_sqlite(element, compiler, **kw):
+    granularity, expr = _unpack(element, compiler, **kw)
+    if granularity == 'week':
+        # strftime('%w') = 0 (domingo) .. 6; retroceder hasta el lunes
+        return (
+            f"datetime(date({expr}, '-' || ((CAST(strftime('%w', {expr}) AS INTEGER) + 6) % 7) || ' days'))"
+        )
+    return f"strftime('{_SQLITE_TRUNC_FORMATS[granularity]}', {expr})"
+
+
+class epoch_seconds(FunctionElement):
+    """Segundos desde 1970-01-01 (float) de una columna DateTime sin zona horaria"""
+
+    type = Float()
+    inherit_cache = True
+    name = 'epoch_seconds'
+
+
+@compiles(epoch_seconds)
+def _compile_epoch_seconds(element, compiler, **kw):
+    # EXTRACT devuelve numeric (Decimal en el driver) desde PostgreSQL 14
+    return f"CAST(EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)}) AS DOUBLE PRECISION)"
+
+
+@compiles(epoch_seconds, 'sqlite')
+def _compile_epoch_seconds_sqlite(element, compiler, **kw):
+    return f"((julianday({compiler.process(element.clauses, **kw)}) - 2440587.5) * 86400.0)"
+
+
+class count_if(FunctionElement):
+    """
+    Número de filas que cumplen una condición (agregación condicional).
+    PostgreSQL usa COUNT(*) FILTER (WHERE ...); SQLite y el resto
+    SUM(CASE WHEN ... THEN 1 ELSE 0 END), que da NULL sin filas.
+    """
+
+    type = Integer()
+    inherit_cache = True
+    name = 'count_if'
+
+
+@compiles(count_if)
+def _compile_count_if(element, compiler, **kw):
+    return f"SUM(CASE WHEN {compiler.process(element.clauses, **kw)} THEN 1 ELSE 0 END)"
+
+
+@compiles(count_if, 'postgresql')
+def _compile_count_if_postgresql(element, compiler, **kw):
+    return f"COUNT(*) FILTER (WHERE {compiler.process(element.clauses, **kw)})"
@@ -0,0 +1,213 @@
+"""
+Time Series - Series temporales con huecos rellenos para el admin
+
+Métricas:
+    leads            leads creados por bucket
+    leads_by_estado  leads creados por bucket y estado actual
+    subscribers      altas en la newsletter por bucket
+    events_by_name   eventos por bucket y event_name (rollups + filas crudas
+                     por encima del high-water mark, como event_counts)
+
+El agrupado por bucket se hace en SQL con date_trunc (ver sql_functions)
+y SQL solo devuelve los buckets con datos. El resto va con NumPy sin
+bucles por bucket: el eje de buckets sale de np.arange sobre datetime64,
+las filas se colocan con searchsorted + np.add.at en una matriz
+series × buckets (los huecos quedan a 0) y el acumulado y la media móvil
+son cumsum por filas. Un año de datos diarios de varias series son unas
+pocas consultas agrupadas y operaciones vectoriales.
+
+El rango se amplía a buckets completos: start se trunca al inicio de su
+bucket y end (exclusivo) se redondea al inicio del siguiente.
+"""
+
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.models.analytics import AnalyticsEvent, AnalyticsRollupHourly, AnalyticsRollupDaily
+from app.models.lead import Lead
+from app.models.newsletter import NewsletterSubscriber
+from app.services.analytics_checkpoints import get_checkpoint
+from app.services.analytics_partitions import partitioned_source
+from app.services.analytics_rollup import ROLLUP_CHECKPOINT, update_rollups
+from app.services.sql_functions import GRANULARITIES, date_trunc
+
+METRICS = ('leads', 'leads_by_estado', 'subscribers', 'events_by_name')
+
+# Unidad de datetime64 y tamaño del paso de cada granularidad
+_STEPS = {
+    'hour': ('h', 1),
+    'day': ('D', 1),
+    'week': ('D', 7),
+    'month': ('M', 1),
+}
+
+# 1970-01-01 fue jueves: día 4 = primer lunes
+_FIRST_MONDAY = 4
+
+
+# ============================================
+# EJE DE BUCKETS
+# ============================================
+
+def _floor(moment, granularity):
+    """Inicio del bucket que contiene moment (datetime64 en la unidad de la granularidad)"""
+    unit, _ = _STEPS[granularity]
+    value = np.datetime64(moment, 'us').astype(f'datetime64[{unit}]')
+    if granularity == 'week':
+        value -= (value.astype(np.int64) - _FIRST_MONDAY) % 7
+    return value
+
+
+def bucket_axis(start, end, granularity):
+    """Inicios de bucket (datetime64[us]) que cubren [start, end)"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Granularidad no soportada: {granularity}')
+    unit, step = _STEPS[granularity]
+    first = _floor(start, granularity)
+    last = _floor(np.datetime64(end, 'us') - np.timedelta64(1, 'us'), granularity)
+    return np.arange(first, last + step, step).astype('datetime64[us]')
+
+
+def _range_edges(buckets, granularity):
+    """(inicio, fin exclusivo) del eje como datetime"""
+    unit, step = _STEPS[granularity]
+    end = buckets[-1].astype(f'datetime64[{unit}]') + step
+    return buckets[0].astype(datetime), end.astype('datetime64[us]').astype(datetime)
+
+
+# ============================================
+# CONSULTAS (solo buckets con datos)
+# ============================================
+
+def _grouped(column, label, granularity, start, end, filters=(), value=None):
+    """
+    [(bucket, serie, valor)] agrupado por date_trunc(column) y label
+    (una columna, o un str para métricas de una sola serie).
+    """
+    bucket = date_trunc(granularity, column)
+    value = value if value is not None else func.count()
+    filters = (column >= start, column < end, *filters)
+    if isinstance(label, str):
+        query = select(bucket, value).where(*filters).group_by(bucket)
+        return [(moment, label, total) for moment, total in db.session.execute(query)]
+    query = select(bucket, label, value).where(*filters).group_by(bucket, label)
+    return db.session.execute(query).all()
+
+
+def _lead_rows(granularity, start, end):
+    return _grouped(Lead.created_at, 'leads', granularity, start, end)
+
+
+def _lead_estado_rows(granularity, start, end):
+    return _grouped(Lead.created_at, func.coalesce(Lead.estado, 'sin_estado'), granularity, start, end)
+
+
+def _subscriber_rows(granularity, start, end):
+    return _grouped(NewsletterSubscriber.created_at, 'subscribers', granularity, start, end)
+
+
+def _event_rows(granularity, start, end):
+    """Rollup horario (hour) o diario (resto) + filas crudas aún no agregadas"""
+    if current_app.config.get('ANALYTICS_ROLLUP_ON_READ', True):
+        update_rollups()
+    hwm = get_checkpoint(ROLLUP_CHECKPOINT)
+
+    rollup = AnalyticsRollupHourly if granularity == 'hour' else AnalyticsRollupDaily
+    rows = _grouped(
+        rollup.bucket, rollup.event_name, granularity, start, end, value=func.sum(rollup.count),
+    )
+
+    source = partitioned_source(AnalyticsEvent, start, end)
+    rows += _grouped(
+        source.c.timestamp, source.c.event_name, granularity, start, end,
+        filters=(source.c.id > hwm,), value=func.sum(source.c.sample_weight),
+    )
+    return rows
+
+
+_METRIC_ROWS = {
+    'leads': _lead_rows,
+    'leads_by_estado': _lead_estado_rows,
+    'subscribers': _subscriber_rows,
+    'events_by_name': _event_rows,
+}
+
+
+# ============================================
+# RELLENO Y VENTANAS (NumPy)
+# ============================================
+
+def fill_series(buckets, rows):
+    """
+    Coloca rows [(bucket, serie, valor)] en el eje buckets.
+    Retorna (nombres de serie ordenados, matriz int64 series × buckets).
+    """
+    if not rows:
+        return [], np.zeros((0, len(buckets)), dtype=np.int64)
+
+    row_buckets, labels, values = zip(*rows)
+    row_buckets = np.array(row_buckets, dtype='datetime64[us]')
+    names, series_index = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    values = np.array(values, dtype=np.int64)
+
+    positions = np.searchsorted(buckets, row_buckets)
+    valid = positions < len(buckets)
+    valid[valid] = buckets[positions[valid]] == row_buckets[valid]
+
+    matrix = np.zeros((len(names), len(buckets)), dtype=np.int64)
+    np.add.at(matrix, (series_index[valid], positions[valid]), values[valid])
+    return names.tolist(), matrix
+
+
+def cumulative(matrix):
+    return np.cumsum(matrix, axis=1)
+
+
+def rolling_mean(matrix, window):
+    """Media de los últimos window buckets (menos al principio del eje)"""
+    sums = np.cumsum(matrix, axis=1, dtype=np.float64)
+    if window < matrix.shape[1]:
+        sums[:, window:] -= sums[:, :-window].copy()
+    counts = np.minimum(np.arange(1, matrix.shape[1] + 1), window)
+    return sums / counts
+
+
+def time_series(metric, granularity, start, end, cumulative_totals=False, rolling=None):
+    """
+    Serie temporal de metric en [start, end) por granularity. Lanza
+    ValueError si la métrica, la granularidad o el rango no son válidos.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Métrica no soportada: {metric} (válidas: {', '.join(METRICS)})")
+    if end <= start:
+        raise ValueError('El rango de fechas está vacío')
+    if rolling is not None and rolling < 1:
+        raise ValueError('rolling debe ser >= 1')
+
+    buckets = bucket_axis(start, end, granularity)
+    max_buckets = current_app.config.get('TIMESERIES_MAX_BUCKETS', 10000)
+    if len(buckets) > max_buckets:
+        raise ValueError(f'Demasiados buckets ({len(buckets)}, máximo {max_buckets})')
+
+    range_start, range_end = _range_edges(buckets, granularity)
+    names, matrix = fill_series(buckets, _METRIC_ROWS[metric](granularity, range_start, range_end))
+
+    result = {
+        'metric': metric,
+        'granularity': granularity,
+        'start': range_start.isoformat(),
+        'end': range_end.isoformat(),
+        'buckets': np.datetime_as_string(buckets, unit='s').tolist(),
+        'series': dict(zip(names, matrix.tolist())),
+        'totals': dict(zip(names, matrix.sum(axis=1).tolist())),
+    }
+    if cumulative_totals:
+        result['cumulative'] = dict(zip(names, cumulative(matrix).tolist()))
+    if rolling:
+        result['rolling_window'] = rolling
+        result['rolling'] = dict(zip(names, np.round(rolling_mean(matrix, rolling), 3).tolist()))
+    return result
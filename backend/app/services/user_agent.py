@@ -0,0 +1,116 @@
+"""
+User Agent - Clasificación de User-Agent en device/browser/os
+
+Patrones compilados en el arranque, sin dependencias ni red. El resultado
+se guarda en columnas cortas (device_type, browser_family, os_family) al
+ingerir eventos, leads y refresh tokens, así los desgloses por dispositivo
+son GROUP BY sobre columnas indexadas en lugar de parsear cadenas.
+
+En la práctica unos pocos User-Agent concentran casi todo el tráfico, por
+eso classify_user_agent() va detrás de una LRU (functools.lru_cache) por
+worker; user_agent_cache_info() expone aciertos y fallos.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+USER_AGENT_COLUMNS = ('device_type', 'browser_family', 'os_family')
+
+UserAgentInfo = namedtuple('UserAgentInfo', USER_AGENT_COLUMNS)
+
+DEVICE_TYPES = ('desktop', 'mobile', 'tablet', 'bot', 'other')
+
+CACHE_SIZE = 4096
+
+# Tokens de crawlers conocidos, no subcadenas sueltas: "<nombre>bot" como
+# palabra (salvo los móviles CUBOT), fetchers de vistas previas concretos y
+# monitores de disponibilidad por nombre
+_BOT_RE = re.compile(
+    r'\b(?!cubot\b)[a-z0-9_]*bot\b|crawler|spider|slurp|mediapartners-google|adsbot-google|'
+    r'facebookexternalhit|facebookcatalog|embedly|skypeuripreview|google web preview|vkshare|'
+    r'headlesschrome|phantomjs|puppeteer|playwright|selenium|chrome-lighthouse|'
+    r'uptimerobot|pingdom|statuscake|site24x7|newrelicpinger|datadog/synthetics|'
+    r'curl/|wget/|python-requests|python-urllib|aiohttp|httpx|go-http-client|java/|okhttp|'
+    r'axios/|node-fetch|libwww|scrapy|ia_archiver',
+    re.IGNORECASE,
+)
+
+# Orden relevante: el primero que coincide gana (Edge y Opera incluyen "Chrome",
+# Chrome incluye "Safari")
+_BROWSERS = [
+    (re.compile(r'Edg(?:e|A|iOS)?/'), 'Edge'),
+    (re.compile(r'OPR/|Opera'), 'Opera'),
+    (re.compile(r'SamsungBrowser/'), 'Samsung Internet'),
+    (re.compile(r'YaBrowser/'), 'Yandex'),
+    (re.compile(r'Firefox/|FxiOS/'), 'Firefox'),
+    (re.compile(r'Chrome/|CriOS/|Chromium/'), 'Chrome'),
+    (re.compile(r'MSIE |Trident/'), 'IE'),
+    (re.compile(r'Safari/'), 'Safari'),
+]
+
+_OPERATING_SYSTEMS = [
+    (re.compile(r'iPhone|iPad|iPod'), 'iOS'),
+    (re.compile(r'Android'), 'Android'),
+    (re.compile(r'CrOS'), 'ChromeOS'),
+    (re.compile(r'Windows'), 'Windows'),
+    (re.compile(r'Macintosh|Mac OS X'), 'macOS'),
+    (re.compile(r'Linux|X11'), 'Linux'),
+]
+
+_TABLET_RE = re.compile(r'iPad|Tablet|Kindle|Silk/|PlayBook|(?=.*Android)(?!.*Mobile)', re.IGNORECASE)
+_MOBILE_RE = re.compile(r'Mobi|iPhone|iPod|Android|Windows Phone|Opera Mini', re.IGNORECASE)
+
+
+def _first_match(patterns, user_agent):
+    for pattern, family in patterns:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+def _classify(user_agent):
+    if not user_agent:
+        return UserAgentInfo('other', 'Other', 'Other')
+
+    if _BOT_RE.search(user_agent):
+        return UserAgentInfo('bot', 'Other', _first_match(_OPERATING_SYSTEMS, user_agent))
+
+    browser = _first_match(_BROWSERS, user_agent)
+    os_family = _first_match(_OPERATING_SYSTEMS, user_agent)
+
+    if _TABLET_RE.search(user_agent):
+        device = 'tablet'
+    elif _MOBILE_RE.search(user_agent):
+        device = 'mobile'
+    elif os_family in ('Windows', 'macOS', 'Linux', 'ChromeOS'):
+        device = 'desktop'
+    else:
+        device = 'other'
+
+    return UserAgentInfo(device, browser, os_family)
+
+
+_classify_cached = lru_cache(maxsize=CACHE_SIZE)(_classify)
+
+
+def classify_user_agent(user_agent):
+    """Clasifica un User-Agent (con LRU por worker)"""
+    return _classify_cached(user_agent or '')
+
+
+def user_agent_fields(user_agent):
+    """Dict con las columnas derivadas, para añadir a una fila o modelo"""
+    return classify_user_agent(user_agent)._asdict()
+
+
+def user_agent_cache_info():
+    info = _classify_cached.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hit_rate': round(info.hits / lookups, 4) if lookups else None,
+    }
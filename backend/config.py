@@ -49,11 +49,112 @@ class Config:
     # Rate Limiting
     RATELIMIT_DEFAULT = "200 per day"
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
+    REDIS_URL = os.environ.get('REDIS_URL')
 
     # JWT
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
 
+    # Analytics - buffer write-behind (flush por tamaño o por tiempo)
+    ANALYTICS_BUFFER_ENABLED = os.environ.get('ANALYTICS_BUFFER_ENABLED', 'true').lower() == 'true'
+    ANALYTICS_BUFFER_MAX_ROWS = int(os.environ.get('ANALYTICS_BUFFER_MAX_ROWS', 200))
+    ANALYTICS_BUFFER_FLUSH_MS = int(os.environ.get('ANALYTICS_BUFFER_FLUSH_MS', 1000))
+    ANALYTICS_BUFFER_MAX_QUEUE = int(os.environ.get('ANALYTICS_BUFFER_MAX_QUEUE', 10000))
+
+    # Analytics - spool en disco cuando la base de datos está caída o lenta
+    ANALYTICS_SPOOL_ENABLED = os.environ.get('ANALYTICS_SPOOL_ENABLED', 'true').lower() == 'true'
+    ANALYTICS_SPOOL_DIR = os.environ.get('ANALYTICS_SPOOL_DIR')  # Por defecto: instance/analytics_spool
+    ANALYTICS_SPOOL_SEGMENT_BYTES = int(os.environ.get('ANALYTICS_SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024))
+    ANALYTICS_SPOOL_REPLAY_SECONDS = int(os.environ.get('ANALYTICS_SPOOL_REPLAY_SECONDS', 5))
+    ANALYTICS_SPOOL_SLOW_MS = int(os.environ.get('ANALYTICS_SPOOL_SLOW_MS', 2000))
+    ANALYTICS_SPOOL_DB_TIMEOUT_MS = int(os.environ.get('ANALYTICS_SPOOL_DB_TIMEOUT_MS', 5000))
+
+    # Analytics - rollups incrementales por hora/día
+    ANALYTICS_ROLLUP_ON_READ = os.environ.get('ANALYTICS_ROLLUP_ON_READ', 'true').lower() == 'true'
+    ANALYTICS_ROLLUP_BATCH_SIZE = int(os.environ.get('ANALYTICS_ROLLUP_BATCH_SIZE', 50000))
+    ANALYTICS_ROLLUP_LAG_SECONDS = int(os.environ.get('ANALYTICS_ROLLUP_LAG_SECONDS', 30))
+
+    # Analytics - sesiones (sessionizer incremental)
+    ANALYTICS_SESSIONS_ON_READ = os.environ.get('ANALYTICS_SESSIONS_ON_READ', 'true').lower() == 'true'
+    ANALYTICS_SESSION_GAP_MINUTES = int(os.environ.get('ANALYTICS_SESSION_GAP_MINUTES', 30))
+    ANALYTICS_CONVERSION_EVENTS = os.environ.get('ANALYTICS_CONVERSION_EVENTS', 'generate_lead')
+
+    # Analytics - particiones mensuales y retención (0 = conservar siempre)
+    ANALYTICS_PARTITION_PREMAKE_MONTHS = int(os.environ.get('ANALYTICS_PARTITION_PREMAKE_MONTHS', 2))
+    ANALYTICS_RETENTION_MONTHS = int(os.environ.get('ANALYTICS_RETENTION_MONTHS', 0))
+    PAGEVIEW_RETENTION_MONTHS = int(os.environ.get('PAGEVIEW_RETENTION_MONTHS', 0))
+
+    # Analytics - compactación: borrado por lotes de eventos crudos ya contados en los rollups
+    ANALYTICS_COMPACTION_AGE_DAYS = int(os.environ.get('ANALYTICS_COMPACTION_AGE_DAYS', 30))
+    ANALYTICS_COMPACTION_BATCH_SIZE = int(os.environ.get('ANALYTICS_COMPACTION_BATCH_SIZE', 5000))
+    ANALYTICS_COMPACTION_MAX_BATCHES = int(os.environ.get('ANALYTICS_COMPACTION_MAX_BATCHES', 100))
+    ANALYTICS_COMPACTION_PAUSE_MS = int(os.environ.get('ANALYTICS_COMPACTION_PAUSE_MS', 100))
+    ANALYTICS_COMPACTION_ARCHIVE_DIR = os.environ.get('ANALYTICS_COMPACTION_ARCHIVE_DIR')  # Vacío = sin archivo
+
+    # Page views - conteo por ruta/hora en memoria y muestreo de filas crudas
+    PAGEVIEW_COUNTER_ENABLED = os.environ.get('PAGEVIEW_COUNTER_ENABLED', 'true').lower() == 'true'
+    PAGEVIEW_FLUSH_SECONDS = int(os.environ.get('PAGEVIEW_FLUSH_SECONDS', 10))
+    PAGEVIEW_SAMPLE_RATE = float(os.environ.get('PAGEVIEW_SAMPLE_RATE', 0.01))
+    PAGEVIEW_MAX_KEYS = int(os.environ.get('PAGEVIEW_MAX_KEYS', 10000))
+
+    # Analytics - sketches HyperLogLog de visitantes/sesiones únicos
+    ANALYTICS_SKETCH_BUFFER_ENABLED = os.environ.get('ANALYTICS_SKETCH_BUFFER_ENABLED', 'true').lower() == 'true'
+    ANALYTICS_SKETCH_FLUSH_SECONDS = int(os.environ.get('ANALYTICS_SKETCH_FLUSH_SECONDS', 30))
+    ANALYTICS_SKETCH_MAX_KEYS = int(os.environ.get('ANALYTICS_SKETCH_MAX_KEYS', 2000))
+    # Solo estos event_name y rutas tienen sketch propio (el resto cuenta como 'other'); "/x/*" = prefijo
+    ANALYTICS_SKETCH_EVENTS = os.environ.get(
+        'ANALYTICS_SKETCH_EVENTS',
+        'cta_click,form_start,generate_lead,sign_up,contact,scroll,engagement_time,view_item,'
+        'schedule_start,schedule_complete,exit_intent_shown,exit_intent_converted',
+    )
+    ANALYTICS_SKETCH_PATHS = os.environ.get(
+        'ANALYTICS_SKETCH_PATHS', '/,/demo,/blog,/blog/*,/privacidad,/terminos,/cookies',
+    )
+
+    # Analytics - LRU por worker de url/referrer/user_agent -> id de analytics_dimensions
+    ANALYTICS_DIMENSION_CACHE_SIZE = int(os.environ.get('ANALYTICS_DIMENSION_CACHE_SIZE', 10000))
+
+    # Analytics - muestreo 1-de-N por event_name, p. ej. "scroll=10" (vacío = guardar todo)
+    ANALYTICS_SAMPLE_RATES = os.environ.get('ANALYTICS_SAMPLE_RATES', '')
+
+    # Analytics - deduplicación por event_id del cliente (Bloom filter por worker + tabla de ids)
+    ANALYTICS_DEDUPE_CAPACITY = int(os.environ.get('ANALYTICS_DEDUPE_CAPACITY', 100000))
+    ANALYTICS_DEDUPE_ERROR_RATE = float(os.environ.get('ANALYTICS_DEDUPE_ERROR_RATE', 0.001))
+    ANALYTICS_DEDUPE_RETENTION_HOURS = int(os.environ.get('ANALYTICS_DEDUPE_RETENTION_HOURS', 48))
+
+    # Admin - cache de agregados invalidada por escrituras (generaciones en REDIS_URL o en un fichero SQLite)
+    ADMIN_CACHE_SHARED = os.environ.get('ADMIN_CACHE_SHARED', 'true').lower() == 'true'
+    ADMIN_CACHE_DB = os.environ.get('ADMIN_CACHE_DB')  # Por defecto: instance/admin_cache.sqlite3
+    ADMIN_CACHE_MAX_AGE_SECONDS = int(os.environ.get('ADMIN_CACHE_MAX_AGE_SECONDS', 300))  # 0 = sin cache
+
+    # /admin/leads/fuzzy - búsqueda por trigramas (umbral 0-1 y reconstrucción del índice en memoria de SQLite)
+    LEAD_FUZZY_THRESHOLD = float(os.environ.get('LEAD_FUZZY_THRESHOLD', 0.3))
+    LEAD_FUZZY_MAX_AGE_SECONDS = int(os.environ.get('LEAD_FUZZY_MAX_AGE_SECONDS', 300))  # 0 = solo al arrancar
+
+    # /admin/analytics/timeseries - tope de buckets por petición (un año por horas son 8760)
+    TIMESERIES_MAX_BUCKETS = int(os.environ.get('TIMESERIES_MAX_BUCKETS', 10000))
+
+    # Dashboard en vivo (SSE): ring buffer por minuto compartido entre workers por ficheros
+    LIVE_STREAM_SHARED = os.environ.get('LIVE_STREAM_SHARED', 'true').lower() == 'true'
+    LIVE_STREAM_DIR = os.environ.get('LIVE_STREAM_DIR')  # Por defecto: instance/live_stream
+    LIVE_STREAM_WINDOW_MINUTES = int(os.environ.get('LIVE_STREAM_WINDOW_MINUTES', 60))
+    LIVE_STREAM_INTERVAL_SECONDS = float(os.environ.get('LIVE_STREAM_INTERVAL_SECONDS', 2))
+    LIVE_STREAM_PUBLISH_SECONDS = float(os.environ.get('LIVE_STREAM_PUBLISH_SECONDS', 2))
+    LIVE_STREAM_MAX_SECONDS = int(os.environ.get('LIVE_STREAM_MAX_SECONDS', 300))
+    # Cada stream ocupa un thread de gunicorn: se dejan al menos 2 por worker para el resto de peticiones
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+    LIVE_STREAM_MAX_SUBSCRIBERS = int(
+        os.environ.get('LIVE_STREAM_MAX_SUBSCRIBERS', max(GUNICORN_THREADS - 2, 1))
+    )
+
+    # Analytics - filtro de bots (User-Agent + ritmo por sesión) y conteo de descartes
+    BOT_FILTER_ENABLED = os.environ.get('BOT_FILTER_ENABLED', 'true').lower() == 'true'
+    BOT_SESSION_MAX_EVENTS = int(os.environ.get('BOT_SESSION_MAX_EVENTS', 120))
+    BOT_SESSION_WINDOW_SECONDS = int(os.environ.get('BOT_SESSION_WINDOW_SECONDS', 60))
+    BOT_MAX_TRACKED_SESSIONS = int(os.environ.get('BOT_MAX_TRACKED_SESSIONS', 50000))
+    BOT_COUNTER_BUFFER_ENABLED = os.environ.get('BOT_COUNTER_BUFFER_ENABLED', 'true').lower() == 'true'
+    BOT_FLUSH_SECONDS = int(os.environ.get('BOT_FLUSH_SECONDS', 30))
+
 
 class DevelopmentConfig(Config):
     """Configuración de desarrollo"""
@@ -94,6 +195,16 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
     RATELIMIT_ENABLED = False  # Deshabilitar rate limiting en tests
+    # SQLite no acepta connect_timeout (es un argumento de psycopg2)
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    ANALYTICS_BUFFER_ENABLED = False  # Escritura síncrona en tests
+    ANALYTICS_ROLLUP_LAG_SECONDS = 0  # Los jobs incrementales ven las filas recién insertadas
+    ANALYTICS_SPOOL_ENABLED = False
+    PAGEVIEW_COUNTER_ENABLED = False
+    ANALYTICS_SKETCH_BUFFER_ENABLED = False
+    BOT_COUNTER_BUFFER_ENABLED = False
+    LIVE_STREAM_SHARED = False
+    ADMIN_CACHE_SHARED = False
 
 
 config = {
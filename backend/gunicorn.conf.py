@@ -0,0 +1,30 @@
+"""
+Configuración de Gunicorn
+
+Procfile, railway.json y nixpacks.toml arrancan desde backend/ con
+-c gunicorn.conf.py: sin ella no hay workers gthread (streams SSE) ni
+worker_exit (volcado del buffer, spool y contadores al parar un worker).
+"""
+
+import os
+
+# Workers con threads: un stream SSE (/admin/analytics/live) ocupa un thread,
+# no el worker entero
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def worker_exit(server, worker):
+    """Vuelca el buffer de analytics y los contadores antes de que el worker termine"""
+    from app.services.analytics_buffer import analytics_buffer
+    from app.services.analytics_spool import analytics_spool
+    from app.services.pageview_counter import pageview_counter
+    from app.services.visitor_sketches import visitor_sketches
+    from app.services.bot_filter import bot_filter
+    from app.services.live_stream import live_stream
+    analytics_buffer.stop()
+    pageview_counter.stop()
+    visitor_sketches.stop()
+    bot_filter.stop()
+    live_stream.stop()
+    analytics_spool.close()
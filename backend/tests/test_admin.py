@@ -30,6 +30,70 @@ class TestAdminStats:
         data = response.get_json()
         assert data['periodo_dias'] == 7
 
+    def test_get_stats_figures(self, logged_in_client, multiple_leads, app):
+        """Test que la consulta agregada da las mismas cifras que contar por separado"""
+        from datetime import datetime, timedelta
+
+        with app.app_context():
+            multiple_leads[0].created_at = datetime.utcnow() - timedelta(days=40)
+            db.session.add(NewsletterSubscriber(email='activo@test.com', is_active=True))
+            db.session.add(NewsletterSubscriber(email='baja@test.com', is_active=False))
+            db.session.commit()
+
+        data = logged_in_client.get('/admin/stats?days=30').get_json()
+
+        assert data['leads']['total'] == 10
+        assert data['leads']['nuevos_periodo'] == 9
+        assert data['leads']['pendientes'] == 2
+        assert data['leads']['por_estado'] == {
+            'nuevo': 2, 'contactado': 2, 'en_proceso': 2, 'propuesta': 2, 'ganado': 2,
+        }
+        assert data['leads']['por_dia'] == [
+            {'fecha': datetime.utcnow().date().isoformat(), 'total': 9}
+        ]
+        assert data['newsletter'] == {'total_activos': 1, 'nuevos_periodo': 1}
+
+    def test_get_stats_unknown_estado(self, logged_in_client, multiple_leads, app):
+        """Test que los estados fuera de Lead.ESTADOS también se cuentan"""
+        with app.app_context():
+            multiple_leads[0].estado = 'archivado'
+            db.session.commit()
+
+        data = logged_in_client.get('/admin/stats').get_json()
+        assert data['leads']['por_estado']['archivado'] == 1
+        assert sum(data['leads']['por_estado'].values()) == 10
+
+    def test_get_stats_is_cached_until_write(self, logged_in_client, multiple_leads, app):
+        """Test que las estadísticas se sirven de cache hasta que cambian leads"""
+        from app.services.admin_cache import admin_cache
+
+        assert logged_in_client.get('/admin/stats?days=7').get_json()['leads']['total'] == 10
+        hits = admin_cache.stats().get('hits', 0)
+        assert logged_in_client.get('/admin/stats?days=7').get_json()['leads']['total'] == 10
+        assert admin_cache.stats()['hits'] == hits + 1
+
+        with app.app_context():
+            db.session.add(Lead(nombre='Nuevo', email='nuevo@test.com', proyecto='Proyecto nuevo de prueba'))
+            db.session.commit()
+        assert logged_in_client.get('/admin/stats?days=7').get_json()['leads']['total'] == 11
+
+        # PATCH desde el admin: cambia el conteo por estado
+        lead_id = multiple_leads[1].id
+        logged_in_client.patch(f'/admin/leads/{lead_id}', json={'estado': 'nuevo'})
+        assert logged_in_client.get('/admin/stats?days=7').get_json()['leads']['pendientes'] == 4
+
+    def test_event_counts_invalidated_by_ingestion(self, logged_in_client, app):
+        """Test que los conteos de eventos se invalidan al insertar eventos"""
+        from app.services.analytics_service import insert_events
+
+        assert logged_in_client.get('/admin/analytics/events').get_json()['events_by_type'] == {}
+
+        with app.app_context():
+            insert_events([{'event_name': 'cta_click', 'session_id': 'sess-1'}])
+
+        data = logged_in_client.get('/admin/analytics/events').get_json()
+        assert data['events_by_type'] == {'cta_click': 1}
+
     def test_get_stats_requires_admin(self, client, regular_user):
         """Test que estadísticas requieren ser admin"""
         client.post('/auth/login', json={
@@ -67,6 +131,72 @@ class TestAdminLeads:
         assert data['per_page'] == 5
         assert data['current_page'] == 1
 
+    def _walk(self, client, url):
+        """Recorre todas las páginas en modo cursor; retorna (ids, última respuesta)"""
+        ids = []
+        data = client.get(url).get_json()
+        ids += [lead['id'] for lead in data['leads']]
+        while data['next']:
+            data = client.get(data['next']).get_json()
+            ids += [lead['id'] for lead in data['leads']]
+        return ids, data
+
+    def test_list_leads_cursor_mode(self, logged_in_client, multiple_leads):
+        """Test que el modo cursor recorre todos los leads sin repetir ni saltar"""
+        by_page = logged_in_client.get('/admin/leads?per_page=100&order_by=estado&order_dir=asc').get_json()
+        expected = [lead['id'] for lead in by_page['leads']]
+
+        ids, last = self._walk(logged_in_client, '/admin/leads?cursor=&per_page=3&order_by=estado&order_dir=asc')
+
+        assert sorted(ids) == sorted(expected)
+        assert len(ids) == len(set(ids)) == 10
+        assert last['has_next'] is False
+        assert 'total' not in last
+
+    def test_list_leads_cursor_prev(self, logged_in_client, multiple_leads):
+        """Test que prev vuelve a la página anterior"""
+        first = logged_in_client.get('/admin/leads?cursor=&per_page=4').get_json()
+        assert first['prev'] is None
+        second = logged_in_client.get(first['next']).get_json()
+        back = logged_in_client.get(second['prev']).get_json()
+
+        assert [lead['id'] for lead in back['leads']] == [lead['id'] for lead in first['leads']]
+        assert back['prev'] is None
+        assert back['next'] is not None
+
+    def test_list_leads_cursor_with_ties_and_filters(self, logged_in_client, multiple_leads):
+        """Test que los empates en la clave se resuelven por id y los filtros se mantienen"""
+        ids, _ = self._walk(logged_in_client, '/admin/leads?cursor=&per_page=1&order_by=prioridad&estado=nuevo')
+        assert len(ids) == len(set(ids)) == 2
+
+    @pytest.mark.parametrize('order_by, index', [
+        ('estado', 'ix_leads_estado_id'),
+        ('prioridad', 'ix_leads_prioridad_id'),
+        ('servicio_interes', 'ix_leads_servicio_interes_id'),
+    ])
+    def test_keyset_sort_keys_use_an_index(self, app, order_by, index):
+        """Test que cada clave de ordenación del modo cursor sale de un índice (sin ordenar en memoria)"""
+        from app.routes.admin import KEYSET_SORT_KEYS
+
+        with app.app_context():
+            key = KEYSET_SORT_KEYS[order_by]
+            statement = db.select(Lead.id).order_by(key, Lead.id).limit(20)
+            sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+            plan = ' '.join(row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')))
+
+            assert index in plan
+            assert 'TEMP B-TREE' not in plan
+
+    def test_list_leads_cursor_total_and_tampering(self, logged_in_client, multiple_leads):
+        """Test total opcional y cursores manipulados o de otra ordenación"""
+        data = logged_in_client.get('/admin/leads?cursor=&per_page=3&total=exact').get_json()
+        assert data['total'] == 10
+        assert data['total_is_estimate'] is False
+
+        token = data['next_cursor']
+        assert logged_in_client.get(f'/admin/leads?cursor={token}x').status_code == 400
+        assert logged_in_client.get(f'/admin/leads?cursor={token}&order_by=nombre').status_code == 400
+
     def test_list_leads_filter_by_estado(self, logged_in_client, multiple_leads):
         """Test filtrar leads por estado"""
         response = logged_in_client.get('/admin/leads?estado=nuevo')
@@ -86,6 +216,49 @@ class TestAdminLeads:
         data = response.get_json()
         assert len(data['leads']) > 0
 
+    def test_list_leads_search_prefix_and_email(self, logged_in_client, multiple_leads):
+        """Test búsqueda por prefijo de palabra y por partes del email"""
+        data = logged_in_client.get('/admin/leads?search=lead3').get_json()
+        assert [lead['email'] for lead in data['leads']] == ['lead3@test.com']
+
+        data = logged_in_client.get('/admin/leads?search=test.com').get_json()
+        assert len(data['leads']) == 10
+
+        data = logged_in_client.get('/admin/leads?search=descrip').get_json()
+        assert data['total'] == 10
+
+    def test_list_leads_search_relevance_and_snippet(self, app, logged_in_client, multiple_leads):
+        """Test que una coincidencia en nombre pesa más que en proyecto y el fragmento va resaltado"""
+        with app.app_context():
+            db.session.add(Lead(nombre='Marta Jardinería', email='marta@vivero.es',
+                                proyecto='Tienda online <b>para</b> el vivero'))
+            db.session.add(Lead(nombre='Pedro', email='pedro@otro.es',
+                                proyecto='Web para una empresa de jardinería'))
+            db.session.commit()
+
+        data = logged_in_client.get('/admin/leads?search=jardineria').get_json()
+
+        assert [lead['nombre'] for lead in data['leads']] == ['Marta Jardinería', 'Pedro']
+        pedro = data['leads'][1]
+        assert '<mark>jardinería</mark>' in pedro['search_snippet']
+
+        data = logged_in_client.get('/admin/leads?search=tienda').get_json()
+        assert '&lt;b&gt;' in data['leads'][0]['search_snippet']
+
+    def test_list_leads_search_index_follows_writes(self, app, logged_in_client, multiple_leads):
+        """Test que el índice se actualiza al modificar y borrar leads"""
+        with app.app_context():
+            lead = db.session.get(Lead, multiple_leads[0].id)
+            lead.proyecto = 'Automatizar la facturación con zanahorias'
+            db.session.commit()
+
+        data = logged_in_client.get('/admin/leads?search=zanahoria').get_json()
+        assert [lead['id'] for lead in data['leads']] == [multiple_leads[0].id]
+        assert logged_in_client.get('/admin/leads?search=prueba').get_json()['total'] == 9
+
+        logged_in_client.delete(f'/admin/leads/{multiple_leads[0].id}')
+        assert logged_in_client.get('/admin/leads?search=zanahoria').get_json()['leads'] == []
+
     def test_list_leads_order_by(self, logged_in_client, multiple_leads):
         """Test ordenación de leads"""
         # Orden ascendente
@@ -130,6 +303,17 @@ class TestAdminLeads:
         assert data['lead']['estado'] == 'contactado'
         assert data['lead']['notas'] == 'Lead contactado por teléfono'
 
+    def test_update_lead_rejects_invalid_prioridad(self, logged_in_client, sample_lead):
+        """Test que prioridad NULL o fuera de rango se rechaza (la columna es NOT NULL)"""
+        for value in (None, 5, 'alta'):
+            response = logged_in_client.patch(f'/admin/leads/{sample_lead.id}', json={'prioridad': value})
+            assert response.status_code == 400
+
+        response = logged_in_client.post('/admin/leads/bulk-update', json={
+            'lead_ids': [sample_lead.id], 'updates': {'prioridad': None},
+        })
+        assert response.status_code == 400
+
     def test_update_lead_contacted_sets_date(self, logged_in_client, app):
         """Test que al marcar como contactado desde 'nuevo' se guarda la fecha"""
         # Crear un lead con estado 'nuevo'
@@ -272,6 +456,144 @@ class TestAdminAnalytics:
         assert 'events_by_type' in data
         assert 'periodo_dias' in data
 
+    def test_list_events_counts_by_type(self, logged_in_client, app):
+        """Test que el conteo por tipo incluye rollups y eventos recientes"""
+        from datetime import datetime, timedelta
+        from app.models import AnalyticsEvent
+
+        with app.app_context():
+            now = datetime.utcnow()
+            for name, hours_ago in [('cta_click', 1), ('cta_click', 30), ('scroll', 2), ('scroll', 24 * 10)]:
+                db.session.add(AnalyticsEvent(event_name=name, timestamp=now - timedelta(hours=hours_ago)))
+            db.session.commit()
+
+        response = logged_in_client.get('/admin/analytics/events?days=7')
+        assert response.get_json()['events_by_type'] == {'cta_click': 2, 'scroll': 1}
+
+        response = logged_in_client.get('/admin/analytics/events?days=7&event=scroll')
+        assert response.get_json()['events_by_type'] == {'scroll': 1}
+
+        stats = logged_in_client.get('/admin/stats?days=7').get_json()
+        assert stats['analytics']['eventos_periodo'] == 3
+
+    def test_list_sessions_summary(self, logged_in_client, app):
+        """Test resumen de sesiones con conversiones"""
+        from datetime import datetime, timedelta
+        from app.models import AnalyticsEvent
+
+        app.config['ANALYTICS_ROLLUP_LAG_SECONDS'] = 0
+        with app.app_context():
+            start = datetime.utcnow() - timedelta(hours=1)
+            for session_id, name in [('s1', 'page_view'), ('s1', 'generate_lead'), ('s2', 'page_view')]:
+                db.session.add(AnalyticsEvent(event_name=name, session_id=session_id, timestamp=start))
+            db.session.commit()
+
+        response = logged_in_client.get('/admin/analytics/sessions?days=7')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['sessions'] == 2
+        assert data['converted'] == 1
+        assert data['conversion_rate'] == 50.0
+        assert data['periodo_dias'] == 7
+
+    def test_list_popular_pages(self, logged_in_client):
+        """Test páginas más vistas"""
+        for path in ['/blog', '/blog', '/']:
+            logged_in_client.post('/api/analytics/pageview', json={'path': path})
+
+        response = logged_in_client.get('/admin/analytics/pages?days=1')
+
+        assert response.status_code == 200
+        assert response.get_json()['pages'] == [{'path': '/blog', 'views': 2}, {'path': '/', 'views': 1}]
+
+    def test_unique_visitors(self, logged_in_client):
+        """Test visitantes y sesiones únicos"""
+        for session_id in ['s1', 's2', 's1']:
+            logged_in_client.post('/api/analytics/event', json={'event': 'cta_click', 'session_id': session_id})
+
+        response = logged_in_client.get('/admin/analytics/unique?days=7')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['sessions'] == 2
+        assert data['visitors'] == 1
+        assert len(data['by_day']) == 7
+
+        response = logged_in_client.get('/admin/analytics/unique?days=7&event=scroll')
+        assert response.get_json()['sessions'] == 0
+
+    def test_device_breakdown(self, logged_in_client):
+        """Test desglose por dispositivo"""
+        iphone = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) Version/17.1 Mobile/15E148 Safari/604.1'
+        logged_in_client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': iphone})
+        logged_in_client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': iphone})
+
+        response = logged_in_client.get('/admin/analytics/devices?days=1')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['by_device'] == {'mobile': 2}
+        assert data['by_browser'] == {'Safari': 2}
+        assert data['by_os'] == {'iOS': 2}
+
+    def test_bot_traffic(self, logged_in_client):
+        """Test tráfico de bots descartado"""
+        googlebot = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+        logged_in_client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': googlebot})
+
+        response = logged_in_client.get('/admin/analytics/bots?days=1')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['total'] == 1
+        assert data['by_reason'] == {'user_agent': 1}
+
+    def test_live_stream(self, logged_in_client):
+        """Test stream SSE de contadores en vivo"""
+        logged_in_client.post('/api/analytics/event', json={'event': 'cta_click'})
+
+        response = logged_in_client.get('/admin/analytics/live?seconds=0')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert 'event: counters' in body
+        assert 'cta_click' in body
+
+    def test_funnel(self, logged_in_client):
+        """Test embudo de conversión"""
+        for event in ['cta_click', 'form_start']:
+            logged_in_client.post('/api/analytics/event', json={'event': event, 'session_id': 's1'})
+
+        response = logged_in_client.get('/admin/analytics/funnel?steps=cta_click,form_start&days=1')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert [step['sessions'] for step in data['steps']] == [1, 1]
+
+        assert logged_in_client.get('/admin/analytics/funnel?steps=cta_click').status_code == 400
+        assert logged_in_client.get('/admin/analytics/funnel?steps=a,a').status_code == 400
+
+    def test_export_events(self, logged_in_client):
+        """Test exportación columnar de eventos"""
+        import io
+        from app.services.analytics_export import load_export
+
+        logged_in_client.post('/api/analytics/event', json={'event': 'cta_click'})
+
+        response = logged_in_client.get('/admin/analytics/export?days=1')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        columns = load_export(io.BytesIO(response.data))
+        assert list(columns['event_name']) == ['cta_click']
+
+    def test_export_events_invalid_range(self, logged_in_client):
+        """Test exportación con fechas inválidas"""
+        assert logged_in_client.get('/admin/analytics/export?start=2026-13-01').status_code == 400
+        assert logged_in_client.get('/admin/analytics/export?start=2026-02-01&end=2026-01-01').status_code == 400
+
     def test_list_events_with_days(self, logged_in_client):
         """Test eventos con parámetro de días"""
         response = logged_in_client.get('/admin/analytics/events?days=14')
@@ -304,3 +626,257 @@ class TestAdminErrorHandling:
 
         # Flask debería manejar esto
         assert response.status_code in [200, 400, 415]
+
+
+class TestAdminTimeSeries:
+    """Tests para /admin/analytics/timeseries"""
+
+    def test_leads_by_estado(self, logged_in_client, multiple_leads):
+        """Test serie por estado con huecos a 0"""
+        from datetime import datetime, timedelta
+
+        end = datetime.utcnow()
+        start = end - timedelta(days=3)
+        response = logged_in_client.get(
+            f'/admin/analytics/timeseries?metric=leads_by_estado&granularity=day'
+            f'&start={start.isoformat()}&end={end.isoformat()}&cumulative=true'
+        )
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['buckets']) == 4
+        assert data['series']['nuevo'] == [0, 0, 0, 2]
+        assert data['totals'] == {'contactado': 2, 'en_proceso': 2, 'ganado': 2, 'nuevo': 2, 'propuesta': 2}
+        assert data['cumulative']['nuevo'][-1] == 2
+
+    def test_invalid_parameters(self, logged_in_client):
+        """Test errores de validación"""
+        assert logged_in_client.get('/admin/analytics/timeseries?metric=visits').status_code == 400
+        assert logged_in_client.get('/admin/analytics/timeseries?granularity=minute').status_code == 400
+        assert logged_in_client.get('/admin/analytics/timeseries?start=ayer').status_code == 400
+
+
+class TestLeadFuzzySearch:
+    """Tests para /admin/leads/fuzzy (trigramas)"""
+
+    @pytest.fixture
+    def people(self, app):
+        with app.app_context():
+            leads = [
+                Lead(nombre='María González', email='maria.gonzalez@acme.es', proyecto='Tienda online'),
+                Lead(nombre='Mario Gómez', email='mgomez@taller.com', proyecto='Web corporativa'),
+                Lead(nombre='Pedro Ruiz', email='pedro@ruiz.net', proyecto='Automatización'),
+            ]
+            db.session.add_all(leads)
+            db.session.commit()
+            ids = [lead.id for lead in leads]
+        return ids
+
+    def _names(self, client, query, **params):
+        response = client.get('/admin/leads/fuzzy', query_string={'q': query, **params})
+        assert response.status_code == 200
+        return [lead['nombre'] for lead in response.get_json()['leads']]
+
+    def test_trigrams_like_pg_trgm(self):
+        """Test que los trigramas siguen el formato de pg_trgm"""
+        from app.services.lead_trigrams import trigrams
+
+        assert trigrams('Ana') == {'  a', ' an', 'ana', 'na '}
+        assert trigrams('a.b@c') == {'  a', ' a ', '  b', ' b ', '  c', ' c '}
+
+    def test_fuzzy_tolerates_typos_and_ranks(self, logged_in_client, people):
+        """Test que una errata encuentra el lead y el orden es por parecido"""
+        assert self._names(logged_in_client, 'gonzales')[0] == 'María González'
+        assert self._names(logged_in_client, 'mari') == ['Mario Gómez', 'María González']
+        assert self._names(logged_in_client, 'ruiz.net') == ['Pedro Ruiz']
+
+        data = logged_in_client.get('/admin/leads/fuzzy?q=pedro').get_json()
+        assert data['leads'][0]['score'] == 1.0
+        assert 0 < data['leads'][0]['similarity'] < 1
+
+    def test_fuzzy_threshold(self, logged_in_client, people):
+        """Test que threshold filtra coincidencias débiles y se valida"""
+        assert self._names(logged_in_client, 'gonzales', threshold=0.95) == []
+        assert logged_in_client.get('/admin/leads/fuzzy?q=mari&threshold=2').status_code == 400
+        assert logged_in_client.get('/admin/leads/fuzzy').status_code == 400
+
+    def test_fuzzy_index_follows_commits(self, app, logged_in_client, people):
+        """Test que el índice en memoria recoge altas, cambios, borrados y DML masivo"""
+        with app.app_context():
+            pedro = db.session.get(Lead, people[2])
+            pedro.nombre = 'Pedro Zubizarreta'
+            db.session.commit()
+
+            db.session.add(Lead(nombre='Pedro Descartado', email='x@y.es', proyecto='Nada'))
+            db.session.rollback()
+
+        assert self._names(logged_in_client, 'zubizareta') == ['Pedro Zubizarreta']
+        assert self._names(logged_in_client, 'descartado') == []
+
+        logged_in_client.delete(f'/admin/leads/{people[2]}')
+        assert self._names(logged_in_client, 'zubizarreta') == []
+
+        with app.app_context():
+            db.session.execute(db.update(Lead).where(Lead.id == people[1]).values(nombre='Mario Etxeberria'))
+            db.session.commit()
+
+        assert self._names(logged_in_client, 'etxeberria') == ['Mario Etxeberria']
+
+
+class TestLeadPipeline:
+    """Tests para /admin/leads/pipeline"""
+
+    def _history(self, app, steps):
+        """steps: lista de listas [(estado, días desde el alta)] por lead"""
+        from datetime import datetime, timedelta
+        from app.models import LeadTransition
+
+        with app.app_context():
+            created = datetime.utcnow() - timedelta(days=30)
+            for i, history in enumerate(steps):
+                lead = Lead(nombre=f'Lead {i}', email=f'p{i}@test.com', proyecto='Proyecto de prueba',
+                            created_at=created)
+                db.session.add(lead)
+                db.session.flush()
+                previous = 'nuevo'
+                for estado, day in history:
+                    db.session.add(LeadTransition(lead_id=lead.id, from_estado=previous, to_estado=estado,
+                                                  at=created + timedelta(days=day)))
+                    previous = estado
+            db.session.commit()
+
+    def test_conversion_and_velocity(self, logged_in_client, app):
+        """Test conversión por etapa y días entre estados"""
+        self._history(app, [
+            [('contactado', 1), ('propuesta', 4), ('ganado', 10)],
+            [('contactado', 2), ('en_proceso', 3), ('propuesta', 8)],
+            [('contactado', 1), ('perdido', 2)],
+            [],
+        ])
+
+        data = logged_in_client.get('/admin/leads/pipeline?days=60&from=nuevo&to=propuesta').get_json()
+
+        assert data['leads'] == 4
+        conversion = {step['estado']: step['leads'] for step in data['conversion']}
+        assert conversion['nuevo'] == 4
+        assert conversion['contactado'] == 3
+        assert conversion['propuesta'] == 2
+        assert conversion['ganado'] == 1
+        assert conversion['perdido'] == 1
+        assert data['from_to']['median_days'] == 6.0
+        velocity = {(step['from'], step['to']): step for step in data['velocity']}
+        assert velocity[('nuevo', 'contactado')]['median_days'] == 1.0
+        assert data['time_in_estado']['contactado']['leads'] == 3
+
+    def test_cached_until_lead_changes(self, logged_in_client, app, multiple_leads):
+        """Test que el informe se recalcula al cambiar un lead"""
+        first = logged_in_client.get('/admin/leads/pipeline').get_json()
+        logged_in_client.patch(f'/admin/leads/{multiple_leads[0].id}', json={'estado': 'contactado'})
+        second = logged_in_client.get('/admin/leads/pipeline').get_json()
+
+        contacted = [
+            {step['estado']: step['leads'] for step in report['conversion']}['contactado']
+            for report in (first, second)
+        ]
+        assert contacted[1] == contacted[0] + 1
+
+    def test_invalid_parameters(self, logged_in_client):
+        """Test errores de validación"""
+        assert logged_in_client.get('/admin/leads/pipeline?from=nuevo').status_code == 400
+        assert logged_in_client.get('/admin/leads/pipeline?from=nuevo&to=cerrado').status_code == 400
+        assert logged_in_client.get('/admin/leads/pipeline?start=2026-13-01').status_code == 400
+
+    def test_lead_transitions(self, logged_in_client, sample_lead):
+        """Test historial de estados de un lead"""
+        logged_in_client.patch(f'/admin/leads/{sample_lead.id}', json={'estado': 'contactado'})
+        data = logged_in_client.get(f'/admin/leads/{sample_lead.id}/transitions').get_json()
+        assert [t['to_estado'] for t in data['transitions']] == ['nuevo', 'contactado']
+
+
+class TestAdminCache:
+    """Tests para la cache de agregados invalidada por escrituras"""
+
+    def test_single_flight(self):
+        """Test que los requests concurrentes esperan a un único cálculo"""
+        import threading
+        import time
+        from app.services.admin_cache import AdminCache
+
+        cache = AdminCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'total': 1}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get('stats', ('leads',), compute)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert results == [{'total': 1}] * 10
+
+    def test_invalidation_reaches_other_workers(self, tmp_path):
+        """Test que una invalidación en un worker llega a otro por el fichero SQLite"""
+        from app.services.admin_cache import AdminCache, SQLiteGenerations
+
+        path = str(tmp_path / 'generations.sqlite3')
+        worker_a, worker_b = AdminCache(), AdminCache()
+        worker_a._generations = SQLiteGenerations(path)
+        worker_b._generations = SQLiteGenerations(path)
+
+        values = iter(range(100))
+        assert worker_b.get('stats', ('leads',), lambda: next(values)) == 0
+        assert worker_b.get('stats', ('leads',), lambda: next(values)) == 0
+
+        worker_a.invalidate('newsletter')
+        assert worker_b.get('stats', ('leads',), lambda: next(values)) == 0
+
+        worker_a.invalidate('leads')
+        assert worker_b.get('stats', ('leads',), lambda: next(values)) == 1
+
+    def test_rollback_does_not_invalidate(self, app):
+        """Test que una transacción deshecha no sube la generación"""
+        from app.services.admin_cache import admin_cache
+
+        with app.app_context():
+            before = admin_cache._generations.read(('leads',))
+            db.session.add(Lead(nombre='Temporal', email='tmp@test.com', proyecto='Proyecto temporal de prueba'))
+            db.session.flush()
+            db.session.rollback()
+            assert admin_cache._generations.read(('leads',)) == before
+
+            db.session.add(Lead(nombre='Real', email='real@test.com', proyecto='Proyecto real de prueba'))
+            db.session.commit()
+            assert admin_cache._generations.read(('leads',)) > before
+
+    def test_ingestion_does_not_invalidate_analytics(self, app, client):
+        """Test que la ingesta no sube la generación de analytics; los rollups sí"""
+        from app.services.admin_cache import admin_cache, TOPIC_ANALYTICS
+        from app.services.analytics_rollup import update_rollups
+
+        with app.app_context():
+            before = admin_cache._generations.read((TOPIC_ANALYTICS,))
+            client.post('/api/analytics/event', json={'event': 'cta_click'})
+            assert admin_cache._generations.read((TOPIC_ANALYTICS,)) == before
+
+            assert update_rollups() == 1
+            assert admin_cache._generations.read((TOPIC_ANALYTICS,)) > before
+
+    def test_redis_url_without_redis_package_fails(self, app, monkeypatch):
+        """Test que REDIS_URL sin el paquete redis falla al arrancar en vez de usar otro almacén"""
+        import sys
+        from app.services.admin_cache import AdminCache
+
+        monkeypatch.setitem(sys.modules, 'redis', None)
+        app.config.update(ADMIN_CACHE_SHARED=True, REDIS_URL='redis://localhost:6379/0')
+        with pytest.raises(RuntimeError):
+            AdminCache(app)
+
@@ -0,0 +1,1699 @@
+"""
+Tests para los servicios de analytics
+"""
+
+import io
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import (
+    AnalyticsCheckpoint, AnalyticsDimension, AnalyticsEvent, AnalyticsEventId, AnalyticsRollupHourly,
+    AnalyticsRollupDaily, AnalyticsSession, AnalyticsSketch, BotTrafficCount, Lead, PageView, PageViewCount,
+)
+from app.services.analytics_buffer import AnalyticsWriteBuffer
+from app.services.analytics_service import insert_events
+from app.services.analytics_spool import AnalyticsSpool, MAGIC, RECORD_HEADER, read_segment
+from app.services.analytics_rollup import update_rollups, event_counts, ROLLUP_CHECKPOINT
+from app.services.analytics_checkpoints import (
+    get_checkpoint, visible_id_bound, COMPACTION_CHECKPOINT, VISIBLE_IDS_SEEN,
+)
+from app.services.analytics_compaction import compact_events, compacted_until, device_counts
+from app.services.sessionizer import update_sessions, session_summary
+from app.services.pageview_counter import PageViewCounter, popular_pages
+from app.services.hyperloglog import HyperLogLog, standard_error
+from app.services.visitor_sketches import VisitorSketches, unique_counts
+from app.services.analytics_export import write_export, stream_export, load_export
+from app.services.funnel import compute_funnel, funnel_report, load_step_events
+from app.services.analytics_dimensions import (
+    DimensionCache, dimension_cache, convert_legacy_columns, classify_stored_user_agents,
+)
+from app.services.user_agent import classify_user_agent, user_agent_cache_info
+from app.services.bot_filter import BotFilter, bot_summary
+from app.services.analytics_sampling import keep_event, parse_sample_rates
+from app.services.analytics_dedupe import EventDeduper, prune_event_ids
+from app.services.bloom_filter import BloomFilter, RotatingBloomFilter
+from app.services.live_stream import LiveStream, live_stream
+from app.services.timeseries import bucket_axis, cumulative, fill_series, rolling_mean, time_series
+from app.services import analytics_partitions
+from app.services.analytics_partitions import (
+    maintain_partitions, list_partitions, partitioned_source, partition_name, add_months, month_start
+)
+
+
+def _event_row(name='cta_click', **kwargs):
+    row = {
+        'event_name': name,
+        'event_data': None,
+        'url': 'https://example.com/',
+        'referrer': '',
+        'session_id': 'sess-1',
+        'ip_address': '127.0.0.1',
+        'user_agent': 'pytest',
+        'utm_source': None,
+        'utm_medium': None,
+        'utm_campaign': None,
+        'timestamp': kwargs.pop('timestamp', None) or datetime.utcnow(),
+    }
+    row.update(kwargs)
+    return row
+
+
+class TestAnalyticsWriteBuffer:
+    """Tests para el buffer write-behind"""
+
+    @pytest.fixture
+    def buffer(self, app):
+        app.config.update(
+            ANALYTICS_BUFFER_MAX_ROWS=3,
+            ANALYTICS_BUFFER_FLUSH_MS=60000,
+            ANALYTICS_BUFFER_MAX_QUEUE=5,
+        )
+        buffer = AnalyticsWriteBuffer(app)
+        yield buffer
+        buffer.stop()
+
+    def test_flush_writes_pending_rows(self, buffer, app):
+        """Test que flush vuelca la cola con un único executemany"""
+        assert buffer.enqueue([_event_row(), _event_row('scroll')]) is True
+        assert buffer.depth == 2
+
+        assert buffer.flush() == 2
+        assert buffer.depth == 0
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 2
+
+        stats = buffer.stats()
+        assert stats['flushed'] == 2
+        assert stats['flushes'] == 1
+        assert stats['last_flush_ms'] is not None
+
+    def test_flush_when_max_rows_reached(self, buffer, app):
+        """Test que al alcanzar N filas el hilo hace flush sin esperar T"""
+        buffer.enqueue([_event_row() for _ in range(3)])
+
+        deadline = time.time() + 5
+        while buffer.depth and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert buffer.depth == 0
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 3
+
+    def test_rejects_when_queue_full(self, buffer):
+        """Test que la cola llena rechaza filas (el llamador escribe síncrono)"""
+        buffer.max_rows = 100  # evitar flush automático
+        assert buffer.enqueue([_event_row() for _ in range(5)]) is True
+        assert buffer.enqueue([_event_row()]) is False
+        assert buffer.stats()['rejected'] == 1
+
+    def test_stop_flushes_pending_rows(self, buffer, app):
+        """Test que stop (worker_exit) vuelca lo pendiente"""
+        buffer.enqueue([_event_row()])
+        buffer.stop()
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 1
+
+
+def _refusing_engine():
+    """Motor SQLite que rechaza todas las conexiones (BD caída)"""
+    def refuse():
+        raise sqlite3.OperationalError('connection refused')
+    return create_engine('sqlite://', creator=refuse)
+
+
+class TestAnalyticsSpool:
+    """Tests para el spool durable en disco"""
+
+    @pytest.fixture
+    def spool(self, app, tmp_path):
+        app.config.update(
+            ANALYTICS_SPOOL_ENABLED=True,
+            ANALYTICS_SPOOL_DIR=str(tmp_path / 'spool'),
+            ANALYTICS_SPOOL_SEGMENT_BYTES=4096,
+            ANALYTICS_SPOOL_REPLAY_SECONDS=3600,
+        )
+        spool = AnalyticsSpool(app)
+        yield spool
+        spool.close()
+
+    def test_append_rotates_fixed_size_segments(self, spool):
+        """Test que los segmentos tienen tamaño fijo y se rotan al llenarse"""
+        spool.append([_event_row(event_data={'i': str(i)}) for i in range(40)])
+
+        segments = spool.pending_segments()
+        assert len(segments) > 1
+        assert all(os.path.getsize(path) == 4096 for path in segments)
+        assert sum(len(read_segment(path)[0]) for path in segments) == 40
+
+    def test_replay_keeps_segments_while_db_down(self, spool, app):
+        """Test que con la BD caída no se pierde ni se borra nada"""
+        spool.append([_event_row(), _event_row('scroll')])
+
+        with pytest.raises(OperationalError):
+            spool.replay(_refusing_engine())
+
+        assert spool.pending_segments()
+
+        with app.app_context():
+            assert spool.replay(db.engine) == 2
+            assert AnalyticsEvent.query.count() == 2
+            event = AnalyticsEvent.query.filter_by(event_name='scroll').first()
+            assert isinstance(event.timestamp, datetime)
+
+        assert spool.pending_segments() == []
+
+    def test_replay_skips_segments_opened_during_replay(self, spool, app, monkeypatch):
+        """Test que un segmento rotado por un append concurrente no se carga ni se borra"""
+        spool.append([_event_row()])
+        replayable_dirs = spool._replayable_dirs
+
+        def replayable_dirs_with_concurrent_append():
+            # Otro hilo escribe y rota justo después de que replay suelte el lock
+            spool.append([_event_row(event_data={'i': str(i)}) for i in range(40)])
+            return replayable_dirs()
+
+        monkeypatch.setattr(spool, '_replayable_dirs', replayable_dirs_with_concurrent_append)
+
+        with app.app_context():
+            assert spool.replay(db.engine) == 1
+        assert sum(len(read_segment(path)[0]) for path in spool.pending_segments()) == 40
+        assert os.path.exists(spool._writer.path)
+
+    def test_crash_recovery_discards_torn_record(self, spool, app):
+        """Test que un registro a medio escribir se descarta al reabrir"""
+        spool.append([_event_row(), _event_row()])
+        path = spool._writer.path
+        offset = spool._writer.offset
+        spool.close()
+
+        # Simular una caída a mitad de escritura: cabecera sin payload válido
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            f.write(RECORD_HEADER.pack(50, 12345) + b'{"event_name":')
+
+        payloads, corrupt = read_segment(path)
+        assert len(payloads) == 2
+        assert corrupt is True
+
+        # Reabrir en el mismo proceso continúa tras el último registro válido
+        spool.append([_event_row('after_crash')])
+        payloads, corrupt = read_segment(path)
+        assert len(payloads) == 3
+        assert corrupt is False
+
+    def test_checksum_detects_corruption(self, spool):
+        """Test que un payload alterado no se carga"""
+        spool.append([_event_row(), _event_row()])
+        path = spool._writer.path
+        spool.close()
+
+        with open(path, 'r+b') as f:
+            f.seek(len(MAGIC) + RECORD_HEADER.size + 2)
+            f.write(b'X')
+
+        payloads, corrupt = read_segment(path)
+        assert payloads == []
+        assert corrupt is True
+
+    def test_persist_events_spools_when_db_unreachable(self, app, client, spool, monkeypatch):
+        """Test que la ingesta responde 202 y usa el spool si la BD falla"""
+        from app.services import analytics_service
+
+        def failing_insert(rows):
+            raise OperationalError('INSERT', {}, sqlite3.OperationalError('connection refused'))
+
+        monkeypatch.setattr(analytics_service, 'analytics_spool', spool)
+        monkeypatch.setattr(analytics_service, 'insert_events', failing_insert)
+
+        response = client.post('/api/analytics/event', json={'event': 'cta_click'})
+
+        assert response.status_code == 202
+        assert spool.healthy is False
+        assert spool.stats()['spooled'] == 1
+
+        # Mientras la BD esté degradada, no se intenta escribir en ella
+        response = client.post('/api/analytics/event', json={'event': 'cta_click'})
+        assert response.status_code == 202
+        assert spool.stats()['spooled'] == 2
+
+    def test_retried_event_is_spooled_when_id_check_fails(self, app, client, spool, monkeypatch):
+        """Test que un reintento (positivo del Bloom filter) con la BD caída va al spool, no da 500"""
+        from app.services import analytics_dedupe, analytics_service
+        from app.services.analytics_dedupe import event_deduper
+
+        monkeypatch.setattr(analytics_service, 'analytics_spool', spool)
+        beacon = {'event': 'cta_click', 'event_id': 'evt-reintento-1'}
+        assert client.post('/api/analytics/event', json=beacon).status_code == 201
+
+        checks = []
+
+        def failing_check(event_ids):
+            checks.append(event_ids)
+            raise OperationalError('SELECT', {}, sqlite3.OperationalError('connection refused'))
+
+        def failing_insert(rows):
+            raise OperationalError('INSERT', {}, sqlite3.OperationalError('connection refused'))
+
+        monkeypatch.setattr(analytics_dedupe, '_stored_ids', failing_check)
+        monkeypatch.setattr(analytics_service, 'insert_events', failing_insert)
+
+        response = client.post('/api/analytics/event', json=beacon)
+        assert response.status_code == 202
+        assert spool.stats()['spooled'] == 1
+        assert event_deduper.stats()['confirm_failed'] == 1
+
+        # Con el spool marcado como no sano ya no se intenta la SELECT
+        response = client.post('/api/analytics/event', json=beacon)
+        assert response.status_code == 202
+        assert len(checks) == 1
+        assert spool.stats()['spooled'] == 2
+
+        # El replay descarta los duplicados reales por analytics_event_ids
+        with app.app_context():
+            spool.replay(db.engine)
+            assert AnalyticsEvent.query.count() == 1
+
+
+def _add_events(specs):
+    """specs: lista de (event_name, timestamp, utm_source)"""
+    insert_events([_event_row(name, timestamp=ts, utm_source=source) for name, ts, source in specs])
+
+
+class TestAnalyticsRollups:
+    """Tests para los rollups incrementales"""
+
+    def test_update_rollups_hourly_and_daily(self, app):
+        """Test que los rollups agregan por hora, día, evento y UTM"""
+        with app.app_context():
+            base = datetime(2026, 1, 10, 9, 15)
+            _add_events([
+                ('cta_click', base, 'google'),
+                ('cta_click', base + timedelta(minutes=30), 'google'),
+                ('cta_click', base + timedelta(hours=2), None),
+                ('form_start', base + timedelta(days=1), 'google'),
+            ])
+
+            assert update_rollups(lag_seconds=0) == 4
+
+            hourly = AnalyticsRollupHourly.query.filter_by(
+                bucket=datetime(2026, 1, 10, 9), event_name='cta_click', utm_source='google'
+            ).one()
+            assert hourly.count == 2
+
+            daily = {
+                (r.bucket, r.event_name, r.utm_source): r.count
+                for r in AnalyticsRollupDaily.query.all()
+            }
+            assert daily == {
+                (datetime(2026, 1, 10), 'cta_click', 'google'): 2,
+                (datetime(2026, 1, 10), 'cta_click', ''): 1,
+                (datetime(2026, 1, 11), 'form_start', 'google'): 1,
+            }
+
+    def test_update_rollups_is_incremental(self, app):
+        """Test que solo se procesan eventos posteriores al high-water mark"""
+        with app.app_context():
+            ts = datetime(2026, 1, 10, 9, 0)
+            _add_events([('scroll', ts, None)] * 3)
+            assert update_rollups(lag_seconds=0) == 3
+            assert update_rollups(lag_seconds=0) == 0
+
+            _add_events([('scroll', ts, None)] * 2)
+            assert update_rollups(lag_seconds=0) == 2
+
+            row = AnalyticsRollupHourly.query.filter_by(event_name='scroll').one()
+            assert row.count == 5
+            assert get_checkpoint(ROLLUP_CHECKPOINT) == db.session.query(db.func.max(AnalyticsEvent.id)).scalar()
+
+    def test_update_rollups_respects_batch_size_and_lag(self, app):
+        """Test que se procesa por lotes y el lag cuenta desde que el id fue visible, no desde el timestamp"""
+        with app.app_context():
+            # Timestamps antiguos, como los de un flush del buffer o un replay del spool
+            old = datetime.utcnow() - timedelta(hours=1)
+            _add_events([('scroll', old, None)] * 5)
+
+            assert update_rollups(lag_seconds=60) == 0  # Recién insertados: aún dentro del lag
+
+            # Pasa el lag: la observación anterior (los 5 ids) se convierte en la cota
+            db.session.execute(db.update(AnalyticsCheckpoint).where(
+                AnalyticsCheckpoint.name == VISIBLE_IDS_SEEN
+            ).values(updated_at=datetime.utcnow() - timedelta(seconds=61)))
+            db.session.commit()
+            _add_events([('scroll', old, None)])
+
+            assert update_rollups(batch_size=2, lag_seconds=60) == 2
+            assert update_rollups(batch_size=10, lag_seconds=60) == 3
+            assert update_rollups(batch_size=10, lag_seconds=60) == 0
+            assert visible_id_bound(60) < db.session.query(db.func.max(AnalyticsEvent.id)).scalar()
+
+    def test_event_counts_matches_raw_counts(self, app):
+        """Test que rollups + bucket abierto dan el mismo resultado que contar filas"""
+        with app.app_context():
+            now = datetime.utcnow()
+            specs = []
+            for minutes in range(0, 10 * 24 * 60, 97):
+                specs.append(('cta_click' if minutes % 2 else 'scroll', now - timedelta(minutes=minutes), None))
+            _add_events(specs)
+            update_rollups(lag_seconds=0)
+
+            # Eventos que llegan después de la última actualización
+            _add_events([('cta_click', now - timedelta(minutes=5), None)] * 3)
+
+            for days in (1, 3, 7):
+                start = now - timedelta(days=days)
+                expected = {}
+                for name, ts, _ in specs + [('cta_click', now - timedelta(minutes=5), None)] * 3:
+                    if ts >= start:
+                        expected[name] = expected.get(name, 0) + 1
+                assert event_counts(start) == expected
+                assert event_counts(start, event_name='scroll') == {'scroll': expected['scroll']}
+
+
+def _add_session_events(specs):
+    """specs: lista de (session_id, event_name, timestamp, url, utm_source)"""
+    insert_events([
+        _event_row(name, session_id=session_id, timestamp=ts, url=url, utm_source=source)
+        for session_id, name, ts, url, source in specs
+    ])
+
+
+class TestSessionizer:
+    """Tests para el sessionizer incremental"""
+
+    def test_builds_one_row_per_visit(self, app):
+        """Test que se agrupan eventos por session_id y se parte por inactividad"""
+        with app.app_context():
+            base = datetime(2026, 1, 10, 9, 0)
+            _add_session_events([
+                ('a', 'page_view', base, '/landing', 'google'),
+                ('a', 'cta_click', base + timedelta(minutes=10), '/precios', None),
+                ('a', 'generate_lead', base + timedelta(minutes=20), '/contacto', None),
+                ('a', 'page_view', base + timedelta(hours=3), '/blog', 'newsletter'),
+                ('b', 'page_view', base + timedelta(minutes=5), '/', None),
+                (None, 'scroll', base, '/', None),
+            ])
+
+            assert update_sessions(lag_seconds=0) == 6
+
+            sessions = AnalyticsSession.query.order_by(AnalyticsSession.first_seen).all()
+            assert [(s.session_key, s.event_count) for s in sessions] == [('a', 3), ('b', 1), ('a', 1)]
+
+            first = sessions[0]
+            assert first.landing_url == '/landing'
+            assert first.utm_source == 'google'
+            assert first.last_seen == base + timedelta(minutes=20)
+            assert first.converted is True
+            assert first.converted_at == base + timedelta(minutes=20)
+            assert sessions[2].utm_source == 'newsletter'
+            assert sessions[2].converted is False
+
+    def test_late_events_extend_and_merge_visits(self, app):
+        """Test que un evento tardío actualiza la landing y une visitas"""
+        with app.app_context():
+            app.config['ANALYTICS_SESSION_GAP_MINUTES'] = 30
+            base = datetime(2026, 1, 10, 9, 0)
+            _add_session_events([
+                ('a', 'page_view', base + timedelta(minutes=10), '/precios', None),
+                ('a', 'page_view', base + timedelta(minutes=60), '/blog', None),
+            ])
+            update_sessions(lag_seconds=0)
+            assert AnalyticsSession.query.count() == 2
+
+            # Llega tarde un evento anterior: nueva landing de la primera visita
+            _add_session_events([('a', 'page_view', base, '/landing', 'google')])
+            update_sessions(lag_seconds=0)
+            first = AnalyticsSession.query.order_by(AnalyticsSession.first_seen).first()
+            assert (first.first_seen, first.landing_url, first.utm_source) == (base, '/landing', 'google')
+
+            # Un evento entre ambas las une en una sola visita
+            _add_session_events([('a', 'generate_lead', base + timedelta(minutes=35), '/contacto', None)])
+            update_sessions(lag_seconds=0)
+
+            session = AnalyticsSession.query.one()
+            assert session.event_count == 4
+            assert session.first_seen == base
+            assert session.last_seen == base + timedelta(minutes=60)
+            assert session.landing_url == '/landing'
+            assert session.converted is True
+
+    def test_is_incremental_and_summarizes(self, app):
+        """Test que cada evento se cuenta una vez y el resumen sale de la tabla de sesiones"""
+        with app.app_context():
+            base = datetime.utcnow() - timedelta(hours=2)
+            _add_session_events([
+                ('a', 'page_view', base, '/', 'google'),
+                ('b', 'page_view', base, '/', None),
+            ])
+            assert update_sessions(lag_seconds=0) == 2
+            assert update_sessions(lag_seconds=0) == 0
+
+            _add_session_events([('a', 'generate_lead', base + timedelta(minutes=1), '/contacto', None)])
+            assert update_sessions(lag_seconds=0) == 1
+
+            summary = session_summary(base - timedelta(days=1))
+            assert summary['sessions'] == 2
+            assert summary['converted'] == 1
+            assert summary['conversion_rate'] == 50.0
+            assert summary['avg_events_per_session'] == 1.5
+            assert summary['by_source'][0]['sessions'] == 1
+
+
+def _pageview_row(path, timestamp=None):
+    return {
+        'path': path,
+        'referrer': '',
+        'session_id': 'sess-1',
+        'ip_address': '127.0.0.1',
+        'user_agent': 'pytest',
+        'timestamp': timestamp or datetime.utcnow(),
+    }
+
+
+class TestPageViewCounter:
+    """Tests para el contador de page views en memoria"""
+
+    @pytest.fixture
+    def counter(self, app):
+        app.config.update(PAGEVIEW_COUNTER_ENABLED=True, PAGEVIEW_FLUSH_SECONDS=60, PAGEVIEW_SAMPLE_RATE=0)
+        counter = PageViewCounter(app)
+        yield counter
+        counter.stop()
+        app.config['PAGEVIEW_COUNTER_ENABLED'] = False
+
+    def test_flush_writes_deltas_per_path_and_hour(self, counter, app):
+        """Test que N visitas a una ruta se escriben como una sola fila por hora"""
+        base = datetime(2026, 1, 10, 9, 5)
+        for minutes in (0, 10, 20):
+            assert counter.record(_pageview_row('/precios', base + timedelta(minutes=minutes))) is False
+        counter.record(_pageview_row('/precios', base + timedelta(hours=1)))
+        counter.record(_pageview_row('/'))
+        assert counter.pending == 5
+
+        assert counter.flush() == 5
+        assert counter.pending == 0
+
+        # Un segundo flush suma sobre las filas existentes
+        counter.record(_pageview_row('/precios', base))
+        assert counter.flush() == 1
+
+        with app.app_context():
+            row = PageViewCount.query.filter_by(bucket=datetime(2026, 1, 10, 9), path='/precios').one()
+            assert row.count == 4
+            assert PageViewCount.query.count() == 3
+            assert PageView.query.count() == 0
+
+    def test_sampling_keeps_raw_rows(self, counter, app):
+        """Test que con PAGEVIEW_SAMPLE_RATE=1 se guardan también las filas crudas"""
+        counter.sample_rate = 1.0
+        counter.record(_pageview_row('/'))
+        counter.record(_pageview_row('/blog'))
+        counter.flush()
+
+        with app.app_context():
+            assert PageView.query.count() == 2
+            assert counter.stats()['sampled'] == 2
+
+    def test_failed_flush_keeps_deltas(self, counter, app):
+        """Test que si el flush falla los deltas se reintentan"""
+        counter.record(_pageview_row('/'))
+        with app.app_context():
+            db.drop_all()
+        try:
+            assert counter.flush() == 0
+            assert counter.pending == 1
+        finally:
+            with app.app_context():
+                db.create_all()
+
+        assert counter.flush() == 1
+        assert counter.stats()['failed_flushes'] == 1
+
+    def test_flush_pending_only_when_deferred(self, counter, app):
+        """Test que flush_pending no vuelca nada si las escrituras ya son síncronas"""
+        counter.record(_pageview_row('/'))
+        assert counter.flush_pending() == 1
+
+        app.config['PAGEVIEW_COUNTER_ENABLED'] = False
+        assert counter.record(_pageview_row('/')) is True
+        assert counter.flush_pending() == 0
+
+    def test_forked_worker_starts_empty(self, counter):
+        """Test que tras un fork el hijo no hereda hilo ni deltas del padre"""
+        counter.record(_pageview_row('/'))
+        parent_thread, parent_wakeup = counter._thread, counter._wakeup
+        assert parent_thread.is_alive()
+
+        counter._pid = -1  # como si este proceso fuera el hijo de un fork
+        counter._check_fork()
+        assert counter.pending == 0
+        assert counter._thread is None
+
+        counter.record(_pageview_row('/blog'))
+        assert counter._thread is not parent_thread
+        assert counter.pending == 1
+
+        counter.stop()
+        counter._stopping = True
+        parent_wakeup.set()
+        parent_thread.join(timeout=5)
+        counter._stopping = False
+        assert not parent_thread.is_alive()
+
+    def test_popular_pages(self, app):
+        """Test que el informe ordena las rutas por visitas"""
+        with app.app_context():
+            now = datetime.utcnow()
+            db.session.add_all([
+                PageViewCount(bucket=now.replace(minute=0, second=0, microsecond=0), path='/', count=3),
+                PageViewCount(bucket=now.replace(minute=0, second=0, microsecond=0), path='/blog', count=5),
+                PageViewCount(bucket=datetime(2020, 1, 1), path='/viejo', count=100),
+            ])
+            db.session.commit()
+
+            pages = popular_pages(now - timedelta(days=1))
+            assert pages == [{'path': '/blog', 'views': 5}, {'path': '/', 'views': 3}]
+
+
+class TestHyperLogLog:
+    """Tests para el sketch HyperLogLog"""
+
+    @pytest.mark.parametrize('n', [0, 1, 100, 20000])
+    def test_estimate_within_error_bound(self, n):
+        """Test que el estimado está dentro de 3 errores estándar"""
+        sketch = HyperLogLog().update(f'visitor-{i}' for i in range(n))
+        assert abs(sketch.count() - n) <= max(3 * standard_error() * n, 1)
+
+    def test_merge_is_union_and_idempotent(self):
+        """Test que el merge equivale a la unión y repetir valores no cambia nada"""
+        a = HyperLogLog().update(str(i) for i in range(3000))
+        b = HyperLogLog().update(str(i) for i in range(2000, 5000))
+        union = HyperLogLog.union([a, b, a])
+        direct = HyperLogLog().update(str(i) for i in range(5000))
+        assert union.registers == direct.registers
+
+    def test_serialization_roundtrip(self):
+        """Test que el blob comprimido conserva los registros"""
+        sketch = HyperLogLog().update(['a', 'b', 'c'])
+        blob = sketch.to_bytes()
+        assert len(blob) < 100
+        assert HyperLogLog.from_bytes(blob).registers == sketch.registers
+
+
+class TestVisitorSketches:
+    """Tests para los sketches de únicos por día"""
+
+    @pytest.fixture
+    def sketches(self, app):
+        app.config.update(ANALYTICS_SKETCH_BUFFER_ENABLED=True, ANALYTICS_SKETCH_FLUSH_SECONDS=60)
+        sketches = VisitorSketches(app)
+        yield sketches
+        sketches.stop()
+        app.config['ANALYTICS_SKETCH_BUFFER_ENABLED'] = False
+
+    def test_unique_counts_merge_days(self, sketches, app):
+        """Test que los únicos de un rango unen los sketches de cada día"""
+        day1 = datetime(2026, 1, 10, 12)
+        day2 = day1 + timedelta(days=1)
+        rows = [
+            _event_row('cta_click', timestamp=day1, session_id='s1', ip_address='1.1.1.1'),
+            _event_row('cta_click', timestamp=day1, session_id='s2', ip_address='2.2.2.2'),
+            _event_row('scroll', timestamp=day2, session_id='s1', ip_address='1.1.1.1'),
+            _event_row('scroll', timestamp=day2, session_id='s3', ip_address='1.1.1.1'),
+        ]
+        sketches.add_events(rows)
+        sketches.flush()
+        # Un segundo flush sobre las mismas filas no cambia los únicos
+        sketches.add_events(rows[:1])
+        sketches.flush()
+
+        with app.app_context():
+            result = unique_counts(day1.date(), day2.date())
+            assert (result['visitors'], result['sessions']) == (2, 3)
+            assert [d['sessions'] for d in result['by_day']] == [2, 2]
+
+            by_event = unique_counts(day1.date(), day2.date(), dimension='event', value='scroll')
+            assert (by_event['visitors'], by_event['sessions']) == (1, 2)
+
+            by_path = unique_counts(day1.date(), day2.date(), dimension='path', value='/')
+            assert by_path['sessions'] == 3
+
+    def test_ingestion_updates_sketches(self, client, app):
+        """Test que los endpoints de ingesta alimentan los sketches"""
+        client.post('/api/analytics/event', json={'event': 'cta_click', 'session_id': 'a'})
+        client.post('/api/analytics/pageview', json={'path': '/demo', 'session_id': 'b'})
+
+        with app.app_context():
+            today = datetime.utcnow().date()
+            assert unique_counts(today, today)['sessions'] == 2
+            assert unique_counts(today, today, dimension='path', value='/demo')['sessions'] == 1
+
+    def test_client_values_outside_config_collapse_into_other(self, sketches, app):
+        """Test que event_name y rutas arbitrarios no crean un sketch cada uno"""
+        day = datetime(2026, 1, 10, 12)
+        sketches.add_events([
+            _event_row(f'evento_{i}', timestamp=day, session_id=f's{i}', url=f'https://example.com/x{i}')
+            for i in range(50)
+        ] + [
+            _event_row('cta_click', timestamp=day, session_id='s0', url='https://example.com/blog/post-1'),
+            _event_row('cta_click', timestamp=day, session_id='s1', url='https://example.com/blog/post-2'),
+        ])
+        sketches.flush()
+
+        with app.app_context():
+            values = {(row.dimension, row.value) for row in db.session.query(
+                AnalyticsSketch.dimension, AnalyticsSketch.value
+            ).distinct()}
+            assert values == {
+                ('all', ''), ('event', 'other'), ('event', 'cta_click'), ('path', 'other'), ('path', '/blog/*'),
+            }
+
+            other = unique_counts(day.date(), day.date(), dimension='event', value='evento_7')
+            assert (other['value'], other['sessions']) == ('other', 50)
+            blog = unique_counts(day.date(), day.date(), dimension='path', value='/blog/post-2')
+            assert (blog['value'], blog['sessions']) == ('/blog/*', 2)
+
+
+class TestAnalyticsExport:
+    """Tests para la exportación columnar"""
+
+    def _seed(self):
+        base = datetime(2026, 1, 10, 9)
+        rows = [
+            _event_row('cta_click', timestamp=base + timedelta(minutes=i), utm_source='google' if i % 2 else None,
+                       event_data={'n': str(i)} if i == 3 else None)
+            for i in range(7)
+        ]
+        rows.append(_event_row('scroll', timestamp=base + timedelta(days=5)))
+        insert_events(rows)
+        return base
+
+    def test_export_roundtrip_in_chunks(self, app):
+        """Test que la exportación por bloques se lee con los mismos valores"""
+        with app.app_context():
+            base = self._seed()
+            output = io.BytesIO()
+            total = write_export(output, base, base + timedelta(days=1), chunk_rows=3)
+            assert total == 7
+
+            output.seek(0)
+            columns = load_export(output)
+
+        assert len(columns['id']) == 7
+        assert columns['timestamp'].dtype == np.dtype('datetime64[us]')
+        assert columns['timestamp'][0] == np.datetime64(base)
+        assert list(columns['event_name']) == ['cta_click'] * 7
+        assert list(columns['utm_source'][:3]) == [None, 'google', None]
+        assert columns['event_data'][3] == '{"n": "3"}'
+
+    def test_stream_matches_file(self, app):
+        """Test que el streaming produce un .npz válido"""
+        with app.app_context():
+            base = self._seed()
+            data = b''.join(stream_export(base, base + timedelta(days=10), chunk_rows=2))
+
+        columns = load_export(io.BytesIO(data))
+        assert list(columns['event_name']).count('scroll') == 1
+        assert len(columns['id']) == 8
+
+    def test_empty_range(self, app):
+        """Test que un rango sin eventos da columnas vacías"""
+        with app.app_context():
+            output = io.BytesIO()
+            assert write_export(output, datetime(2020, 1, 1), datetime(2020, 1, 2)) == 0
+            output.seek(0)
+            assert len(load_export(output)['id']) == 0
+
+
+class TestFunnel:
+    """Tests para el embudo vectorizado"""
+
+    def test_compute_funnel_respects_order(self):
+        """Test que un paso solo cuenta si ocurre después del anterior"""
+        # sesión 0: 0 -> 1 -> 2 ; sesión 1: 1 antes de 0 (no avanza) ; sesión 2: 0 -> 1
+        session = np.array([0, 0, 0, 1, 1, 2, 2, 0])
+        step = np.array([0, 1, 2, 1, 0, 0, 1, 0])
+        time = np.array([0.0, 10.0, 40.0, 0.0, 5.0, 100.0, 130.0, 50.0])
+
+        results = compute_funnel(session, step, time, 3)
+
+        assert [count for count, _ in results] == [3, 2, 1]
+        assert results[1][1] == 20.0  # mediana de 10 s y 30 s
+        assert results[2][1] == 30.0
+
+    def test_compute_funnel_empty(self):
+        """Test que sin eventos el embudo está vacío"""
+        empty = np.array([], dtype=np.int64)
+        assert compute_funnel(empty, empty, empty.astype(float), 2) == [(0, None), (0, None)]
+
+    def test_funnel_report_from_events(self, app):
+        """Test del informe leyendo analytics_events"""
+        with app.app_context():
+            base = datetime(2026, 1, 10, 9)
+            _add_session_events([
+                ('a', 'cta_click', base, '/', None),
+                ('a', 'form_start', base + timedelta(seconds=30), '/', None),
+                ('a', 'generate_lead', base + timedelta(seconds=90), '/', None),
+                ('b', 'cta_click', base, '/', None),
+                ('b', 'scroll', base + timedelta(seconds=5), '/', None),
+                (None, 'cta_click', base, '/', None),
+            ])
+
+            report = funnel_report(['cta_click', 'form_start', 'generate_lead'], base, base + timedelta(days=1))
+
+        assert report['sessions_entered'] == 2
+        assert report['sessions_converted'] == 1
+        assert [s['sessions'] for s in report['steps']] == [2, 1, 1]
+        assert report['steps'][1]['conversion_from_previous'] == 50.0
+        assert report['steps'][1]['median_seconds_from_previous'] == 30.0
+        assert report['steps'][2]['conversion_from_start'] == 50.0
+
+    def test_load_step_events_codes_sessions_and_steps(self, app):
+        """Test que la carga devuelve índices de paso, códigos de sesión y segundos epoch"""
+        with app.app_context():
+            base = datetime(2026, 1, 10, 9)
+            _add_session_events([
+                ('a', 'form_start', base, '/', None),
+                ('b', 'cta_click', base + timedelta(seconds=1), '/', None),
+                ('a', 'cta_click', base + timedelta(seconds=2), '/', None),
+                ('b', 'scroll', base + timedelta(seconds=3), '/', None),
+            ])
+
+            session, step, time = load_step_events(['cta_click', 'form_start'], base, base + timedelta(days=1))
+
+        assert session.dtype == np.int64 and step.dtype == np.int64 and time.dtype == np.float64
+        order = np.argsort(time)
+        assert step[order].tolist() == [1, 0, 0]
+        assert session[order][0] == session[order][2] != session[order][1]
+        assert time[order][0] == datetime(2026, 1, 10, 9).replace(tzinfo=timezone.utc).timestamp()
+
+    def test_benchmark_reports_load_and_compute(self, app):
+        """Test que el benchmark mide carga y cálculo sobre los mismos eventos"""
+        from app.services.funnel import benchmark
+
+        with app.app_context():
+            now = datetime.utcnow() - timedelta(hours=1)
+            _add_session_events([
+                ('a', 'cta_click', now, '/', None),
+                ('a', 'form_start', now + timedelta(seconds=10), '/', None),
+            ])
+            report = benchmark(days=1, repeat=2)
+
+        assert report['events'] == 2
+        assert report['load_ms'] >= 0 and report['compute_ms'] >= 0
+        assert report['events_per_second'] > 0
+
+
+def _create_legacy_events_table():
+    """analytics_events como era antes de la codificación con diccionario, con dos filas"""
+    AnalyticsEvent.__table__.drop(db.engine)
+    db.session.execute(db.text(
+        'CREATE TABLE analytics_events (id INTEGER PRIMARY KEY AUTOINCREMENT, event_name VARCHAR(100), '
+        'event_data JSON, url VARCHAR(500), referrer VARCHAR(500), session_id VARCHAR(100), '
+        'ip_address VARCHAR(45), user_agent VARCHAR(500), utm_source VARCHAR(100), '
+        'utm_medium VARCHAR(100), utm_campaign VARCHAR(100), timestamp DATETIME)'
+    ))
+    db.session.execute(db.text(
+        "INSERT INTO analytics_events (event_name, url, referrer, user_agent, timestamp) VALUES "
+        "('cta_click', '/a', '', 'ua-1', '2026-01-10 09:00:00'), "
+        "('scroll', '/a', NULL, 'ua-2', '2026-01-10 09:01:00')"
+    ))
+    db.session.commit()
+
+
+class TestAnalyticsDimensions:
+    """Tests para la codificación con diccionario de url/referrer/user_agent"""
+
+    def test_repeated_strings_stored_once(self, app):
+        """Test que los valores repetidos se guardan una sola vez y se leen en to_dict"""
+        with app.app_context():
+            insert_events([_event_row(url='https://example.com/precios') for _ in range(5)])
+            insert_events([_event_row(url='https://example.com/', user_agent=None)])
+
+            assert AnalyticsDimension.query.filter_by(kind='url').count() == 2
+            assert AnalyticsDimension.query.filter_by(kind='user_agent').count() == 1
+
+            events = AnalyticsEvent.query.order_by(AnalyticsEvent.id).all()
+            assert events[0].to_dict()['url'] == 'https://example.com/precios'
+            assert events[0].user_agent == 'pytest'
+            assert events[-1].user_agent is None
+            assert events[0].url_id == events[4].url_id
+
+    def test_lru_hits_and_eviction(self, app):
+        """Test que la LRU acierta con valores conocidos y respeta su tamaño"""
+        cache = DimensionCache(app)
+        cache.max_size = 4
+        with app.app_context():
+            conn = db.session.connection()
+            first = cache.encode_rows(conn, [_event_row(url='/a')])
+            again = cache.encode_rows(conn, [_event_row(url='/a')])
+            assert first[0]['url_id'] == again[0]['url_id']
+            assert 'url' not in first[0]
+            assert cache.stats()['hits'] == 3  # url, referrer y user_agent
+
+            cache.encode_rows(conn, [_event_row(url=f'/{i}') for i in range(5)])
+            assert cache.stats()['size'] == 4
+            assert cache.stats()['evictions'] > 0
+
+            # Tras la expulsión el valor se vuelve a leer con el mismo id
+            assert cache.encode_rows(conn, [_event_row(url='/a')])[0]['url_id'] == first[0]['url_id']
+
+    def test_failed_insert_clears_cache(self, app):
+        """Test que un INSERT fallido vacía la LRU (los ids nuevos se deshicieron)"""
+        with app.app_context():
+            with pytest.raises(Exception):
+                insert_events([_event_row(url='/nuevo', event_name=None)])
+            db.session.rollback()
+            assert dimension_cache.stats()['size'] == 0
+
+            insert_events([_event_row(url='/nuevo')])
+            assert AnalyticsEvent.query.one().url == '/nuevo'
+
+    def test_convert_legacy_columns(self, app):
+        """Test que una tabla antigua con columnas de texto se convierte"""
+        with app.app_context():
+            _create_legacy_events_table()
+
+            assert convert_legacy_columns() == ['analytics_events']
+            assert convert_legacy_columns() == []
+
+            events = AnalyticsEvent.query.order_by(AnalyticsEvent.id).all()
+            assert [(e.url, e.referrer, e.user_agent) for e in events] == [('/a', '', 'ua-1'), ('/a', None, 'ua-2')]
+            assert AnalyticsDimension.query.filter_by(kind='url').count() == 1
+            assert [e.device_type for e in events] == ['other', 'other']
+
+    def test_up_to_date_table_keeps_the_view(self, app):
+        """Test que sin nada que convertir no se toca la vista <tabla>_all"""
+        with app.app_context():
+            db.session.execute(db.text('CREATE VIEW analytics_events_all AS SELECT * FROM analytics_events'))
+            db.session.commit()
+
+            assert convert_legacy_columns() == []
+            assert 'analytics_events_all' in db.inspect(db.engine).get_view_names()
+
+    def test_startup_converts_legacy_table(self, tmp_path, monkeypatch):
+        """Test que create_app convierte una base anterior y la ingesta vuelve a funcionar"""
+        from app import create_app
+        from config import TestingConfig
+
+        monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'legacy.db'}")
+        legacy = create_app('testing')
+        with legacy.app_context():
+            _create_legacy_events_table()
+            db.engine.dispose()
+
+        app = create_app('testing')
+        with app.app_context():
+            insert_events([_event_row(url='/nuevo')])
+            events = AnalyticsEvent.query.order_by(AnalyticsEvent.id).all()
+            assert [event.url for event in events] == ['/a', '/a', '/nuevo']
+            db.session.remove()
+            db.engine.dispose()
+
+
+CHROME_WINDOWS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/120.0.0.0 Safari/537.36'
+)
+SAFARI_IPHONE = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1'
+)
+
+
+class TestUserAgentClassification:
+    """Tests para la clasificación de User-Agent"""
+
+    @pytest.mark.parametrize('user_agent, expected', [
+        (CHROME_WINDOWS, ('desktop', 'Chrome', 'Windows')),
+        (CHROME_WINDOWS + ' Edg/120.0.0.0', ('desktop', 'Edge', 'Windows')),
+        (SAFARI_IPHONE, ('mobile', 'Safari', 'iOS')),
+        ('Mozilla/5.0 (Linux; Android 12; SM-X200) AppleWebKit/537.36 (KHTML, like Gecko) '
+         'Chrome/119.0 Safari/537.36', ('tablet', 'Chrome', 'Android')),
+        ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:120.0) Gecko/20100101 Firefox/120.0',
+         ('desktop', 'Firefox', 'macOS')),
+        ('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)', ('bot', 'Other', 'Other')),
+        ('', ('other', 'Other', 'Other')),
+    ])
+    def test_classify(self, user_agent, expected):
+        """Test de familias conocidas"""
+        assert tuple(classify_user_agent(user_agent)) == expected
+
+    @pytest.mark.parametrize('user_agent', [
+        'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+        'Mozilla/5.0 (compatible; MJ12bot/v1.4.8; http://mj12bot.com/)',
+        'Mozilla/5.0 (compatible; archive.org_bot +http://archive.org/details/archive.org_bot)',
+        'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)',
+        'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+        'Mozilla/5.0+(compatible; UptimeRobot/2.0; http://www.uptimerobot.com/)',
+        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/120.0.0.0 '
+        'Safari/537.36',
+        'curl/8.4.0',
+    ])
+    def test_known_crawlers_are_bots(self, user_agent):
+        """Test que los crawlers y fetchers conocidos se clasifican como bot"""
+        assert classify_user_agent(user_agent).device_type == 'bot'
+
+    @pytest.mark.parametrize('user_agent', [
+        'Mozilla/5.0 (Linux; Android 9; CUBOT X19) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/83.0.4103.106 Mobile Safari/537.36',
+        'Mozilla/5.0 (Linux; Android 10; CUBOT_X30) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/96.0.4664.104 Mobile Safari/537.36',
+        'Mozilla/5.0 (Linux; Android 11; KingKong 5 Pro Build/RP1A.200720.011) AppleWebKit/537.36 '
+        '(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+        'Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'SamsungBrowser/23.0 Chrome/115.0.0.0 Mobile Safari/537.36',
+        SAFARI_IPHONE,
+    ])
+    def test_mobile_phones_are_not_bots(self, user_agent):
+        """Test que móviles reales (CUBOT incluido) no se descartan como bots"""
+        assert classify_user_agent(user_agent).device_type == 'mobile'
+
+    def test_lru_cache_hits(self):
+        """Test que los User-Agent repetidos salen de la caché"""
+        before = user_agent_cache_info()['hits']
+        for _ in range(3):
+            classify_user_agent(SAFARI_IPHONE + ' test-cache')
+        assert user_agent_cache_info()['hits'] >= before + 2
+
+    def test_ingestion_stores_fields(self, client, app):
+        """Test que la ingesta guarda las columnas derivadas"""
+        client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': SAFARI_IPHONE})
+
+        with app.app_context():
+            event = AnalyticsEvent.query.one()
+            assert (event.device_type, event.browser_family, event.os_family) == ('mobile', 'Safari', 'iOS')
+
+    def test_rows_without_fields_are_classified(self, app):
+        """Test que las filas sin clasificar (p. ej. del spool) se clasifican al insertar"""
+        with app.app_context():
+            insert_events([_event_row(user_agent=CHROME_WINDOWS)])
+            assert AnalyticsEvent.query.one().browser_family == 'Chrome'
+
+    def test_classify_stored_user_agents(self, app):
+        """Test que los leads anteriores a la clasificación se rellenan"""
+        with app.app_context():
+            for column in ('device_type', 'browser_family', 'os_family'):
+                db.session.execute(db.text(f'ALTER TABLE leads DROP COLUMN {column}'))
+            db.session.execute(db.text(
+                "INSERT INTO leads (nombre, email, proyecto, estado, created_at, updated_at, user_agent) "
+                "VALUES ('Ana', 'ana@example.com', 'Web', 'nuevo', '2026-01-10 09:00:00', '2026-01-10 09:00:00', :ua)"
+            ), {'ua': SAFARI_IPHONE})
+            db.session.commit()
+
+            assert classify_stored_user_agents() == ['leads']
+            assert classify_stored_user_agents() == []
+            assert Lead.query.one().to_dict(include_tracking=True)['device_type'] == 'mobile'
+
+    def test_startup_classifies_stored_user_agents(self, tmp_path, monkeypatch):
+        """Test que create_app añade las columnas a leads y refresh_tokens de una base anterior"""
+        from app import create_app
+        from app.models import RefreshToken
+        from config import TestingConfig
+
+        monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'legacy.db'}")
+        legacy = create_app('testing')
+        with legacy.app_context():
+            for table_name in ('leads', 'refresh_tokens'):
+                for column in ('device_type', 'browser_family', 'os_family'):
+                    db.session.execute(db.text(f'ALTER TABLE {table_name} DROP COLUMN {column}'))
+            db.session.execute(db.text(
+                "INSERT INTO leads (nombre, email, proyecto, estado, created_at, updated_at, user_agent) "
+                "VALUES ('Ana', 'ana@example.com', 'Web', 'nuevo', '2026-01-10 09:00:00', '2026-01-10 09:00:00', :ua)"
+            ), {'ua': SAFARI_IPHONE})
+            db.session.commit()
+            db.engine.dispose()
+
+        app = create_app('testing')
+        with app.app_context():
+            assert Lead.query.one().device_type == 'mobile'
+            assert RefreshToken.query.count() == 0
+            db.session.remove()
+            db.engine.dispose()
+
+
+GOOGLEBOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+
+class TestBotFilter:
+    """Tests para el filtro de bots en la ingesta"""
+
+    @pytest.fixture
+    def bot_filter(self, app):
+        app.config.update(BOT_SESSION_MAX_EVENTS=3, BOT_SESSION_WINDOW_SECONDS=60)
+        yield BotFilter(app)
+        app.config.update(BOT_SESSION_MAX_EVENTS=120, BOT_SESSION_WINDOW_SECONDS=60)
+
+    def test_check_reasons(self, bot_filter):
+        """Test de los motivos de descarte"""
+        assert bot_filter.check({'user_agent': GOOGLEBOT}) == 'user_agent'
+        assert bot_filter.check({'user_agent': ''}) == 'empty_user_agent'
+        assert bot_filter.check({'user_agent': SAFARI_IPHONE, 'session_id': 's1'}) is None
+
+    def test_session_rate(self, bot_filter):
+        """Test que una sesión con demasiados eventos en la ventana se descarta"""
+        row = {'user_agent': SAFARI_IPHONE, 'session_id': 's1'}
+        assert [bot_filter.check(row) for _ in range(5)] == [None, None, None, 'session_rate', 'session_rate']
+        assert bot_filter.check({'user_agent': SAFARI_IPHONE, 'session_id': 's2'}) is None
+
+        # Pasada la ventana la sesión vuelve a contar desde cero
+        bot_filter._sessions['s1'][0] -= 61
+        assert bot_filter.check(row) is None
+
+    def test_tracked_sessions_are_bounded(self, bot_filter):
+        """Test que las sesiones vigiladas no crecen sin límite"""
+        bot_filter.max_tracked_sessions = 10
+        for i in range(25):
+            bot_filter.check({'user_agent': SAFARI_IPHONE, 'session_id': f's{i}'})
+        assert len(bot_filter._sessions) == 10
+
+    def test_filter_rows_counts_dropped(self, bot_filter, app):
+        """Test que las filas descartadas se cuentan por tipo y motivo"""
+        rows = [_event_row(user_agent=GOOGLEBOT), _event_row(user_agent=CHROME_WINDOWS), _event_row(user_agent='')]
+        with app.app_context():
+            kept = bot_filter.filter_rows(rows, 'event')
+            assert [row['user_agent'] for row in kept] == [CHROME_WINDOWS]
+            assert BotTrafficCount.query.count() == 2
+
+            summary = bot_summary(datetime.utcnow() - timedelta(days=1))
+            assert summary == {
+                'total': 2,
+                'by_reason': {'user_agent': 1, 'empty_user_agent': 1},
+                'by_kind': {'event': 2},
+            }
+        assert bot_filter.stats()['dropped'] == {'event.user_agent': 1, 'event.empty_user_agent': 1}
+
+    def test_buffered_counts(self, bot_filter, app):
+        """Test que con el acumulador activo los conteos se vuelcan en el flush"""
+        app.config.update(BOT_COUNTER_BUFFER_ENABLED=True, BOT_FLUSH_SECONDS=60)
+        try:
+            for _ in range(3):
+                bot_filter.filter_rows([_event_row(user_agent=GOOGLEBOT)], 'event')
+            assert bot_filter.stats()['pending'] == 3
+
+            assert bot_filter.flush() == 3
+            with app.app_context():
+                assert BotTrafficCount.query.one().count == 3
+        finally:
+            bot_filter.stop()
+            app.config['BOT_COUNTER_BUFFER_ENABLED'] = False
+
+    def test_bots_are_not_stored(self, client, app):
+        """Test que los eventos y page views de bots no se guardan"""
+        response = client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': GOOGLEBOT})
+        assert response.status_code == 202
+        client.post('/api/analytics/pageview', json={'path': '/'}, headers={'User-Agent': GOOGLEBOT})
+        client.post('/api/analytics/event', json={'event': 'cta_click'}, headers={'User-Agent': CHROME_WINDOWS})
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 1
+            assert PageViewCount.query.count() == 0
+            assert {(row.kind, row.count) for row in BotTrafficCount.query} == {('event', 1), ('pageview', 1)}
+
+    def test_check_does_not_reparse_user_agents(self, bot_filter):
+        """Test que check usa el device_type guardado o la LRU, sin analizar el User-Agent en cada evento"""
+        bot_filter.session_max_events = 10 ** 9
+        user_agent = CHROME_WINDOWS + ' check-cache'
+        before = user_agent_cache_info()
+        for _ in range(100):
+            bot_filter.check({'user_agent': user_agent, 'session_id': 's1', 'device_type': 'desktop'})
+        classified = user_agent_cache_info()
+        assert (classified['hits'], classified['misses']) == (before['hits'], before['misses'])
+
+        for _ in range(100):
+            bot_filter.check({'user_agent': user_agent, 'session_id': 's1'})
+        after = user_agent_cache_info()
+        assert after['misses'] == classified['misses'] + 1
+        assert after['hits'] == classified['hits'] + 99
+
+
+class TestAnalyticsSampling:
+    """Tests para el muestreo por event_name"""
+
+    @pytest.fixture
+    def sampled(self, app):
+        app.config['ANALYTICS_SAMPLE_RATES'] = 'scroll=4'
+        yield
+        app.config['ANALYTICS_SAMPLE_RATES'] = ''
+
+    def test_parse_sample_rates(self):
+        """Test del formato de ANALYTICS_SAMPLE_RATES"""
+        assert parse_sample_rates('scroll=10, time_on_page=5,cta_click=1,roto') == {'scroll': 10, 'time_on_page': 5}
+        assert parse_sample_rates('') == {}
+
+    def test_decision_is_per_session(self):
+        """Test que una sesión se conserva entera o no se conserva"""
+        for i in range(50):
+            decisions = {keep_event(f'session-{i}', 4) for _ in range(5)}
+            assert len(decisions) == 1
+        kept = sum(keep_event(f'session-{i}', 4) for i in range(4000))
+        assert 800 < kept < 1200
+
+    def test_weighted_counts(self, client, app, sampled):
+        """Test que los conteos escalan las filas muestreadas por su peso"""
+        app.config['ANALYTICS_ROLLUP_LAG_SECONDS'] = 0
+        sessions = [f'session-{i}' for i in range(40)]
+        kept_sessions = [session_id for session_id in sessions if keep_event(session_id, 4)]
+        for session_id in sessions:
+            client.post('/api/analytics/event', json={'event': 'scroll', 'session_id': session_id})
+            client.post('/api/analytics/event', json={'event': 'cta_click', 'session_id': session_id})
+
+        with app.app_context():
+            assert AnalyticsEvent.query.filter_by(event_name='scroll').count() == len(kept_sessions)
+            assert {e.sample_weight for e in AnalyticsEvent.query.filter_by(event_name='scroll')} == {4}
+
+            start = datetime.utcnow() - timedelta(days=1)
+            # Filas crudas (antes del rollup) y rollups dan el mismo resultado
+            raw = event_counts(start)
+            update_rollups()
+            assert event_counts(start) == raw == {'scroll': 4 * len(kept_sessions), 'cta_click': 40}
+
+            update_sessions()
+            session = AnalyticsSession.query.filter_by(session_key=kept_sessions[0]).one()
+            assert session.event_count == 5
+
+
+class TestBloomFilter:
+    """Tests para el Bloom filter"""
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        """Test que lo añadido siempre está y los falsos positivos rondan la tasa pedida"""
+        bloom = BloomFilter(10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(f'id-{i}')
+        assert all(f'id-{i}' in bloom for i in range(10000))
+        false_positives = sum(f'otro-{i}' in bloom for i in range(10000))
+        assert false_positives < 200
+
+    def test_add_reports_presence(self):
+        """Test que add() indica si el valor ya estaba"""
+        bloom = BloomFilter(100)
+        assert bloom.add('a') is False
+        assert bloom.add('a') is True
+        assert bloom.count == 1
+
+    def test_rotation_keeps_recent_values(self):
+        """Test que al rotar se recuerdan los últimos valores y se olvidan los más viejos"""
+        bloom = RotatingBloomFilter(100, error_rate=0.001)
+        for i in range(250):
+            bloom.add(f'id-{i}')
+        assert bloom.rotations == 2
+        assert all(f'id-{i}' in bloom for i in range(200, 250))
+        assert sum(f'id-{i}' in bloom for i in range(100)) < 5
+
+
+class TestEventDedupe:
+    """Tests para la deduplicación por event_id del cliente"""
+
+    def test_repeated_event_id_is_stored_once(self, client, app):
+        """Test que un reintento con el mismo event_id no se guarda dos veces"""
+        for _ in range(3):
+            response = client.post('/api/analytics/event', json={'event': 'cta_click', 'event_id': 'evt-00000001'})
+            assert response.status_code == 201
+        client.post('/api/analytics/batch', json={'events': [
+            {'event': 'cta_click', 'event_id': 'evt-00000001'},
+            {'event': 'cta_click', 'event_id': 'evt-00000002'},
+            {'event': 'cta_click', 'event_id': 'evt-00000002'},
+            {'event': 'cta_click'},
+        ]})
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 3
+            assert AnalyticsEventId.query.count() == 2
+
+    def test_duplicate_from_other_worker(self, app):
+        """Test que la tabla de ids descarta duplicados que el Bloom filter de este worker no vio"""
+        with app.app_context():
+            assert insert_events([_event_row(client_event_id='evt-00000001')]) == 1
+            assert insert_events([_event_row(client_event_id='evt-00000001'), _event_row()]) == 1
+            assert AnalyticsEvent.query.count() == 2
+
+    def test_bloom_hits_are_confirmed(self, app):
+        """Test que un positivo del Bloom filter solo se descarta si el id está guardado"""
+        with app.app_context():
+            deduper = EventDeduper(app)
+            insert_events([_event_row(client_event_id='evt-guardado')])
+
+            deduper.filter_rows([{'client_event_id': 'evt-guardado'}, {'client_event_id': 'evt-en-vuelo'}])
+            kept = deduper.filter_rows([{'client_event_id': 'evt-guardado'}, {'client_event_id': 'evt-en-vuelo'}])
+
+            assert kept == [{'client_event_id': 'evt-en-vuelo'}]
+            assert deduper.stats()['duplicates'] == 1
+            assert deduper.stats()['unconfirmed'] == 1
+
+    def test_invalid_event_id(self, client):
+        """Test que se rechazan event_id con formato inválido"""
+        response = client.post('/api/analytics/event', json={'event': 'cta_click', 'event_id': 'x y'})
+        assert response.status_code == 400
+
+    def test_prune_event_ids(self, app):
+        """Test que se purgan los ids fuera de la ventana"""
+        with app.app_context():
+            db.session.add_all([
+                AnalyticsEventId(client_event_id='evt-viejo', created_at=datetime.utcnow() - timedelta(days=3)),
+                AnalyticsEventId(client_event_id='evt-nuevo', created_at=datetime.utcnow()),
+            ])
+            db.session.commit()
+
+            assert prune_event_ids(retention_hours=48) == 1
+            assert [row.client_event_id for row in AnalyticsEventId.query] == ['evt-nuevo']
+
+
+class TestLiveStream:
+    """Tests para el ring buffer de contadores en vivo"""
+
+    @pytest.fixture
+    def stream(self, app, tmp_path):
+        app.config.update(LIVE_STREAM_DIR=str(tmp_path / 'live'), LIVE_STREAM_INTERVAL_SECONDS=0)
+        stream = LiveStream(app)
+        yield stream
+        stream.stop()
+        app.config.update(LIVE_STREAM_DIR=None, LIVE_STREAM_INTERVAL_SECONDS=2, LIVE_STREAM_SHARED=False)
+
+    def test_snapshot_counts_by_minute(self, stream):
+        """Test que el snapshot suma eventos por nombre, leads y suscriptores"""
+        stream.record_events([{'event_name': 'cta_click'}, {'event_name': 'cta_click'}, {'event_name': 'scroll'}])
+        stream.record_lead()
+        stream.record_subscriber()
+
+        snapshot = stream.snapshot()
+        assert snapshot['totals'] == {'events': {'cta_click': 2, 'scroll': 1}, 'leads': 1, 'subscribers': 1}
+        assert len(snapshot['minutes']) == 1
+
+    def test_window_drops_old_minutes(self, stream):
+        """Test que el ring buffer no guarda más minutos que la ventana"""
+        stream.window = 5
+        for minute in range(20):
+            with stream._lock:
+                stream._bucket(minute)['leads'] += 1
+        assert list(stream._minutes) == [15, 16, 17, 18, 19]
+
+    def test_snapshot_merges_other_workers(self, stream, app):
+        """Test que con LIVE_STREAM_SHARED se suman los ring buffers publicados por otros workers"""
+        app.config['LIVE_STREAM_SHARED'] = True
+        stream.record_lead()
+
+        other = LiveStream(app)
+        other.record_events([{'event_name': 'cta_click'}])
+        assert other.publish() is True
+        assert other.publish() is False
+        # Mismo proceso en el test: se publica con el nombre de otro worker
+        os.replace(
+            os.path.join(stream.directory, f'worker-{os.getpid()}.json'),
+            os.path.join(stream.directory, 'worker-999999.json'),
+        )
+
+        other.stop()
+
+        snapshot = stream.snapshot()
+        assert snapshot['workers'] == 2
+        assert snapshot['totals']['events'] == {'cta_click': 1}
+        assert snapshot['totals']['leads'] == 1
+
+    def test_stream_yields_sse_messages(self, stream):
+        """Test del formato de los mensajes SSE y del contador de suscriptores"""
+        stream.record_lead()
+        messages = stream.stream(duration=0)
+        assert stream.subscribers == 1
+
+        assert next(messages).startswith('retry: ')
+        event = next(messages)
+        assert event.startswith('event: counters\ndata: ')
+        assert '"leads": 1' in event
+        assert list(messages) == []
+        assert stream.subscribers == 0
+
+    def test_subscriber_cap_is_reserved_atomically(self, stream):
+        """Test que la plaza se reserva al abrir el stream y se libera al cerrarlo sin haberlo leído"""
+        stream.max_subscribers = 2
+        first, second = stream.stream(duration=0), stream.stream(duration=0)
+
+        assert first is not None and second is not None
+        assert stream.stream(duration=0) is None
+
+        first.close()
+        first.close()
+        assert stream.subscribers == 1
+        assert stream.stream(duration=0) is not None
+
+    def test_subscriber_cap_leaves_gunicorn_threads_free(self, app, caplog):
+        """Test que LIVE_STREAM_MAX_SUBSCRIBERS no puede ocupar todos los threads del worker"""
+        app.config.update(GUNICORN_THREADS=8, LIVE_STREAM_MAX_SUBSCRIBERS=20)
+        assert LiveStream(app).max_subscribers == 6
+        assert 'LIVE_STREAM_MAX_SUBSCRIBERS=20' in caplog.text
+
+        app.config['LIVE_STREAM_MAX_SUBSCRIBERS'] = 3
+        assert LiveStream(app).max_subscribers == 3
+
+    def test_ingestion_feeds_ring_buffer(self, client, app):
+        """Test que los eventos recibidos llegan al ring buffer"""
+        app.config['LIVE_STREAM_INTERVAL_SECONDS'] = 0
+        live_stream.interval = 0
+        try:
+            client.post('/api/analytics/event', json={'event': 'cta_click'})
+            assert live_stream.snapshot()['totals']['events'] == {'cta_click': 1}
+        finally:
+            live_stream.interval = 2
+
+
+class TestAnalyticsPartitions:
+    """Tests para particiones mensuales (SQLite: tabla por mes + vista UNION)"""
+
+    def _seed(self, now):
+        specs = []
+        for months_ago in range(4):
+            month = add_months(month_start(now), -months_ago)
+            specs += [('scroll', month + timedelta(days=2), None)] * (months_ago + 1)
+        _add_events(specs)
+        return specs
+
+    def test_closed_months_move_to_partitions(self, app):
+        """Test que los meses cerrados pasan a su tabla y la vista los une"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+
+            report = maintain_partitions(now=now)
+
+            assert len(report['analytics_events']['created']) == 3
+            assert report['analytics_events']['moved_rows'] == 2 + 3 + 4
+            assert len(list_partitions('analytics_events')) == 3
+            # La tabla caliente solo conserva el mes actual
+            assert AnalyticsEvent.query.count() == 1
+            total = db.session.execute(db.text('SELECT count(*) FROM analytics_events_all')).scalar()
+            assert total == 10
+
+    def test_partitioned_source_prunes_by_window(self, app):
+        """Test que una ventana corta solo toca las particiones que solapan"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            maintain_partitions(now=now)
+
+            previous = partition_name('analytics_events', add_months(month_start(now), -1))
+            oldest = partition_name('analytics_events', add_months(month_start(now), -3))
+
+            source = partitioned_source(AnalyticsEvent, month_start(now) - timedelta(days=7))
+            sql = str(db.select(source.c.id).compile(db.engine))
+            assert previous in sql
+            assert oldest not in sql
+
+            # Los conteos no cambian al mover filas a particiones
+            assert event_counts(add_months(month_start(now), -3)) == {'scroll': 10}
+
+    def test_ids_stay_monotonic_after_rotation(self, app):
+        """Test que los ids no se reutilizan al vaciar la tabla caliente"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            max_id = db.session.query(db.func.max(AnalyticsEvent.id)).scalar()
+            db.session.execute(db.delete(AnalyticsEvent))
+            db.session.commit()
+
+            _add_events([('scroll', now, None)])
+            assert AnalyticsEvent.query.one().id > max_id
+
+    def test_unprocessed_rows_stay_in_hot_table(self, app):
+        """Test que no se mueven filas que los jobs incrementales no han leído"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            get_checkpoint(ROLLUP_CHECKPOINT)  # checkpoint en 0
+
+            report = maintain_partitions(now=now)
+            assert report['analytics_events']['moved_rows'] == 0
+
+    def test_retention_drops_whole_partitions(self, app):
+        """Test que la retención elimina particiones completas"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            maintain_partitions(now=now)
+
+            app.config['ANALYTICS_RETENTION_MONTHS'] = 2
+            report = maintain_partitions(now=now)
+
+            assert report['analytics_events']['dropped'] == [
+                partition_name('analytics_events', add_months(month_start(now), -3))
+            ]
+            total = db.session.execute(db.text('SELECT count(*) FROM analytics_events_all')).scalar()
+            assert total == 10 - 4
+
+    def _record_pg_statements(self, monkeypatch, default_rows):
+        """Sustituye db.session.execute por un registro de SQL (el SQL de PostgreSQL no corre en SQLite)"""
+        statements = []
+
+        class Result:
+            def scalar(self):
+                return default_rows
+
+        def execute(statement, params=None):
+            statements.append(str(statement))
+            return Result()
+
+        monkeypatch.setattr(db.session, 'execute', execute)
+        return statements
+
+    def test_pg_partition_created_after_rows_landed_in_default(self, app, monkeypatch):
+        """Test que las filas del mes que estaban en DEFAULT pasan a la partición nueva"""
+        with app.app_context():
+            month = month_start(datetime.utcnow())
+            statements = self._record_pg_statements(monkeypatch, default_rows=5)
+
+            name, moved = analytics_partitions._pg_create_partition('analytics_events', month)
+
+            assert (name, moved) == (partition_name('analytics_events', month), 5)
+            detach, create, insert, delete, attach = statements[1:]
+            assert detach.startswith('ALTER TABLE "analytics_events" DETACH PARTITION "analytics_events_default"')
+            assert create.startswith(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF')
+            assert insert.startswith(f'INSERT INTO "{name}" SELECT * FROM "analytics_events_default"')
+            assert delete.startswith('DELETE FROM "analytics_events_default"')
+            assert attach == 'ALTER TABLE "analytics_events" ATTACH PARTITION "analytics_events_default" DEFAULT'
+
+    def test_pg_partition_without_default_rows_is_a_plain_create(self, app, monkeypatch):
+        """Test que sin filas en DEFAULT solo se crea la partición"""
+        with app.app_context():
+            statements = self._record_pg_statements(monkeypatch, default_rows=0)
+
+            _, moved = analytics_partitions._pg_create_partition('analytics_events', month_start(datetime.utcnow()))
+
+            assert moved == 0
+            assert len(statements) == 2
+            assert 'PARTITION OF' in statements[1]
+
+class TestAnalyticsCompaction:
+    """Tests para la compactación por lotes de eventos antiguos"""
+
+    def _seed(self, now):
+        old = now - timedelta(days=40)
+        _add_events([('scroll', old + timedelta(minutes=i), None) for i in range(5)])
+        _add_events([('cta_click', now - timedelta(days=1), None)])
+        return old
+
+    def test_old_events_are_deleted_in_batches(self, app):
+        """Test que se borran por lotes solo los eventos antiguos y los conteos se mantienen"""
+        with app.app_context():
+            now = datetime.utcnow()
+            old = self._seed(now)
+
+            report = compact_events(now=now, batch_size=2, pause_ms=0)
+
+            assert report['rows'] == 5
+            assert report['batches'] == 3
+            assert report['bytes'] > 0
+            assert [event.event_name for event in AnalyticsEvent.query.all()] == ['cta_click']
+            # Los conteos salen de los rollups
+            assert event_counts(old.replace(minute=0, second=0, microsecond=0)) == {
+                'scroll': 5, 'cta_click': 1,
+            }
+
+    def test_runs_incrementally_from_checkpoint(self, app):
+        """Test que max_batches corta la ejecución y la siguiente continúa"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+
+            first = compact_events(now=now, batch_size=2, max_batches=1, pause_ms=0)
+            assert first['rows'] == 2
+            assert get_checkpoint(COMPACTION_CHECKPOINT) == first['last_id']
+
+            second = compact_events(now=now, batch_size=2, pause_ms=0)
+            assert second['rows'] == 3
+            assert compact_events(now=now, pause_ms=0)['rows'] == 0
+
+    def test_stops_at_first_recent_event(self, app):
+        """Test que no se borra nada por detrás de un evento reciente"""
+        with app.app_context():
+            now = datetime.utcnow()
+            _add_events([
+                ('scroll', now - timedelta(days=40), None),
+                ('scroll', now - timedelta(days=1), None),
+                ('scroll', now - timedelta(days=40), None),
+            ])
+
+            report = compact_events(now=now, pause_ms=0)
+            assert report['rows'] == 1
+            assert AnalyticsEvent.query.count() == 2
+
+    def test_archives_before_deleting(self, app, tmp_path):
+        """Test que cada lote se archiva en un .npz legible"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+
+            report = compact_events(now=now, batch_size=3, archive_dir=str(tmp_path), pause_ms=0)
+
+            assert len(report['archives']) == 2
+            archived = [load_export(path) for path in report['archives']]
+            assert sum(len(columns['id']) for columns in archived) == 5
+            assert set(np.concatenate([columns['event_name'] for columns in archived])) == {'scroll'}
+
+    def test_device_counts_survive_compaction(self, app):
+        """Test que los conteos por dispositivo incluyen los días compactados"""
+        with app.app_context():
+            now = datetime.utcnow()
+            old = now - timedelta(days=40)
+            iphone = {'device_type': 'mobile', 'browser_family': 'Safari', 'os_family': 'iOS'}
+            insert_events([
+                _event_row('scroll', timestamp=old, **iphone),
+                _event_row('scroll', timestamp=old, **iphone),
+                _event_row('scroll', timestamp=old),
+                _event_row('cta_click', timestamp=now - timedelta(days=1), **iphone),
+            ])
+
+            assert compact_events(now=now, pause_ms=0)['rows'] == 3
+
+            totals = {}
+            for device, browser, os_family, count in device_counts(now - timedelta(days=60)):
+                totals[(device, browser, os_family)] = totals.get((device, browser, os_family), 0) + count
+            assert totals == {('mobile', 'Safari', 'iOS'): 3, ('other', 'Other', 'Other'): 1}
+            assert compacted_until() == old.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def test_funnel_window_starts_after_compacted_range(self, app):
+        """Test que el embudo no cuenta de menos en silencio sobre rangos compactados"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            assert funnel_report(['cta_click', 'form_start'], now - timedelta(days=60), now)['compacted_until'] is None
+
+            compact_events(now=now, pause_ms=0)
+
+            report = funnel_report(['cta_click', 'form_start'], now - timedelta(days=60), now)
+            assert report['compacted_until'] == compacted_until().isoformat()
+            assert report['sessions_entered'] == 1
+            assert funnel_report(['cta_click', 'form_start'], now - timedelta(days=2), now)['compacted_until'] is None
+
+    def test_partitions_are_compacted(self, app):
+        """Test que también se borran filas ya movidas a particiones mensuales"""
+        with app.app_context():
+            now = datetime.utcnow()
+            self._seed(now)
+            update_rollups()
+            update_sessions()
+            maintain_partitions(now=now)
+
+            report = compact_events(now=now, pause_ms=0)
+
+            assert report['rows'] == 5
+            total = db.session.execute(db.text('SELECT count(*) FROM analytics_events_all')).scalar()
+            assert total == 1
+
+
+class TestTimeSeries:
+    """Tests para las series temporales con huecos rellenos"""
+
+    def test_bucket_axis(self):
+        """Test que el eje cubre el rango con buckets completos (semanas en lunes)"""
+        start, end = datetime(2026, 1, 7, 10, 30), datetime(2026, 3, 2)
+
+        weeks = bucket_axis(start, end, 'week')
+        assert str(weeks[0]) == '2026-01-05T00:00:00.000000'
+        assert len(weeks) == 8
+        months = bucket_axis(start, end, 'month')
+        assert [str(m)[:10] for m in months] == ['2026-01-01', '2026-02-01', '2026-03-01']
+        assert len(bucket_axis(start, end, 'hour')) == 54 * 24 - 10
+
+    def test_fill_series_and_windows(self):
+        """Test que los buckets sin filas quedan a 0 y las ventanas se calculan por serie"""
+        buckets = bucket_axis(datetime(2026, 1, 1), datetime(2026, 1, 6), 'day')
+        names, matrix = fill_series(buckets, [
+            (datetime(2026, 1, 1), 'b', 2),
+            (datetime(2026, 1, 4), 'a', 3),
+            (datetime(2026, 1, 4), 'a', 1),
+            (datetime(2026, 2, 1), 'a', 9),  # fuera del eje
+        ])
+
+        assert names == ['a', 'b']
+        assert matrix.tolist() == [[0, 0, 0, 4, 0], [2, 0, 0, 0, 0]]
+        assert cumulative(matrix).tolist() == [[0, 0, 0, 4, 4], [2, 2, 2, 2, 2]]
+        assert rolling_mean(matrix, 2).tolist()[0] == [0, 0, 0, 2, 2]
+
+    def test_events_by_name_combines_rollups_and_raw(self, app):
+        """Test que events_by_name suma rollups y filas aún no agregadas"""
+        with app.app_context():
+            app.config['ANALYTICS_ROLLUP_LAG_SECONDS'] = 0
+            base = datetime(2026, 1, 10, 9)
+            _add_events([('cta_click', base, None), ('scroll', base + timedelta(days=2), None)])
+            update_rollups()
+            _add_events([('cta_click', base + timedelta(days=2), None)])
+            app.config['ANALYTICS_ROLLUP_ON_READ'] = False
+
+            result = time_series('events_by_name', 'day', datetime(2026, 1, 10), datetime(2026, 1, 13))
+
+            assert result['buckets'] == ['2026-01-10T00:00:00', '2026-01-11T00:00:00', '2026-01-12T00:00:00']
+            assert result['series'] == {'cta_click': [1, 0, 1], 'scroll': [0, 0, 1]}
+            assert result['totals'] == {'cta_click': 2, 'scroll': 1}
+
+    def test_year_of_daily_buckets_is_one_query(self, app):
+        """Test que un año de datos diarios sale de una sola consulta, sin bucles por bucket"""
+        from sqlalchemy import event
+
+        with app.app_context():
+            end = datetime.utcnow()
+            for i in range(0, 365, 7):
+                db.session.add(Lead(
+                    nombre=f'Lead {i}', email=f'lead{i}@test.com', proyecto='Proyecto de prueba suficiente',
+                    estado='ganado' if i % 2 else 'nuevo', created_at=end - timedelta(days=i),
+                ))
+            db.session.commit()
+
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                result = time_series(
+                    'leads_by_estado', 'day', end - timedelta(days=365), end, cumulative_totals=True, rolling=7,
+                )
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            assert len(statements) == 1
+            assert len(result['buckets']) == 366
+            assert sum(result['totals'].values()) == 53
+            assert result['cumulative']['nuevo'][-1] == result['totals']['nuevo']
+
+    def test_invalid_parameters(self, app):
+        """Test que métrica, granularidad y rango se validan"""
+        with app.app_context():
+            start, end = datetime(2026, 1, 1), datetime(2026, 2, 1)
+            with pytest.raises(ValueError):
+                time_series('visits', 'day', start, end)
+            with pytest.raises(ValueError):
+                time_series('leads', 'minute', start, end)
+            with pytest.raises(ValueError):
+                time_series('leads', 'day', end, start)
+            app.config['TIMESERIES_MAX_BUCKETS'] = 10
+            with pytest.raises(ValueError):
+                time_series('leads', 'day', start, end)
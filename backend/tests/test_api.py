@@ -4,7 +4,7 @@ Tests para la API pública
 
 import pytest
 from app import db
-from app.models import Lead, NewsletterSubscriber
+from app.models import Lead, NewsletterSubscriber, AnalyticsEvent
 
 # Las fixtures app y client ahora vienen de conftest.py
 
@@ -100,6 +100,147 @@ class TestNewsletterAPI:
         assert response.status_code == 400
 
 
+class TestAnalyticsAPI:
+    """Tests para ingesta de eventos de analytics"""
+
+    def test_track_event(self, client, app):
+        """Test registrar un evento"""
+        response = client.post('/api/analytics/event', json={
+            'event': 'cta_click',
+            'data': {'cta_name': 'hero'},
+            'session_id': 'sess-1',
+        })
+
+        assert response.status_code == 201
+        with app.app_context():
+            assert AnalyticsEvent.query.filter_by(event_name='cta_click').count() == 1
+
+    def test_track_event_requires_name(self, client):
+        """Test que el nombre del evento es obligatorio"""
+        response = client.post('/api/analytics/event', json={'data': {}})
+
+        assert response.status_code == 400
+
+    def test_batch_accepts_and_rejects_per_event(self, client, app):
+        """Test batch con eventos válidos e inválidos"""
+        response = client.post('/api/analytics/batch', json={
+            'events': [
+                {'event': 'form_start', 'session_id': 'sess-1'},
+                {'data': {'sin': 'nombre'}},
+                {'event': 'generate_lead', 'session_id': 'sess-1', 'utm_source': 'google'},
+                'no-es-un-objeto',
+            ]
+        })
+
+        assert response.status_code == 201
+        data = response.get_json()
+        assert data['accepted'] == 2
+        assert data['rejected'] == 2
+        assert [r['accepted'] for r in data['results']] == [True, False, True, False]
+        assert data['results'][1]['error']
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 2
+            lead_event = AnalyticsEvent.query.filter_by(event_name='generate_lead').first()
+            assert lead_event.utm_source == 'google'
+            assert lead_event.timestamp is not None
+
+    def test_batch_rejects_badly_typed_fields_per_event(self, client, app):
+        """Test que un campo de texto con otro tipo rechaza solo ese evento"""
+        response = client.post('/api/analytics/batch', json={
+            'events': [
+                {'event': 'form_start', 'session_id': 'sess-1', 'url': '/contacto'},
+                {'event': 'scroll', 'url': 5},
+                {'event': 'scroll', 'session_id': ['x']},
+                {'event': 'cta_click', 'referrer': None},
+            ]
+        })
+
+        assert response.status_code == 201
+        data = response.get_json()
+        assert [r['accepted'] for r in data['results']] == [True, False, False, True]
+        assert data['results'][1]['error'] == 'Invalid url'
+        assert data['results'][2]['error'] == 'Invalid session_id'
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 2
+
+    def test_pageview_rejects_badly_typed_fields(self, client):
+        """Test que la page view con session_id no string da 400, no 500"""
+        response = client.post('/api/analytics/pageview', json={'path': '/', 'session_id': {'a': 1}})
+
+        assert response.status_code == 400
+
+    def test_batch_requires_list(self, client):
+        """Test que el batch requiere una lista no vacía"""
+        assert client.post('/api/analytics/batch', json={'events': []}).status_code == 400
+        assert client.post('/api/analytics/batch', json={'event': 'x'}).status_code == 400
+
+    def test_batch_max_events(self, client):
+        """Test límite de eventos por batch"""
+        from app.routes.api import MAX_BATCH_EVENTS
+
+        events = [{'event': 'scroll'} for _ in range(MAX_BATCH_EVENTS + 1)]
+        response = client.post('/api/analytics/batch', json={'events': events})
+
+        assert response.status_code == 400
+
+    def test_batch_max_bytes(self, client):
+        """Test límite de tamaño del batch"""
+        from app.routes.api import MAX_BATCH_BYTES
+
+        events = [{'event': 'scroll', 'data': {'x': 'a' * MAX_BATCH_BYTES}}]
+        response = client.post('/api/analytics/batch', json={'events': events})
+
+        assert response.status_code == 413
+
+
+class TestAnalyticsWriteBehind:
+    """Tests para la ingesta con buffer write-behind"""
+
+    def test_track_event_buffered_returns_202(self, client, app):
+        """Test que con buffer activo se responde 202 y se escribe al hacer flush"""
+        from app.services.analytics_buffer import analytics_buffer
+
+        app.config['ANALYTICS_BUFFER_ENABLED'] = True
+        try:
+            response = client.post('/api/analytics/event', json={'event': 'cta_click'})
+            assert response.status_code == 202
+
+            response = client.post('/api/analytics/batch', json={
+                'events': [{'event': 'scroll'}, {'event': 'scroll'}]
+            })
+            assert response.status_code == 202
+        finally:
+            analytics_buffer.stop()
+            app.config['ANALYTICS_BUFFER_ENABLED'] = False
+
+        with app.app_context():
+            assert AnalyticsEvent.query.count() == 3
+
+
+class TestPageViewAPI:
+    """Tests para la ingesta de page views"""
+
+    def test_track_pageview(self, client, app):
+        """Test que se cuenta la ruta sin query string"""
+        from app.models import PageViewCount
+
+        response = client.post('/api/analytics/pageview', json={'path': '/precios?utm_source=x#plan'})
+        assert response.status_code == 201
+
+        client.post('/api/analytics/pageview', json={'path': '/precios'})
+
+        with app.app_context():
+            row = PageViewCount.query.one()
+            assert (row.path, row.count) == ('/precios', 2)
+
+    def test_track_pageview_requires_path(self, client):
+        """Test que se rechaza una ruta vacía o absoluta"""
+        assert client.post('/api/analytics/pageview', json={}).status_code == 400
+        assert client.post('/api/analytics/pageview', json={'path': 'https://x.com/'}).status_code == 400
+
+
 class TestConfigAPI:
     """Tests para configuración pública"""
 
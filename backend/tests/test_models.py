@@ -6,7 +6,7 @@ import pytest
 from datetime import datetime, timedelta
 
 from app import db
-from app.models import User, Lead, NewsletterSubscriber, RefreshToken
+from app.models import User, Lead, LeadTransition, NewsletterSubscriber, RefreshToken
 
 
 class TestUserModel:
@@ -168,6 +168,127 @@ class TestLeadModel:
                 assert lead is not None
 
 
+class TestLeadTransitions:
+    """Tests para el historial de estados (lead_transitions)"""
+
+    def _lead(self, **kwargs):
+        lead = Lead(nombre='Test', email='t@test.com', proyecto='Proyecto de prueba', **kwargs)
+        db.session.add(lead)
+        db.session.commit()
+        return lead
+
+    def test_creation_and_changes_are_logged(self, app):
+        """Test que el alta y cada cambio de estado añaden una transición"""
+        with app.app_context():
+            lead = self._lead()
+            lead.estado = 'contactado'
+            db.session.commit()
+            lead.notas = 'Sin cambio de estado'
+            db.session.commit()
+            lead.estado = 'contactado'
+            db.session.commit()
+            lead.marcar_contactado()
+
+            assert [(t.from_estado, t.to_estado) for t in lead.transitions] == [
+                (None, 'nuevo'), ('nuevo', 'contactado'),
+            ]
+
+    def test_rollback_discards_transition(self, app):
+        """Test que la transición va en la misma transacción que el cambio"""
+        with app.app_context():
+            lead = self._lead()
+            lead.estado = 'ganado'
+            db.session.flush()
+            db.session.rollback()
+
+            assert LeadTransition.query.count() == 1
+            assert db.session.get(Lead, lead.id).estado == 'nuevo'
+
+    def test_backfill_for_existing_leads(self, app):
+        """Test que el backfill crea el historial mínimo de leads antiguos"""
+        from app.services.lead_pipeline import backfill_transitions
+
+        with app.app_context():
+            created = datetime.utcnow() - timedelta(days=10)
+            db.session.execute(Lead.__table__.insert(), [{
+                'nombre': 'Antiguo', 'email': 'old@test.com', 'proyecto': 'Proyecto antiguo',
+                'estado': 'propuesta', 'created_at': created, 'updated_at': created + timedelta(days=5),
+                'contacted_at': created + timedelta(days=1),
+            }])
+            db.session.commit()
+
+            assert backfill_transitions() == 1
+            assert backfill_transitions() == 0
+            lead = Lead.query.one()
+            assert [(t.from_estado, t.to_estado) for t in lead.transitions] == [
+                (None, 'nuevo'), ('nuevo', 'contactado'), ('contactado', 'propuesta'),
+            ]
+
+
+class TestLeadSerializer:
+    """Tests para la serialización de listados (lead_serializer)"""
+
+    def _leads(self, admin_user):
+        now = datetime.utcnow()
+        leads = [
+            Lead(nombre='Sin asignar', email='a@test.com', proyecto='Proyecto A',
+                 created_at=now - timedelta(days=3)),
+            Lead(nombre='Asignado', email='b@test.com', proyecto='Proyecto B', estado='contactado',
+                 contacted_at=now - timedelta(days=5), assigned_to_id=admin_user.id),
+            Lead(nombre='Estado raro', email='c@test.com', proyecto='Proyecto C', estado='archivado'),
+        ]
+        db.session.add_all(leads)
+        db.session.commit()
+        return leads
+
+    def test_same_output_as_to_dict(self, app, admin_user):
+        """Test que serialize_rows produce lo mismo que to_dict()"""
+        from app.services.lead_serializer import project, serialize_rows
+
+        with app.app_context():
+            self._leads(admin_user)
+            query = Lead.query.order_by(Lead.id)
+            expected = [lead.to_dict() for lead in query.all()]
+
+            assert serialize_rows(project(query).all()) == expected
+            assert expected[1]['assigned_to'] == 'Admin Test'
+            assert expected[2]['estado_display'] == 'archivado'
+
+    def test_single_query_per_page(self, app, admin_user):
+        """Test que el listado no hace una consulta por lead asignado"""
+        from sqlalchemy import event
+        from app.services.lead_serializer import project, serialize_rows
+
+        with app.app_context():
+            self._leads(admin_user)
+            db.session.expunge_all()
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                items = serialize_rows(project(Lead.query.order_by(Lead.id)).all())
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            assert len(items) == 3
+            assert len(statements) == 1
+
+    def test_benchmark_reports_rates(self, app, admin_user):
+        """Test que el benchmark mide ambos caminos sobre los mismos leads"""
+        from app.services.lead_serializer import benchmark
+
+        with app.app_context():
+            self._leads(admin_user)
+            report = benchmark(limit=2, repeat=3)
+
+            assert report['rows'] == 6
+            assert report['to_dict_rows_per_second'] > 0
+            assert report['fast_rows_per_second'] > 0
+
+
 class TestRefreshTokenModel:
     """Tests para el modelo RefreshToken"""
 
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, createContext, useContext } from 'react';
 import { Cookie, Settings, X } from 'lucide-react';
-import { initGA4, initMetaPixel, saveUTMParams } from '../../utils/analytics';
+import { initGA4, initMetaPixel, initServerAnalytics, saveUTMParams } from '../../utils/analytics';
 
 const CookieConsentContext = createContext();
 
@@ -169,6 +169,7 @@ export const CookieConsentProvider = ({ children }) => {
   useEffect(() => {
     if (consent?.analytics) {
       initGA4();
+      initServerAnalytics();
     }
     if (consent?.marketing) {
       initMetaPixel();
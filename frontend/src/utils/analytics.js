@@ -10,9 +10,19 @@
 const GA_MEASUREMENT_ID = 'G-XXXXXXXXXX'; // Reemplazar con tu ID de GA4
 const META_PIXEL_ID = '000000000000000'; // Reemplazar con tu Pixel ID
 
+import { trackEventsBatch, trackPageView } from './api';
+
 // Estado de inicialización
 let gaInitialized = false;
 let metaInitialized = false;
+let serverInitialized = false;
+
+// Cola de eventos para el backend (se envía en batch a /api/analytics/batch)
+const SERVER_BATCH_ENDPOINT = '/api/analytics/batch';
+const SERVER_QUEUE_MAX = 20; // Debe ser <= MAX_BATCH_EVENTS del backend
+const SERVER_FLUSH_INTERVAL_MS = 5000;
+let serverQueue = [];
+let serverFlushTimer = null;
 
 /**
  * Inicializa Google Analytics 4
@@ -63,9 +73,105 @@ export function initMetaPixel() {
 }
 
 /**
- * Trackea un evento en GA4
+ * Obtiene (o genera) el ID de sesión para el backend
+ */
+function getSessionId() {
+  let sessionId = sessionStorage.getItem('analytics_session_id');
+  if (!sessionId) {
+    sessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    sessionStorage.setItem('analytics_session_id', sessionId);
+  }
+  return sessionId;
+}
+
+/**
+ * Id único por evento: el backend descarta los repetidos (reintentos, sendBeacon)
+ */
+export function newEventId() {
+  if (window.crypto && window.crypto.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+/**
+ * Envía la cola de eventos al backend en una sola petición.
+ * Con useBeacon=true usa navigator.sendBeacon (cierre de página).
+ */
+export function flushServerEvents({ useBeacon = false } = {}) {
+  if (serverFlushTimer) {
+    clearTimeout(serverFlushTimer);
+    serverFlushTimer = null;
+  }
+  if (serverQueue.length === 0) return;
+
+  const events = serverQueue;
+  serverQueue = [];
+
+  if (useBeacon && navigator.sendBeacon) {
+    const blob = new Blob([JSON.stringify({ events })], { type: 'application/json' });
+    navigator.sendBeacon(SERVER_BATCH_ENDPOINT, blob);
+    return;
+  }
+
+  trackEventsBatch(events).catch(() => {
+    // Analytics nunca debe romper la página
+  });
+}
+
+/**
+ * Añade un evento a la cola del backend
+ */
+function queueServerEvent(eventName, params = {}) {
+  if (!serverInitialized) return;
+
+  const utm = getSavedUTMParams();
+  serverQueue.push({
+    event: eventName,
+    event_id: newEventId(),
+    data: params,
+    url: window.location.href,
+    referrer: document.referrer,
+    session_id: getSessionId(),
+    utm_source: utm.utm_source,
+    utm_medium: utm.utm_medium,
+    utm_campaign: utm.utm_campaign,
+  });
+
+  if (serverQueue.length >= SERVER_QUEUE_MAX) {
+    flushServerEvents();
+  } else if (!serverFlushTimer) {
+    serverFlushTimer = setTimeout(flushServerEvents, SERVER_FLUSH_INTERVAL_MS);
+  }
+}
+
+/**
+ * Activa el envío de eventos al backend propio
+ */
+export function initServerAnalytics() {
+  if (serverInitialized) return;
+
+  // Vaciar la cola al ocultar/cerrar la página
+  window.addEventListener('pagehide', () => flushServerEvents({ useBeacon: true }));
+  document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+      flushServerEvents({ useBeacon: true });
+    }
+  });
+
+  serverInitialized = true;
+
+  trackPageView(window.location.pathname, getSessionId()).catch(() => {
+    // Analytics nunca debe romper la página
+  });
+}
+
+/**
+ * Trackea un evento en GA4 (y lo encola para el backend)
  */
 export function trackEvent(eventName, params = {}) {
+  queueServerEvent(eventName, params);
+
   if (!gaInitialized || !window.gtag) return;
 
   window.gtag('event', eventName, {
@@ -216,6 +322,8 @@ export function getSavedUTMParams() {
 export default {
   initGA4,
   initMetaPixel,
+  initServerAnalytics,
+  flushServerEvents,
   trackEvent,
   trackMetaEvent,
   ConversionEvents,
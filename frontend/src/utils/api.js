@@ -82,12 +82,14 @@ export async function getConfig() {
 
 /**
  * Registrar evento de analytics
+ * (eventId opcional: reutilizarlo en los reintentos evita duplicados)
  */
-export async function trackEvent(eventName, eventData = {}) {
+export async function trackEvent(eventName, eventData = {}, eventId = undefined) {
   return request('/analytics/event', {
     method: 'POST',
     body: JSON.stringify({
       event: eventName,
+      event_id: eventId,
       data: eventData,
       timestamp: new Date().toISOString(),
       url: window.location.href,
@@ -96,9 +98,35 @@ export async function trackEvent(eventName, eventData = {}) {
   });
 }
 
+/**
+ * Registrar varios eventos de analytics en una sola petición
+ */
+export async function trackEventsBatch(events) {
+  return request('/analytics/batch', {
+    method: 'POST',
+    body: JSON.stringify({ events }),
+  });
+}
+
+/**
+ * Registrar una page view (contador por ruta en el backend)
+ */
+export async function trackPageView(path, sessionId) {
+  return request('/analytics/pageview', {
+    method: 'POST',
+    body: JSON.stringify({
+      path,
+      referrer: document.referrer,
+      session_id: sessionId,
+    }),
+  });
+}
+
 export default {
   submitContact,
   subscribeNewsletter,
   getConfig,
   trackEvent,
+  trackEventsBatch,
+  trackPageView,
 };